@@ -1,14 +1,17 @@
 """
 Authentication API endpoints.
 """
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.config import get_settings
 from app.core.security import (
-    verify_password,
+    verify_and_update_password,
     get_password_hash,
     create_access_token,
     decode_token,
@@ -29,7 +32,7 @@ settings = get_settings()
 
 
 @router.post("/login", response_model=TokenResponse)
-async def login(
+def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -44,13 +47,23 @@ async def login(
     # Find user by username
     user = db.query(User).filter(User.username == form_data.username).first()
     
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if user:
+        is_valid, new_hash = verify_and_update_password(form_data.password, user.password_hash)
+    else:
+        is_valid, new_hash = False, None
+    
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade legacy bcrypt hashes to argon2id on successful login
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+    
     if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -68,18 +81,17 @@ async def login(
         expires_delta=access_token_expires
     )
     
-    from datetime import datetime
-    expires_at = datetime.utcnow() + access_token_expires
+    expires_at = datetime.now(timezone.utc) + access_token_expires
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_at=expires_at
-    )
+    return ORJSONResponse(content={
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_at": expires_at,
+    })
 
 
 @router.post("/refresh", response_model=TokenResponse)
-async def refresh_token(
+def refresh_token(
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -99,18 +111,17 @@ async def refresh_token(
         expires_delta=access_token_expires
     )
     
-    from datetime import datetime
-    expires_at = datetime.utcnow() + access_token_expires
+    expires_at = datetime.now(timezone.utc) + access_token_expires
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_at=expires_at
-    )
+    return ORJSONResponse(content={
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_at": expires_at,
+    })
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(
+def register_user(
     user_data: UserCreate,
     db: Session = Depends(get_db)
 ):
@@ -122,24 +133,7 @@ async def register_user(
     - **email**: Optional email address
     - **role**: User role (default: "user")
     """
-    # Check if username already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="El nombre de usuario ya existe"
-        )
-    
-    # Check if email already exists (if provided)
-    if user_data.email:
-        existing_email = db.query(User).filter(User.email == user_data.email).first()
-        if existing_email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El email ya está registrado"
-            )
-    
-    # Create new user
+    # Create new user; uniqueness of username and email is enforced by the database
     new_user = User(
         username=user_data.username,
         password_hash=get_password_hash(user_data.password),
@@ -148,14 +142,30 @@ async def register_user(
     )
     
     db.add(new_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Driver messages name the failed constraint differently, so ask which
+        # value is taken; this only runs when the insert was rejected
+        if db.query(exists().where(User.username == user_data.username)).scalar():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El nombre de usuario ya existe"
+            )
+        if user_data.email and db.query(exists().where(User.email == user_data.email)).scalar():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El email ya está registrado"
+            )
+        raise
     db.refresh(new_user)
     
     return new_user
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(
+def get_current_user_info(
     current_user: User = Depends(get_current_user)
 ):
     """
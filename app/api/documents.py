@@ -1,110 +1,285 @@
 """
 Document Analysis API endpoints.
 """
+import asyncio
 import uuid
-import json
 from datetime import datetime
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, List, Optional, Tuple
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, UploadFile, File, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
 
-from app.core.database import get_db
+from app.core.database import get_db, SessionLocal
 from app.core.config import get_settings
 from app.core.security import require_role, get_current_user
-from app.models.models import User, Document, InvoiceData, InfoData
-from app.services.s3_service import get_s3_service
+from app.models.models import User, Document, InvoiceData, InfoData, EventLog
+from app.services.s3_service import S3Service, get_s3_service
 from app.services.document_service import get_document_service
 from app.services.event_service import get_event_service
 from app.schemas.schemas import (
+    DocumentRegisterRequest,
     DocumentResponse,
     DocumentListResponse,
-    InvoiceDataBase,
-    InfoDataBase,
-    InvoiceProduct,
+    DocumentUploadUrlRequest,
+    DocumentUploadUrlResponse,
     MessageResponse,
 )
 
 router = APIRouter(prefix="/documents", tags=["Document Analysis"])
 settings = get_settings()
 
+# Stateless services shared by all requests; S3 is resolved lazily since its first use checks the bucket
+event_service = get_event_service()
+document_service = get_document_service()
+
+# Uploads kept for background analysis stay in memory up to this size, then go to disk
+ANALYSIS_SPOOL_MAX_BYTES = 1024 * 1024
+
+# Columns returned by list_documents, selected directly instead of full ORM rows
+_LIST_COLUMNS = (
+    Document.id,
+    Document.filename,
+    Document.original_filename,
+    Document.document_type,
+    Document.analysis_status,
+    Document.file_size,
+    Document.created_at,
+)
+
+
+def _get_owned_document(db: Session, document_id: int, user_id: int, *options) -> Document:
+    """
+    Fetch a document owned by the user or raise 404.
+    
+    Every endpoint goes through the same parameterized statement, so it is
+    compiled once and served from SQLAlchemy's statement cache afterwards.
+    """
+    document = db.query(Document).options(*options).filter(
+        Document.id == document_id,
+        Document.user_id == user_id
+    ).first()
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Documento no encontrado"
+        )
+    
+    return document
+
+
+def _validate_extension(filename: Optional[str]) -> str:
+    """Return the lowercase extension of a document filename or raise 400."""
+    if not filename:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El nombre del archivo es requerido"
+        )
+    
+    file_ext = filename.rsplit(".", 1)[-1].lower()
+    if file_ext not in settings.document_allowed_extensions_list:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Extensión no permitida. Permitidas: {settings.document_allowed_extensions}"
+        )
+    
+    return file_ext
+
+
+def _new_document_key(user_id: int, file_ext: str) -> Tuple[str, str]:
+    """Generate a unique stored filename and the S3 key it is kept under."""
+    unique_id = str(uuid.uuid4())
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    filename = f"{timestamp}_{unique_id}.{file_ext}"
+    return filename, f"documents/{user_id}/{filename}"
+
 
 def _build_document_response(
     doc: Document,
     s3_url: str,
     invoice_data: Optional[InvoiceData] = None,
     info_data: Optional[InfoData] = None
-) -> DocumentResponse:
-    """Build document response from model."""
-    invoice_data_schema = None
-    info_data_schema = None
+) -> dict:
+    """Build the document response payload from the models."""
+    invoice_payload = None
+    info_payload = None
     
     if invoice_data:
-        products = []
-        if invoice_data.products_json:
-            try:
-                products_raw = json.loads(invoice_data.products_json)
-                products = [InvoiceProduct(**p) for p in products_raw]
-            except (json.JSONDecodeError, TypeError):
-                pass
-        
-        invoice_data_schema = InvoiceDataBase(
-            client_name=invoice_data.client_name,
-            client_address=invoice_data.client_address,
-            provider_name=invoice_data.provider_name,
-            provider_address=invoice_data.provider_address,
-            invoice_number=invoice_data.invoice_number,
-            invoice_date=invoice_data.invoice_date,
-            invoice_total=invoice_data.invoice_total,
-            currency=invoice_data.currency,
-            products=products
-        )
+        invoice_payload = {
+            "client_name": invoice_data.client_name,
+            "client_address": invoice_data.client_address,
+            "provider_name": invoice_data.provider_name,
+            "provider_address": invoice_data.provider_address,
+            "invoice_number": invoice_data.invoice_number,
+            "invoice_date": invoice_data.invoice_date,
+            "invoice_total": invoice_data.invoice_total,
+            "currency": invoice_data.currency,
+            "products": invoice_data.products_json or [],
+        }
     
     if info_data:
-        key_topics = []
-        if info_data.key_topics_json:
-            try:
-                key_topics = json.loads(info_data.key_topics_json)
-            except json.JSONDecodeError:
-                pass
-        
-        info_data_schema = InfoDataBase(
-            description=info_data.description,
-            summary=info_data.summary,
-            sentiment=info_data.sentiment,
-            sentiment_score=info_data.sentiment_score,
-            key_topics=key_topics
-        )
+        info_payload = {
+            "description": info_data.description,
+            "summary": info_data.summary,
+            "sentiment": info_data.sentiment,
+            "sentiment_score": info_data.sentiment_score,
+            "key_topics": info_data.key_topics_json or [],
+        }
     
-    return DocumentResponse(
-        id=doc.id,
-        filename=doc.filename,
-        original_filename=doc.original_filename,
-        s3_key=doc.s3_key,
-        s3_url=s3_url,
-        file_size=doc.file_size,
-        content_type=doc.content_type,
-        document_type=doc.document_type,
-        analysis_status=doc.analysis_status,
-        analysis_error=doc.analysis_error,
-        created_at=doc.created_at,
-        updated_at=doc.updated_at,
-        invoice_data=invoice_data_schema,
-        info_data=info_data_schema
+    return {
+        "id": doc.id,
+        "filename": doc.filename,
+        "original_filename": doc.original_filename,
+        "s3_key": doc.s3_key,
+        "s3_url": s3_url,
+        "file_size": doc.file_size,
+        "content_type": doc.content_type,
+        "document_type": doc.document_type,
+        "analysis_status": doc.analysis_status,
+        "analysis_error": doc.analysis_error,
+        "created_at": doc.created_at,
+        "updated_at": doc.updated_at,
+        "invoice_data": invoice_payload,
+        "info_data": info_payload,
+    }
+
+
+def _save_analysis(db: Session, document: Document, analysis_result, user_id: int) -> tuple:
+    """Store a successful analysis and log it. Returns (invoice_data, info_data)."""
+    invoice_data, info_data = document_service.store_analysis_result(db, document, analysis_result)
+    
+    # The event is written in the same transaction as the results
+    event_service.log_ai_analysis(
+        db=db,
+        document_id=document.id,
+        document_type=analysis_result.document_type.value,
+        user_id=user_id,
+        success=True,
+        commit=False
     )
+    db.commit()
+    
+    return invoice_data, info_data
+
+
+def _record_analysis_failure(db: Session, document: Document, error: str, user_id: int):
+    """Mark a document's analysis as failed and log the error."""
+    db.rollback()
+    document.analysis_status = "failed"
+    document.analysis_error = error
+    
+    event_service.log_ai_analysis(
+        db=db,
+        document_id=document.id,
+        document_type="unknown",
+        user_id=user_id,
+        success=False,
+        error=error,
+        commit=False
+    )
+    db.commit()
+
+
+def _reset_analysis(db: Session, document: Document):
+    """Drop previously extracted data and mark a document as processing again."""
+    db.query(InvoiceData).filter(InvoiceData.document_id == document.id).delete()
+    db.query(InfoData).filter(InfoData.document_id == document.id).delete()
+    
+    document.analysis_status = "processing"
+    document.analysis_error = None
+    db.commit()
+
+
+def _is_registered(db: Session, s3_key: str) -> bool:
+    """Whether a document is already stored under an S3 key."""
+    return db.query(Document.id).filter(Document.s3_key == s3_key).first() is not None
+
+
+def _create_document(db: Session, document: Document):
+    """Insert a new document record and load its generated columns."""
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+
+
+async def _run_analysis(
+    document_id: int,
+    file: Optional[BinaryIO],
+    content_type: str,
+    filename: str,
+    user_id: int,
+    s3_service: Optional[S3Service] = None
+):
+    """
+    Analyze an uploaded document in the background.
+    
+    Runs after the upload response has been sent, so it opens its own
+    database session instead of reusing the request's. ``file`` is a copy
+    of the upload made while streaming it to S3, and is closed here; without
+    it the file is downloaded from S3 first.
+    """
+    db = SessionLocal()
+    
+    try:
+        document = await run_in_threadpool(db.get, Document, document_id)
+        if not document:
+            return
+        
+        try:
+            if file is not None:
+                file.seek(0)
+                file_content = await run_in_threadpool(file.read)
+            else:
+                file_content = await s3_service.download_file(document.s3_key)
+                if file_content is None:
+                    raise RuntimeError("No se pudo obtener el archivo de S3")
+            
+            analysis_result = await document_service.analyze_document(
+                file_content=file_content,
+                content_type=content_type,
+                filename=filename
+            )
+            
+            await run_in_threadpool(_save_analysis, db, document, analysis_result, user_id)
+            
+        except Exception as e:
+            await run_in_threadpool(_record_analysis_failure, db, document, str(e), user_id)
+    finally:
+        db.close()
+        if file is not None:
+            file.close()
+
+
+def _purge_document(db: Session, document: Document):
+    """Delete a document and its event logs in one transaction."""
+    # Events still buffered for this document would fail their foreign key
+    event_service.discard_pending_for_document(document.id)
+    try:
+        # Delete event logs first to avoid FK constraint violation
+        db.query(EventLog).filter(EventLog.document_id == document.id).delete()
+        
+        # Delete document; invoice/info data go with it via ON DELETE CASCADE
+        db.delete(document)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
 
 @router.post(
     "/upload",
     response_model=DocumentResponse,
-    status_code=status.HTTP_201_CREATED,
+    status_code=status.HTTP_202_ACCEPTED,
     dependencies=[Depends(require_role("uploader"))]
 )
 async def upload_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="Documento PDF, JPG o PNG a analizar"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Upload and analyze a document (PDF, JPG, or PNG).
@@ -116,170 +291,208 @@ async def upload_document(
     2. Classified automatically (Factura or Información)
     3. Data extracted based on classification
     
-    Returns document details with extracted data.
+    Steps 2 and 3 run in the background: the document is returned with
+    `analysis_status="processing"` and can be polled via `GET /documents/{id}`.
     """
-    event_service = get_event_service()
-    
     # Validate file
-    if not file.filename:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="El nombre del archivo es requerido"
-        )
+    file_ext = _validate_extension(file.filename)
     
-    file_ext = file.filename.rsplit(".", 1)[-1].lower()
-    if file_ext not in settings.document_allowed_extensions_list:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Extensión no permitida. Permitidas: {settings.document_allowed_extensions}"
-        )
+    # Get content type
+    content_type = document_service.get_content_type(file.filename)
     
-    # Read file content
-    file_content = await file.read()
-    file_size = len(file_content)
+    # Generate unique filename for S3
+    stored_filename, s3_key = _new_document_key(current_user.id, file_ext)
     
-    # Validate file size
-    if file_size > settings.max_document_size_bytes:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"Archivo demasiado grande. Máximo: {settings.max_document_size_mb}MB"
+    analysis_file = SpooledTemporaryFile(max_size=ANALYSIS_SPOOL_MAX_BYTES)
+    try:
+        # Stream to S3 in parts, validating size as chunks are read; the same
+        # chunks are copied to a spool that the background analysis reads and closes
+        upload_result = await s3_service.upload_streaming(
+            file=file,
+            s3_key=s3_key,
+            content_type=content_type,
+            max_size=settings.max_document_size_bytes,
+            copy_to=analysis_file
+        )
+        
+        if not upload_result["success"]:
+            error_code = upload_result.get("error_code")
+            if error_code == "file_too_large":
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Archivo demasiado grande. Máximo: {settings.max_document_size_mb}MB"
+                )
+            if error_code == "empty_file":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="El archivo está vacío"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error al subir archivo a S3: {upload_result.get('error', 'Unknown error')}"
+            )
+        
+        s3_url = s3_service.get_presigned_url(s3_key)
+        file_size = upload_result["size"]
+        
+        # Create document record
+        db_document = Document(
+            filename=stored_filename,
+            original_filename=file.filename,
+            s3_key=s3_key,
+            file_size=file_size,
+            content_type=content_type,
+            analysis_status="processing",
+            user_id=current_user.id,
         )
+        
+        await run_in_threadpool(_create_document, db, db_document)
+    except BaseException:
+        analysis_file.close()
+        raise
+    
+    # Log upload event after the response is sent, ahead of the analysis task
+    background_tasks.add_task(
+        event_service.log_with_new_session,
+        event_service.log_document_upload,
+        document_id=db_document.id,
+        filename=file.filename,
+        user_id=current_user.id
+    )
+    
+    background_tasks.add_task(
+        _run_analysis,
+        db_document.id,
+        analysis_file,
+        content_type,
+        file.filename,
+        current_user.id
+    )
+    
+    return ORJSONResponse(
+        content=_build_document_response(db_document, s3_url),
+        status_code=status.HTTP_202_ACCEPTED
+    )
+
+
+@router.post(
+    "/upload-url",
+    response_model=DocumentUploadUrlResponse,
+    dependencies=[Depends(require_role("uploader"))]
+)
+def create_upload_url(
+    request: DocumentUploadUrlRequest,
+    current_user: User = Depends(get_current_user),
+    s3_service: S3Service = Depends(get_s3_service)
+):
+    """
+    Get a presigned POST to upload a document (PDF, JPG, or PNG) straight to S3.
+    
+    **Requires 'uploader' or 'admin' role.**
+    
+    The client posts the returned `fields` followed by the file to `url`,
+    then registers the upload with `POST /documents/register` using `s3_key`.
+    The file does not pass through the API server.
+    """
+    file_ext = _validate_extension(request.filename)
+    _, s3_key = _new_document_key(current_user.id, file_ext)
+    
+    presigned = s3_service.get_presigned_upload(
+        s3_key,
+        document_service.get_content_type(request.filename),
+        settings.max_document_size_bytes
+    )
     
-    if file_size == 0:
+    return ORJSONResponse(content={
+        "url": presigned["url"],
+        "fields": presigned["fields"],
+        "s3_key": s3_key,
+        "expires_in": settings.s3_presigned_upload_expiry,
+    })
+
+
+@router.post(
+    "/register",
+    response_model=DocumentResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(require_role("uploader"))]
+)
+async def register_document(
+    request: DocumentRegisterRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
+):
+    """
+    Register and analyze a document uploaded through `POST /documents/upload-url`.
+    
+    **Requires 'uploader' or 'admin' role.**
+    
+    Like `POST /documents/upload`, the analysis runs in the background and
+    the document is returned with `analysis_status="processing"`.
+    """
+    # Only keys handed out to this user can be registered
+    key_prefix = f"documents/{current_user.id}/"
+    stored_filename = request.s3_key[len(key_prefix):]
+    if not request.s3_key.startswith(key_prefix) or not stored_filename or "/" in stored_filename:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="El archivo está vacío"
+            detail="Clave de S3 no válida"
         )
     
-    # Get content type
-    document_service = get_document_service()
-    content_type = document_service.get_content_type(file.filename)
+    # The content type was fixed when the upload was signed for this extension
+    _validate_extension(stored_filename)
+    content_type = document_service.get_content_type(stored_filename)
     
-    # Generate unique filename for S3
-    unique_id = str(uuid.uuid4())
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    s3_key = f"documents/{current_user.id}/{timestamp}_{unique_id}.{file_ext}"
-    
-    # Upload to S3
-    s3_service = get_s3_service()
-    upload_result = await s3_service.upload_file(
-        file_content=file_content,
-        s3_key=s3_key,
-        content_type=content_type
-    )
-    
-    if not upload_result["success"]:
+    if await run_in_threadpool(_is_registered, db, request.s3_key):
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error al subir archivo a S3: {upload_result.get('error', 'Unknown error')}"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El documento ya fue registrado"
         )
     
-    s3_url = upload_result["url"]
+    file_size = await s3_service.get_file_size(request.s3_key)
+    if file_size is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No se pudo obtener el archivo de S3"
+        )
     
-    # Create document record
     db_document = Document(
-        filename=f"{timestamp}_{unique_id}.{file_ext}",
-        original_filename=file.filename,
-        s3_key=s3_key,
+        filename=stored_filename,
+        original_filename=request.filename,
+        s3_key=request.s3_key,
         file_size=file_size,
         content_type=content_type,
         analysis_status="processing",
         user_id=current_user.id,
     )
     
-    db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
+    await run_in_threadpool(_create_document, db, db_document)
     
-    # Log upload event
-    event_service.log_document_upload(
-        db=db,
+    background_tasks.add_task(
+        event_service.log_with_new_session,
+        event_service.log_document_upload,
         document_id=db_document.id,
-        filename=file.filename,
+        filename=request.filename,
         user_id=current_user.id
     )
     
-    # Analyze document with AI
-    try:
-        analysis_result = await document_service.analyze_document(
-            file_content=file_content,
-            content_type=content_type,
-            filename=file.filename
-        )
-        
-        # Update document with classification
-        db_document.document_type = analysis_result.document_type.value
-        db_document.analysis_status = "completed"
-        
-        # Store extracted data based on document type
-        invoice_data = None
-        info_data = None
-        
-        if analysis_result.document_type.value == "factura" and analysis_result.invoice_data:
-            products_json = json.dumps([p.model_dump() for p in analysis_result.invoice_data.products])
-            
-            invoice_data = InvoiceData(
-                document_id=db_document.id,
-                client_name=analysis_result.invoice_data.client_name,
-                client_address=analysis_result.invoice_data.client_address,
-                provider_name=analysis_result.invoice_data.provider_name,
-                provider_address=analysis_result.invoice_data.provider_address,
-                invoice_number=analysis_result.invoice_data.invoice_number,
-                invoice_date=analysis_result.invoice_data.invoice_date,
-                invoice_total=analysis_result.invoice_data.invoice_total,
-                currency=analysis_result.invoice_data.currency,
-                products_json=products_json,
-                raw_text=analysis_result.raw_text,
-            )
-            db.add(invoice_data)
-        
-        elif analysis_result.document_type.value == "informacion" and analysis_result.info_data:
-            key_topics_json = json.dumps(analysis_result.info_data.key_topics)
-            
-            info_data = InfoData(
-                document_id=db_document.id,
-                description=analysis_result.info_data.description,
-                summary=analysis_result.info_data.summary,
-                sentiment=analysis_result.info_data.sentiment,
-                sentiment_score=analysis_result.info_data.sentiment_score,
-                key_topics_json=key_topics_json,
-                raw_text=analysis_result.raw_text,
-            )
-            db.add(info_data)
-        
-        db.commit()
-        db.refresh(db_document)
-        
-        # Log AI analysis event
-        event_service.log_ai_analysis(
-            db=db,
-            document_id=db_document.id,
-            document_type=analysis_result.document_type.value,
-            user_id=current_user.id,
-            success=True
-        )
-        
-        return _build_document_response(db_document, s3_url, invoice_data, info_data)
-        
-    except Exception as e:
-        db_document.analysis_status = "failed"
-        db_document.analysis_error = str(e)
-        db.commit()
-        
-        # Log AI analysis failure
-        event_service.log_ai_analysis(
-            db=db,
-            document_id=db_document.id,
-            document_type="unknown",
-            user_id=current_user.id,
-            success=False,
-            error=str(e)
-        )
-        
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error en el análisis del documento: {str(e)}"
-        )
+    # The file only exists in S3, so the analysis downloads it
+    background_tasks.add_task(
+        _run_analysis,
+        db_document.id,
+        None,
+        content_type,
+        request.filename,
+        current_user.id,
+        s3_service
+    )
+    
+    return ORJSONResponse(
+        content=_build_document_response(db_document, s3_service.get_presigned_url(request.s3_key)),
+        status_code=status.HTTP_202_ACCEPTED
+    )
 
 
 @router.get(
@@ -287,7 +500,7 @@ async def upload_document(
     response_model=List[DocumentListResponse],
     dependencies=[Depends(require_role("user"))]
 )
-async def list_documents(
+def list_documents(
     status_filter: Optional[str] = Query(None, description="Filtrar por estado: pending, processing, completed, failed"),
     type_filter: Optional[str] = Query(None, description="Filtrar por tipo: factura, informacion"),
     page: int = Query(1, ge=1, description="Número de página"),
@@ -300,7 +513,7 @@ async def list_documents(
     
     Supports filtering by status and document type.
     """
-    query = db.query(Document).filter(Document.user_id == current_user.id)
+    query = db.query(*_LIST_COLUMNS).filter(Document.user_id == current_user.id)
     
     if status_filter:
         query = query.filter(Document.analysis_status == status_filter)
@@ -309,20 +522,9 @@ async def list_documents(
         query = query.filter(Document.document_type == type_filter)
     
     offset = (page - 1) * page_size
-    documents = query.order_by(Document.created_at.desc()).offset(offset).limit(page_size).all()
-    
-    return [
-        DocumentListResponse(
-            id=doc.id,
-            filename=doc.filename,
-            original_filename=doc.original_filename,
-            document_type=doc.document_type,
-            analysis_status=doc.analysis_status,
-            file_size=doc.file_size,
-            created_at=doc.created_at
-        )
-        for doc in documents
-    ]
+    rows = query.order_by(Document.created_at.desc()).offset(offset).limit(page_size).all()
+    
+    return ORJSONResponse(content=[row._asdict() for row in rows])
 
 
 @router.get(
@@ -330,41 +532,36 @@ async def list_documents(
     response_model=DocumentResponse,
     dependencies=[Depends(require_role("user"))]
 )
-async def get_document(
+def get_document(
     document_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Get details of a specific document including extracted data.
     """
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
-    
-    s3_url = f"{settings.s3_endpoint_url}/{settings.s3_bucket_name}/{document.s3_key}"
+    document = _get_owned_document(
+        db, document_id, current_user.id,
+        joinedload(Document.invoice_data),
+        joinedload(Document.info_data)
+    )
     
-    # Get related data
-    invoice_data = db.query(InvoiceData).filter(InvoiceData.document_id == document_id).first()
-    info_data = db.query(InfoData).filter(InfoData.document_id == document_id).first()
+    s3_url = s3_service.get_presigned_url(document.s3_key)
     
-    # Log user interaction
-    event_service = get_event_service()
-    event_service.log_user_interaction(
-        db=db,
+    # Log user interaction after the response is sent
+    background_tasks.add_task(
+        event_service.log_with_new_session,
+        event_service.log_user_interaction,
         action="Visualización de documento",
         user_id=current_user.id,
         document_id=document_id
     )
     
-    return _build_document_response(document, s3_url, invoice_data, info_data)
+    return ORJSONResponse(
+        content=_build_document_response(document, s3_url, document.invoice_data, document.info_data)
+    )
 
 
 @router.delete(
@@ -374,46 +571,35 @@ async def get_document(
 )
 async def delete_document(
     document_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Delete a document and its associated data.
     
     **Requires 'uploader' or 'admin' role.**
     """
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
+    document = await run_in_threadpool(_get_owned_document, db, document_id, current_user.id)
     
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
-    
-    # Delete from S3
-    s3_service = get_s3_service()
-    await s3_service.delete_file(document.s3_key)
-    
-    # Save filename before deletion for logging
+    # Save values before deletion for logging
     filename_for_log = document.original_filename
+    s3_key = document.s3_key
     
-    # Delete related data (must delete event logs first to avoid FK constraint violation)
-    from app.models.models import EventLog
-    db.query(EventLog).filter(EventLog.document_id == document_id).delete()
-    db.query(InvoiceData).filter(InvoiceData.document_id == document_id).delete()
-    db.query(InfoData).filter(InfoData.document_id == document_id).delete()
+    # S3 object and DB rows are independent, so remove both concurrently
+    s3_deleted, _ = await asyncio.gather(
+        s3_service.delete_file(s3_key),
+        run_in_threadpool(_purge_document, db, document)
+    )
     
-    # Delete document
-    db.delete(document)
-    db.commit()
+    if not s3_deleted:
+        print(f"Warning: document {document_id} deleted but S3 object {s3_key} could not be removed")
     
     # Log event after deletion is successful (without document_id to avoid FK violation)
-    event_service = get_event_service()
-    event_service.log_user_interaction(
-        db=db,
+    background_tasks.add_task(
+        event_service.log_with_new_session,
+        event_service.log_user_interaction,
         action="Eliminación de documento",
         user_id=current_user.id,
         document_id=None,  # Don't reference the deleted document
@@ -434,7 +620,8 @@ async def delete_document(
 async def reanalyze_document(
     document_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Re-analyze a document with AI.
@@ -443,20 +630,13 @@ async def reanalyze_document(
     
     Useful if the initial analysis failed or was incorrect.
     """
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
+    document = await run_in_threadpool(_get_owned_document, db, document_id, current_user.id)
+    s3_key = document.s3_key
+    content_type = document.content_type
+    original_filename = document.original_filename
     
     # Download file from S3
-    s3_service = get_s3_service()
-    file_content = await s3_service.download_file(document.s3_key)
+    file_content = await s3_service.download_file(s3_key)
     
     if not file_content:
         raise HTTPException(
@@ -465,93 +645,30 @@ async def reanalyze_document(
         )
     
     # Delete existing extracted data
-    db.query(InvoiceData).filter(InvoiceData.document_id == document_id).delete()
-    db.query(InfoData).filter(InfoData.document_id == document_id).delete()
-    
-    # Update status
-    document.analysis_status = "processing"
-    document.analysis_error = None
-    db.commit()
+    await run_in_threadpool(_reset_analysis, db, document)
     
     # Re-analyze with AI
-    document_service = get_document_service()
-    event_service = get_event_service()
-    
     try:
         analysis_result = await document_service.analyze_document(
             file_content=file_content,
-            content_type=document.content_type,
-            filename=document.original_filename
+            content_type=content_type,
+            filename=original_filename,
+            use_cache=False
         )
         
-        # Update document
-        document.document_type = analysis_result.document_type.value
-        document.analysis_status = "completed"
-        
-        # Store extracted data
-        invoice_data = None
-        info_data = None
-        
-        if analysis_result.document_type.value == "factura" and analysis_result.invoice_data:
-            products_json = json.dumps([p.model_dump() for p in analysis_result.invoice_data.products])
-            
-            invoice_data = InvoiceData(
-                document_id=document.id,
-                client_name=analysis_result.invoice_data.client_name,
-                client_address=analysis_result.invoice_data.client_address,
-                provider_name=analysis_result.invoice_data.provider_name,
-                provider_address=analysis_result.invoice_data.provider_address,
-                invoice_number=analysis_result.invoice_data.invoice_number,
-                invoice_date=analysis_result.invoice_data.invoice_date,
-                invoice_total=analysis_result.invoice_data.invoice_total,
-                currency=analysis_result.invoice_data.currency,
-                products_json=products_json,
-                raw_text=analysis_result.raw_text,
-            )
-            db.add(invoice_data)
-        
-        elif analysis_result.document_type.value == "informacion" and analysis_result.info_data:
-            key_topics_json = json.dumps(analysis_result.info_data.key_topics)
-            
-            info_data = InfoData(
-                document_id=document.id,
-                description=analysis_result.info_data.description,
-                summary=analysis_result.info_data.summary,
-                sentiment=analysis_result.info_data.sentiment,
-                sentiment_score=analysis_result.info_data.sentiment_score,
-                key_topics_json=key_topics_json,
-                raw_text=analysis_result.raw_text,
-            )
-            db.add(info_data)
-        
-        db.commit()
-        db.refresh(document)
-        
-        # Log event
-        event_service.log_ai_analysis(
-            db=db,
-            document_id=document.id,
-            document_type=analysis_result.document_type.value,
-            user_id=current_user.id,
-            success=True
+        invoice_data, info_data = await run_in_threadpool(
+            _save_analysis, db, document, analysis_result, current_user.id
         )
         
-        s3_url = f"{settings.s3_endpoint_url}/{settings.s3_bucket_name}/{document.s3_key}"
-        return _build_document_response(document, s3_url, invoice_data, info_data)
+        # Committed objects reload their attributes on access, so build the payload off the loop too
+        s3_url = s3_service.get_presigned_url(s3_key)
+        content = await run_in_threadpool(
+            _build_document_response, document, s3_url, invoice_data, info_data
+        )
+        return ORJSONResponse(content=content)
         
     except Exception as e:
-        document.analysis_status = "failed"
-        document.analysis_error = str(e)
-        db.commit()
-        
-        event_service.log_ai_analysis(
-            db=db,
-            document_id=document.id,
-            document_type="unknown",
-            user_id=current_user.id,
-            success=False,
-            error=str(e)
-        )
+        await run_in_threadpool(_record_analysis_failure, db, document, str(e), current_user.id)
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -565,45 +682,40 @@ async def reanalyze_document(
 )
 async def download_document(
     document_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Download the original document file.
     """
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
+    document = await run_in_threadpool(_get_owned_document, db, document_id, current_user.id)
     
-    s3_service = get_s3_service()
-    file_content = await s3_service.download_file(document.s3_key)
+    stream = await s3_service.stream_file(document.s3_key)
     
-    if not file_content:
+    if stream is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No se pudo obtener el archivo de S3"
         )
     
-    # Log download event
-    event_service = get_event_service()
-    event_service.log_user_interaction(
-        db=db,
+    chunks, content_length = stream
+    
+    # Log download event after the response is sent
+    background_tasks.add_task(
+        event_service.log_with_new_session,
+        event_service.log_user_interaction,
         action="Descarga de documento",
         user_id=current_user.id,
         document_id=document_id
     )
     
     return StreamingResponse(
-        BytesIO(file_content),
+        chunks,
         media_type=document.content_type,
         headers={
-            "Content-Disposition": f"attachment; filename={document.original_filename}"
+            "Content-Disposition": f"attachment; filename={document.original_filename}",
+            "Content-Length": str(content_length)
         }
     )
@@ -1,16 +1,20 @@
 """
 Event History API endpoints.
 """
+import os
 from datetime import datetime
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import StreamingResponse
+from typing import BinaryIO, Iterator, Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.core.cache import TTLCache
+from app.core.config import get_settings
 from app.core.database import get_db
 from app.core.security import require_role, get_current_user
 from app.models.models import User
-from app.services.event_service import get_event_service
+from app.services.event_service import EventService, get_event_service
 from app.schemas.schemas import (
     EventLogResponse,
     EventLogListResponse,
@@ -19,6 +23,39 @@ from app.schemas.schemas import (
 )
 
 router = APIRouter(prefix="/events", tags=["Event History"])
+settings = get_settings()
+
+# Stats are polled by the dashboard; counts may lag behind new events by the TTL
+_stats_cache = TTLCache(maxsize=256, ttl=settings.event_stats_cache_ttl_seconds)
+
+# Display labels for each event type
+EVENT_TYPE_LABELS = {
+    "subida_documento": "Subida de Documento",
+    "analisis_ia": "Análisis IA",
+    "interaccion_usuario": "Interacción de Usuario",
+    "sistema": "Sistema"
+}
+
+# The event types never change, so their response body is serialized once
+EVENT_TYPES_RESPONSE = {
+    "event_types": [
+        {"value": value, "label": label}
+        for value, label in EVENT_TYPE_LABELS.items()
+    ]
+}
+_EVENT_TYPES_BODY = orjson.dumps(EVENT_TYPES_RESPONSE)
+
+# Size of each chunk sent while streaming an export
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_file(file: BinaryIO) -> Iterator[bytes]:
+    """Yield a file in chunks and close it once fully sent."""
+    try:
+        while chunk := file.read(EXPORT_CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
 
 
 @router.get(
@@ -26,15 +63,18 @@ router = APIRouter(prefix="/events", tags=["Event History"])
     response_model=EventLogListResponse,
     dependencies=[Depends(require_role("user"))]
 )
-async def list_events(
+def list_events(
     event_type: Optional[EventTypeEnum] = Query(None, description="Filtrar por tipo de evento"),
     description_search: Optional[str] = Query(None, description="Buscar en descripción"),
     date_from: Optional[datetime] = Query(None, description="Fecha desde (ISO format)"),
     date_to: Optional[datetime] = Query(None, description="Fecha hasta (ISO format)"),
     page: int = Query(1, ge=1, description="Número de página"),
     page_size: int = Query(20, ge=1, le=100, description="Elementos por página"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente"),
+    include_total: bool = Query(False, description="Incluir el total de eventos"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    event_service: EventService = Depends(get_event_service)
 ):
     """
     List event history with optional filters.
@@ -48,9 +88,10 @@ async def list_events(
     **Pagination:**
     - `page`: Page number (default: 1)
     - `page_size`: Items per page (default: 20, max: 100)
+    - `cursor`: `next_cursor` from the previous page; takes precedence over
+      `page` and stays fast however deep the page is
+    - `include_total`: Also return `total` (default: false, `total` is null)
     """
-    event_service = get_event_service()
-    
     # Build filters
     filters = EventLogFilter(
         event_type=event_type,
@@ -60,25 +101,23 @@ async def list_events(
     )
     
     # Get events
-    events, total = event_service.get_events(
+    events, total, next_cursor = event_service.get_events(
         db=db,
         filters=filters,
         page=page,
-        page_size=page_size
-    )
-    
-    # Convert to response format
-    event_responses = [
-        event_service.event_to_response(event, db)
-        for event in events
-    ]
-    
-    return EventLogListResponse(
-        total=total,
-        page=page,
         page_size=page_size,
-        events=event_responses
+        cursor=cursor,
+        include_total=include_total
     )
+    
+    # Trusted DB data: serialize plain dicts and skip response_model re-validation
+    return ORJSONResponse(content={
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "events": [event_service.event_to_dict(event) for event in events],
+        "next_cursor": next_cursor,
+    })
 
 
 @router.get(
@@ -89,27 +128,21 @@ async def get_event_types():
     """
     Get all available event types.
     """
-    return {
-        "event_types": [
-            {"value": "subida_documento", "label": "Subida de Documento"},
-            {"value": "analisis_ia", "label": "Análisis IA"},
-            {"value": "interaccion_usuario", "label": "Interacción de Usuario"},
-            {"value": "sistema", "label": "Sistema"}
-        ]
-    }
+    return Response(content=_EVENT_TYPES_BODY, media_type="application/json")
 
 
 @router.get(
     "/export",
     dependencies=[Depends(require_role("admin"))]
 )
-async def export_events_to_excel(
+def export_events_to_excel(
     event_type: Optional[EventTypeEnum] = Query(None, description="Filtrar por tipo de evento"),
     description_search: Optional[str] = Query(None, description="Buscar en descripción"),
     date_from: Optional[datetime] = Query(None, description="Fecha desde (ISO format)"),
     date_to: Optional[datetime] = Query(None, description="Fecha hasta (ISO format)"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    event_service: EventService = Depends(get_event_service)
 ):
     """
     Export filtered events to Excel file.
@@ -118,8 +151,6 @@ async def export_events_to_excel(
     
     Returns an Excel file (.xlsx) with the filtered event data.
     """
-    event_service = get_event_service()
-    
     # Build filters
     filters = EventLogFilter(
         event_type=event_type,
@@ -144,17 +175,20 @@ async def export_events_to_excel(
     )
     
     # Generate Excel file
-    excel_buffer = event_service.export_to_excel(db=db, filters=filters)
+    excel_file = event_service.export_to_excel(db=db, filters=filters)
+    file_size = excel_file.seek(0, os.SEEK_END)
+    excel_file.seek(0)
     
     # Generate filename with timestamp
     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     filename = f"historico_eventos_{timestamp}.xlsx"
     
     return StreamingResponse(
-        excel_buffer,
+        _iter_file(excel_file),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={
-            "Content-Disposition": f"attachment; filename={filename}"
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(file_size)
         }
     )
 
@@ -163,7 +197,7 @@ async def export_events_to_excel(
     "/stats",
     dependencies=[Depends(require_role("user"))]
 )
-async def get_event_stats(
+def get_event_stats(
     date_from: Optional[datetime] = Query(None, description="Fecha desde (ISO format)"),
     date_to: Optional[datetime] = Query(None, description="Fecha hasta (ISO format)"),
     db: Session = Depends(get_db)
@@ -171,11 +205,17 @@ async def get_event_stats(
     """
     Get event statistics.
     
-    Returns counts grouped by event type.
+    Returns counts grouped by event type. Results are cached per date range
+    for a few seconds.
     """
     from sqlalchemy import func
     from app.models.models import EventLog
     
+    cache_key = (date_from, date_to)
+    cached = _stats_cache.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(content=cached)
+    
     query = db.query(
         EventLog.event_type,
         func.count(EventLog.id).label("count")
@@ -189,32 +229,20 @@ async def get_event_stats(
     
     stats = query.group_by(EventLog.event_type).all()
     
-    # Get total count
-    total_query = db.query(func.count(EventLog.id))
-    if date_from:
-        total_query = total_query.filter(EventLog.created_at >= date_from)
-    if date_to:
-        total_query = total_query.filter(EventLog.created_at <= date_to)
-    
-    total = total_query.scalar() or 0
+    # event_type is never NULL, so the groups add up to the total
+    total = sum(s.count for s in stats)
     
     # Format response
-    event_type_labels = {
-        "subida_documento": "Subida de Documento",
-        "analisis_ia": "Análisis IA",
-        "interaccion_usuario": "Interacción de Usuario",
-        "sistema": "Sistema"
-    }
-    
     stats_response = {
         "total": total,
         "by_type": {
-            event_type_labels.get(s.event_type, s.event_type): s.count
+            EVENT_TYPE_LABELS.get(s.event_type, s.event_type): s.count
             for s in stats
         }
     }
     
-    return stats_response
+    _stats_cache.set(cache_key, stats_response)
+    return ORJSONResponse(content=stats_response)
 
 
 @router.get(
@@ -222,15 +250,14 @@ async def get_event_stats(
     response_model=EventLogResponse,
     dependencies=[Depends(require_role("user"))]
 )
-async def get_event(
+def get_event(
     event_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    event_service: EventService = Depends(get_event_service)
 ):
     """
     Get details of a specific event.
     """
-    event_service = get_event_service()
-    
     event = event_service.get_event(db=db, event_id=event_id)
     
     if not event:
@@ -239,4 +266,4 @@ async def get_event(
             detail="Evento no encontrado"
         )
     
-    return event_service.event_to_response(event, db)
+    return ORJSONResponse(content=event_service.event_to_dict(event))
@@ -3,15 +3,21 @@ File upload API endpoints.
 """
 import uuid
 from datetime import datetime
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from sqlalchemy.orm import Session
+from itertools import islice
+from typing import Dict, List, Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, undefer
 from app.core.database import get_db
+from app.core.pagination import paginate_keyset
 from app.core.config import get_settings
 from app.core.security import require_role, get_current_user
 from app.models.models import User, UploadedFile, CSVData, FileValidation
-from app.services.s3_service import get_s3_service
-from app.services.csv_service import get_csv_service
+from app.services.s3_service import S3Service, get_s3_service
+from app.services.csv_service import CSVService, CSVValidation, get_csv_service
 from app.schemas.schemas import (
     FileUploadResponse,
     UploadedFileResponse,
@@ -21,6 +27,92 @@ from app.schemas.schemas import (
 router = APIRouter(prefix="/files", tags=["File Upload"])
 settings = get_settings()
 
+# Columns returned by the list endpoint (UploadedFileResponse)
+_LIST_COLUMNS = (
+    UploadedFile.id,
+    UploadedFile.filename,
+    UploadedFile.original_filename,
+    UploadedFile.s3_key,
+    UploadedFile.file_size,
+    UploadedFile.param1,
+    UploadedFile.param2,
+    UploadedFile.row_count,
+    UploadedFile.upload_status,
+    UploadedFile.created_at,
+)
+
+# Validations inserted per statement; bounds the parameter lists built at once
+VALIDATION_INSERT_BATCH_SIZE = 5000
+
+
+def _get_accessible_file(db: Session, file_id: int, user: User, *options) -> UploadedFile:
+    """
+    Load a file the user may see, raising 404 if missing or 403 if not theirs.
+    
+    Admins may see every file.
+    """
+    db_file = db.query(UploadedFile).options(*options).filter(UploadedFile.id == file_id).first()
+    
+    if not db_file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Archivo no encontrado"
+        )
+    
+    # Check permissions
+    if user.role != "admin" and db_file.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tienes permiso para ver este archivo"
+        )
+    
+    return db_file
+
+
+def _store_uploaded_file(
+    db: Session,
+    db_file: UploadedFile,
+    validations: List[CSVValidation]
+):
+    """
+    Persist an uploaded file record with its validations.
+    
+    The record already carries its CSV rows as one compressed blob; the
+    validations go in as batched multi-row INSERTs, and everything is
+    committed together.
+    
+    Blocking; called through run_in_threadpool from the upload endpoint.
+    """
+    # Everything is written in one transaction, so the record can go in as completed
+    db_file.upload_status = "completed"
+    
+    try:
+        db.add(db_file)
+        db.flush()  # Assigns db_file.id without committing
+        
+        # Validations share the file's timestamp instead of computing a default per row
+        created_at = db_file.created_at
+        
+        # render_nulls keeps None row/column values in the INSERT; otherwise the ORM
+        # omits those columns and splits the batch into one statement per run of rows
+        # with the same missing keys
+        for start in range(0, len(validations), VALIDATION_INSERT_BATCH_SIZE):
+            db.execute(
+                insert(FileValidation),
+                [
+                    {"uploaded_file_id": db_file.id, "created_at": created_at, **validation._asdict()}
+                    for validation in validations[start:start + VALIDATION_INSERT_BATCH_SIZE]
+                ],
+                execution_options={"render_nulls": True},
+            )
+        
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    db.refresh(db_file)
+
 
 @router.post(
     "/upload",
@@ -33,7 +125,9 @@ async def upload_csv_file(
     param1: str = Form(..., description="Primer parámetro adicional"),
     param2: str = Form(..., description="Segundo parámetro adicional"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    csv_service: CSVService = Depends(get_csv_service),
+    s3_service: S3Service = Depends(get_s3_service)
 ):
     """
     Upload and validate a CSV file.
@@ -65,9 +159,8 @@ async def upload_csv_file(
             detail=f"Extensión de archivo no permitida. Permitidas: {settings.allowed_extensions}"
         )
     
-    # Read file content
-    file_content = await file.read()
-    file_size = len(file_content)
+    # The upload is already spooled by the form parser; check its size without reading it
+    file_size = file.size or 0
     
     # Validate file size
     if file_size > settings.max_file_size_bytes:
@@ -88,8 +181,10 @@ async def upload_csv_file(
     s3_key = f"uploads/{current_user.id}/{timestamp}_{unique_id}.csv"
     
     # Process and validate CSV
-    csv_service = get_csv_service()
-    rows, validations = csv_service.validate_and_process(file_content, file.filename)
+    # Rows are packed into the stored blob as they are parsed
+    data_blob, row_count, validations = await csv_service.validate_and_pack_upload(
+        file.file, file.filename, settings.csv_max_validations or None
+    )
     
     # Check for critical errors
     critical_errors = [v for v in validations if v.severity == "error"]
@@ -98,16 +193,17 @@ async def upload_csv_file(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail={
                 "message": "El archivo tiene errores críticos",
-                "errors": [v.model_dump() for v in critical_errors]
+                "errors": [v._asdict() for v in critical_errors]
             }
         )
     
-    # Upload to S3
-    s3_service = get_s3_service()
-    upload_result = await s3_service.upload_file(
-        file_content=file_content,
-        s3_key=s3_key,
-        content_type="text/csv"
+    # Upload to S3 in parts straight from the spooled file
+    await file.seek(0)
+    upload_result = await s3_service.upload_streaming(
+        file,
+        s3_key,
+        content_type="text/csv",
+        max_size=settings.max_file_size_bytes
     )
     
     if not upload_result["success"]:
@@ -125,61 +221,39 @@ async def upload_csv_file(
         content_type="text/csv",
         param1=param1,
         param2=param2,
-        row_count=len(rows),
+        row_count=row_count,
+        data_blob=data_blob,
         upload_status="processing",
         user_id=current_user.id,
     )
-    
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
-    
-    # Store CSV data in database
-    json_rows = csv_service.rows_to_json(rows)
-    for row_num, json_data in enumerate(json_rows, start=1):
-        csv_data = CSVData(
-            uploaded_file_id=db_file.id,
-            row_number=row_num,
-            data=json_data,
-        )
-        db.add(csv_data)
-    
-    # Store validations in database
-    for validation in validations:
-        db_validation = FileValidation(
-            uploaded_file_id=db_file.id,
-            validation_type=validation.validation_type,
-            row_number=validation.row_number,
-            column_name=validation.column_name,
-            message=validation.message,
-            severity=validation.severity,
-        )
-        db.add(db_validation)
-    
-    # Update status to completed
-    db_file.upload_status = "completed"
-    db.commit()
-    
-    return FileUploadResponse(
-        id=db_file.id,
-        filename=db_file.filename,
-        original_filename=db_file.original_filename,
-        s3_key=db_file.s3_key,
-        s3_url=upload_result["url"],
-        file_size=file_size,
-        row_count=len(rows),
-        param1=param1,
-        param2=param2,
-        upload_status=db_file.upload_status,
-        validations=validations,
-        created_at=db_file.created_at,
+    await run_in_threadpool(_store_uploaded_file, db, db_file, validations)
+    
+    # Serialized directly so a file with many warnings does not build one
+    # ValidationResult model per validation
+    return ORJSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content={
+            "id": db_file.id,
+            "filename": db_file.filename,
+            "original_filename": db_file.original_filename,
+            "s3_key": db_file.s3_key,
+            "s3_url": upload_result["url"],
+            "file_size": file_size,
+            "row_count": row_count,
+            "param1": param1,
+            "param2": param2,
+            "upload_status": db_file.upload_status,
+            "validations": [v._asdict() for v in validations],
+            "created_at": db_file.created_at,
+        },
     )
 
 
 @router.get("/", response_model=List[UploadedFileResponse])
-async def list_uploaded_files(
+def list_uploaded_files(
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -188,20 +262,28 @@ async def list_uploaded_files(
     
     - **skip**: Number of records to skip (pagination)
     - **limit**: Maximum number of records to return
+    - **cursor**: Value of the `X-Next-Cursor` header from the previous page;
+      takes precedence over `skip`
     """
-    query = db.query(UploadedFile)
+    query = db.query(*_LIST_COLUMNS)
     
     # Non-admin users can only see their own files
     if current_user.role != "admin":
         query = query.filter(UploadedFile.user_id == current_user.id)
     
-    files = query.order_by(UploadedFile.created_at.desc()).offset(skip).limit(limit).all()
+    files, next_cursor = paginate_keyset(
+        query, UploadedFile.created_at, UploadedFile.id, limit,
+        cursor=cursor, offset=skip
+    )
+    
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
     
-    return files
+    # Only the response columns were selected, so serialize the rows directly
+    return ORJSONResponse(content=[row._asdict() for row in files], headers=headers)
 
 
 @router.get("/{file_id}", response_model=UploadedFileResponse)
-async def get_uploaded_file(
+def get_uploaded_file(
     file_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -211,26 +293,11 @@ async def get_uploaded_file(
     
     - **file_id**: ID of the file to retrieve
     """
-    db_file = db.query(UploadedFile).filter(UploadedFile.id == file_id).first()
-    
-    if not db_file:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Archivo no encontrado"
-        )
-    
-    # Check permissions
-    if current_user.role != "admin" and db_file.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No tienes permiso para ver este archivo"
-        )
-    
-    return db_file
+    return _get_accessible_file(db, file_id, current_user)
 
 
 @router.get("/{file_id}/validations", response_model=List[ValidationResult])
-async def get_file_validations(
+def get_file_validations(
     file_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -240,32 +307,48 @@ async def get_file_validations(
     
     - **file_id**: ID of the file
     """
-    db_file = db.query(UploadedFile).filter(UploadedFile.id == file_id).first()
-    
-    if not db_file:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Archivo no encontrado"
-        )
-    
-    # Check permissions
-    if current_user.role != "admin" and db_file.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No tienes permiso para ver este archivo"
-        )
-    
-    validations = db.query(FileValidation).filter(
+    _get_accessible_file(db, file_id, current_user)
+    
+    validations = db.query(
+        FileValidation.validation_type,
+        FileValidation.row_number,
+        FileValidation.column_name,
+        FileValidation.message,
+        FileValidation.severity,
+    ).filter(
         FileValidation.uploaded_file_id == file_id
     ).all()
     
-    return [
-        ValidationResult(
-            validation_type=v.validation_type,
-            row_number=v.row_number,
-            column_name=v.column_name,
-            message=v.message,
-            severity=v.severity,
-        )
-        for v in validations
-    ]
+    # One entry per flagged cell can add up; skip ValidationResult round-trips
+    return ORJSONResponse(content=[v._asdict() for v in validations])
+
+
+@router.get("/{file_id}/rows", response_model=List[Dict[str, Optional[str]]])
+def get_file_rows(
+    file_id: int,
+    skip: int = Query(0, ge=0, description="Filas a omitir"),
+    limit: int = Query(100, ge=1, le=1000, description="Máximo de filas a devolver"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    csv_service: CSVService = Depends(get_csv_service)
+):
+    """
+    Get the parsed rows of a specific file.
+    
+    - **file_id**: ID of the file
+    - **skip**: Number of rows to skip (pagination)
+    - **limit**: Maximum number of rows to return
+    """
+    db_file = _get_accessible_file(db, file_id, current_user, undefer(UploadedFile.data_blob))
+    
+    if db_file.data_blob is not None:
+        # Stop decompressing once the requested page has been read
+        rows = list(islice(csv_service.iter_blob_rows(db_file.data_blob), skip, skip + limit))
+    else:
+        # Files uploaded before data_blob existed keep one CSVData record per row
+        records = db.query(CSVData.data).filter(
+            CSVData.uploaded_file_id == file_id
+        ).order_by(CSVData.row_number).offset(skip).limit(limit).all()
+        rows = [orjson.loads(record.data) for record in records]
+    
+    return ORJSONResponse(content=rows)
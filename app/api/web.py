@@ -1,50 +1,69 @@
 """
 Web Interface Routes for Document Analysis and Event History.
 """
+import tempfile
+from functools import lru_cache
 from fastapi import APIRouter, Request, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 from pathlib import Path
+from app.core.config import get_settings
 
-# Setup templates
+settings = get_settings()
+
+# Setup templates; compiled bytecode is kept on disk so restarts skip compiling
 templates_path = Path(__file__).parent.parent / "templates"
-templates = Jinja2Templates(directory=str(templates_path))
+bytecode_cache_path = Path(tempfile.gettempdir()) / "onecore_jinja_cache"
+bytecode_cache_path.mkdir(parents=True, exist_ok=True)
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader(str(templates_path)),
+    autoescape=select_autoescape(),
+    bytecode_cache=FileSystemBytecodeCache(str(bytecode_cache_path)),
+    auto_reload=settings.debug
+))
 
 router = APIRouter(prefix="/web", tags=["Web Interface"])
 
 
+def _render(name: str, **context) -> str:
+    """Render a template to HTML."""
+    return templates.get_template(name).render(**context)
+
+
+# The pages only depend on constant context, so render each one once
+_render_cached = lru_cache(maxsize=16)(_render)
+
+
+def _page(name: str, **context) -> HTMLResponse:
+    """Build the response for a static page, re-rendering only in debug mode."""
+    render = _render if settings.debug else _render_cached
+    return HTMLResponse(render(name, **context))
+
+
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     """Login page."""
-    return templates.TemplateResponse(
-        "login.html",
-        {"request": request}
-    )
+    return _page("login.html")
 
 
 @router.get("/documents", response_class=HTMLResponse)
 async def documents_page(request: Request):
     """Document analysis page."""
-    return templates.TemplateResponse(
+    return _page(
         "documents.html",
-        {
-            "request": request,
-            "title": "Análisis de Documentos",
-            "active_page": "documents"
-        }
+        title="Análisis de Documentos",
+        active_page="documents"
     )
 
 
 @router.get("/events", response_class=HTMLResponse)
 async def events_page(request: Request):
     """Event history page."""
-    return templates.TemplateResponse(
+    return _page(
         "events.html",
-        {
-            "request": request,
-            "title": "Histórico de Eventos",
-            "active_page": "events"
-        }
+        title="Histórico de Eventos",
+        active_page="events"
     )
 
 
@@ -2,7 +2,7 @@
 Application configuration using Pydantic Settings.
 Loads configuration from environment variables and .env file.
 """
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -19,6 +19,10 @@ class Settings(BaseSettings):
     jwt_secret_key: str = Field(...)
     jwt_algorithm: str = Field(default="HS256")
     jwt_access_token_expire_minutes: int = Field(default=30)
+    user_cache_ttl_seconds: int = Field(default=60)
+    event_stats_cache_ttl_seconds: int = Field(default=30)
+    event_log_batch_size: int = Field(default=50)  # Background events written per INSERT batch
+    event_log_flush_interval_seconds: float = Field(default=1.0)  # Max delay before buffered events are written
     
     # Database Configuration
     db_server: str = Field(default=r"(localdb)\MSSQLLocalDB")
@@ -26,6 +30,11 @@ class Settings(BaseSettings):
     db_driver: str = Field(default="ODBC Driver 17 for SQL Server")
     db_user: str = Field(default="")  # Empty for Windows Auth (LocalDB)
     db_password: str = Field(default="")  # Empty for Windows Auth (LocalDB)
+    db_pool_size: int = Field(default=25)
+    db_max_overflow: int = Field(default=25)
+    db_pool_recycle: int = Field(default=1800)  # Seconds before a connection is recycled
+    db_pool_timeout: int = Field(default=10)  # Seconds to wait for a free connection
+    db_query_cache_size: int = Field(default=1200)  # Compiled SQL statements kept per engine
     
     # AWS S3 / LocalStack Configuration
     aws_access_key_id: str = Field(default="test")
@@ -33,20 +42,37 @@ class Settings(BaseSettings):
     aws_region: str = Field(default="us-east-1")
     s3_endpoint_url: str = Field(default="http://localhost:4566")
     s3_bucket_name: str = Field(default="onecoremxpy-bucket")
+    s3_max_pool_connections: int = Field(default=50)
+    s3_presigned_url_expiry: int = Field(default=3600)  # Seconds
+    s3_presigned_upload_expiry: int = Field(default=900)  # Seconds to start a direct upload
     
     # File Upload Configuration
     max_file_size_mb: int = Field(default=10)
     allowed_extensions: str = Field(default="csv")
+    csv_process_workers: int = Field(default=0)  # Processes for CSV validation; 0 uses the threadpool
+    csv_max_validations: int = Field(default=0)  # Value checks stop after this many results; 0 checks every row
     
     # Document Analysis Configuration
     document_allowed_extensions: str = Field(default="pdf,jpg,jpeg,png")
     max_document_size_mb: int = Field(default=20)
+    document_analysis_cache_size: int = Field(default=256)  # Analyses kept per process, keyed by file hash
+    document_analysis_cache_ttl_seconds: int = Field(default=86400)
+    
+    # Web Interface Configuration
+    static_cache_max_age_seconds: int = Field(default=86400)
+    cors_allowed_origins: str = Field(default="")  # Comma-separated; empty disables CORS
     
     # OpenAI Configuration (for Document Analysis)
     openai_api_key: str = Field(default="")
     openai_model: str = Field(default="gpt-4o")
+    openai_max_connections: int = Field(default=200)
+    openai_max_keepalive_connections: int = Field(default=100)
+    openai_timeout: float = Field(default=60.0)  # Seconds per request
+    openai_max_concurrency: int = Field(default=32)  # Analyses in flight at once per process
+    openai_max_retries: int = Field(default=5)  # Retries with backoff on rate limits and server errors
+    openai_max_document_tokens: int = Field(default=2000)  # Document text sent per analysis
     
-    @property
+    @cached_property
     def database_url(self) -> str:
         """Generate the database connection URL for SQLAlchemy."""
         # Check if DATABASE_URL env var is set (for local SQLite testing)
@@ -65,22 +91,27 @@ class Settings(BaseSettings):
             f"?driver={self.db_driver.replace(' ', '+')}&TrustServerCertificate=yes"
         )
     
-    @property
+    @cached_property
     def max_file_size_bytes(self) -> int:
         """Convert max file size from MB to bytes."""
         return self.max_file_size_mb * 1024 * 1024
     
-    @property
-    def allowed_extensions_list(self) -> list[str]:
-        """Get allowed extensions as a list."""
-        return [ext.strip().lower() for ext in self.allowed_extensions.split(",")]
+    @cached_property
+    def allowed_extensions_list(self) -> frozenset[str]:
+        """Get allowed extensions as a set."""
+        return frozenset(ext.strip().lower() for ext in self.allowed_extensions.split(","))
+    
+    @cached_property
+    def document_allowed_extensions_list(self) -> frozenset[str]:
+        """Get allowed document extensions as a set."""
+        return frozenset(ext.strip().lower() for ext in self.document_allowed_extensions.split(","))
     
-    @property
-    def document_allowed_extensions_list(self) -> list[str]:
-        """Get allowed document extensions as a list."""
-        return [ext.strip().lower() for ext in self.document_allowed_extensions.split(",")]
+    @cached_property
+    def cors_allowed_origins_list(self) -> list[str]:
+        """Get allowed CORS origins as a list."""
+        return [origin.strip() for origin in self.cors_allowed_origins.split(",") if origin.strip()]
     
-    @property
+    @cached_property
     def max_document_size_bytes(self) -> int:
         """Convert max document size from MB to bytes."""
         return self.max_document_size_mb * 1024 * 1024
@@ -1,19 +1,50 @@
 """
 Database connection and session management.
 """
-from sqlalchemy import create_engine
+import orjson
+from sqlalchemy import Index, create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import get_settings
 
 settings = get_settings()
 
-# Create SQLAlchemy engine
+# Pool sizing only applies to server databases; SQLite uses its own pool classes
+_engine_options = {}
+if not settings.database_url.startswith("sqlite"):
+    _engine_options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_timeout": settings.db_pool_timeout,
+    }
+
+# Let pyodbc bind executemany parameters as arrays instead of one round trip per row
+if settings.database_url.startswith("mssql+pyodbc"):
+    _engine_options["fast_executemany"] = True
+
+# Create SQLAlchemy engine; JSON columns are (de)serialized with orjson
 engine = create_engine(
     settings.database_url,
     echo=settings.debug,
     pool_pre_ping=True,
+    query_cache_size=settings.db_query_cache_size,
+    json_serializer=lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode(),
+    json_deserializer=orjson.loads,
+    **_engine_options,
 )
 
+# SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to per connection.
+# WAL lets reads run alongside a write, and synchronous=NORMAL syncs the log at
+# checkpoints instead of on every commit.
+if settings.database_url.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -25,6 +56,10 @@ def get_db():
     """
     Dependency that provides a database session.
     Automatically closes the session when done.
+    
+    Sessions are synchronous, so endpoints that only talk to the database
+    are declared with plain ``def`` and run in FastAPI's threadpool instead
+    of blocking the event loop.
     """
     db = SessionLocal()
     try:
@@ -33,6 +68,52 @@ def get_db():
         db.close()
 
 
+def _add_missing_columns(connection):
+    """Add nullable columns that were introduced after their table was created."""
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD {preparer.format_column(column)} {column_type} NULL"
+            ))
+
+
+# Indexes dropped from the models that older databases may still have, by table.
+# ix_event_logs_created_id (created_at DESC, id DESC) serves created_at lookups
+_OBSOLETE_INDEXES = {
+    "event_logs": ("ix_event_logs_created_at",),
+}
+
+
+def _drop_obsolete_indexes(connection):
+    """Drop indexes the models no longer declare, so writes stop maintaining them."""
+    inspector = inspect(connection)
+    
+    for table_name, index_names in _OBSOLETE_INDEXES.items():
+        table = Base.metadata.tables[table_name]
+        for index in inspector.get_indexes(table_name):
+            if index["name"] in index_names:
+                obsolete = Index(index["name"], *(table.c[name] for name in index["column_names"]))
+                # Building the Index attaches it to the model's table; detach it again
+                table.indexes.discard(obsolete)
+                obsolete.drop(connection)
+
+
 def init_db():
-    """Initialize database tables."""
+    """Initialize database tables, columns and indexes."""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips existing tables, so add columns and indexes introduced after they were created
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
+        _drop_obsolete_indexes(connection)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
@@ -0,0 +1,64 @@
+"""
+ASGI middleware for request-level safeguards.
+"""
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Allowance for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized upload requests before their body is read.
+
+    Requests to the configured paths are refused with 413 when the declared
+    Content-Length exceeds the limit; bodies without a Content-Length (or
+    with a misleading one) are counted while streamed and cut off as soon
+    as they go over.
+    """
+
+    def __init__(self, app: ASGIApp, limits: dict[str, int]):
+        """
+        Args:
+            app: The wrapped ASGI application
+            limits: Maximum file size in bytes, keyed by request path
+        """
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        max_body_size = limit + MULTIPART_OVERHEAD_BYTES
+        detail = f"Archivo demasiado grande. Máximo: {limit // (1024 * 1024)}MB"
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+            response = JSONResponse(
+                {"detail": detail},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # Raised while FastAPI parses the form, which re-raises HTTPException as-is
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=detail
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
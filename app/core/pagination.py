@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination helpers.
+"""
+import base64
+from datetime import datetime
+from typing import Any, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode the position of a row as an opaque cursor."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido"
+        )
+
+
+def paginate_keyset(
+    query,
+    created_column,
+    id_column,
+    limit: int,
+    cursor: Optional[str] = None,
+    offset: int = 0
+) -> tuple[list[Any], Optional[str]]:
+    """
+    Fetch one page of a query ordered newest first.
+
+    Rows are ordered by (created_at desc, id desc) and, when a cursor is
+    given, start right after the row it points to, so the database seeks
+    on the index instead of scanning past skipped rows. Row-value
+    comparison is spelled out because SQL Server does not support it.
+
+    Args:
+        query: Query to paginate
+        created_column: Creation timestamp column
+        id_column: Primary key column, used as tie-breaker
+        limit: Maximum number of rows to return
+        cursor: Cursor returned with the previous page
+        offset: Rows to skip, for callers still paging by number; ignored
+            when a cursor is given
+
+    Returns:
+        Tuple of (rows, next cursor or None on the last page)
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_column < created_at,
+            and_(created_column == created_at, id_column < row_id)
+        ))
+
+    query = query.order_by(created_column.desc(), id_column.desc())
+    if offset and not cursor:
+        query = query.offset(offset)
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return rows, next_cursor
@@ -8,14 +8,28 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
 from app.core.config import get_settings
 from app.core.database import get_db
 from app.models.models import User
 
 settings = get_settings()
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Column values of recently authenticated users, keyed by user id. Changes to
+# a user (is_active, role) take up to user_cache_ttl_seconds to be seen here
+_user_cache = TTLCache(maxsize=1024, ttl=settings.user_cache_ttl_seconds)
+# Only what requests read from the current user (created_at for /auth/me);
+# the password hash is never kept in the cache
+_CACHED_USER_COLUMNS = ("id", "username", "email", "role", "is_active", "created_at")
+
+# Password hashing: argon2id for new hashes, bcrypt kept to verify existing ones
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,  # KiB
+    argon2__parallelism=1,
+)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -26,6 +40,16 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Verify a password and return a replacement hash if the stored one is outdated.
+    
+    Returns:
+        Tuple of (is_valid, new_hash); new_hash is None unless rehashing is needed
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     """Hash a password."""
     return pwd_context.hash(password)
@@ -96,13 +120,15 @@ def decode_token(token: str) -> dict:
         )
 
 
-async def get_current_user(
+def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> User:
     """
     Get the current authenticated user from the JWT token.
     
+    Users are cached for a short TTL so most requests skip the lookup query.
+    
     Args:
         token: JWT token from request
         db: Database session
@@ -125,10 +151,17 @@ async def get_current_user(
     if user_id is None:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if user is None:
-        raise credentials_exception
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        # Detached copy: safe to share across requests and sessions
+        user = User(**cached)
+    else:
+        user = db.query(User).filter(User.id == user_id).first()
+        
+        if user is None:
+            raise credentials_exception
+        
+        _user_cache.set(user_id, {key: getattr(user, key) for key in _CACHED_USER_COLUMNS})
     
     if not user.is_active:
         raise HTTPException(
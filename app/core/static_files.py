@@ -0,0 +1,44 @@
+"""
+Static file serving with browser caching.
+"""
+import os
+import re
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+# Files whose name carries a content hash (e.g. app.3f9a1c2b.css) never change
+HASHED_FILENAME = re.compile(r"\.[0-9a-f]{8,}\.[^./]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that tells browsers how long they may reuse a file.
+
+    Content-hashed files are cached for a year as immutable. Other files are
+    cached for ``max_age`` seconds and then revalidated with the ETag and
+    Last-Modified headers StaticFiles already sends, which answer with 304
+    when unchanged.
+    """
+
+    def __init__(self, *args, max_age: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+
+        if HASHED_FILENAME.search(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+
+        return response
@@ -1,19 +1,34 @@
 """
 FastAPI Application Entry Point.
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import get_settings
 from app.core.database import init_db
+from app.core.middleware import UploadSizeLimitMiddleware
+from app.core.static_files import CachedStaticFiles
 from app.services.s3_service import get_s3_service
+from app.services.csv_service import get_csv_service
+from app.services.document_service import get_document_service
+from app.services.event_service import get_event_service
 from app.api import auth, files, documents, events, web
 
 settings = get_settings()
 
 
+async def _flush_events_periodically():
+    """Write buffered background events even when no new event arrives."""
+    event_service = get_event_service()
+    while True:
+        await asyncio.sleep(settings.event_log_flush_interval_seconds)
+        await run_in_threadpool(event_service.flush_pending)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events."""
@@ -24,15 +39,21 @@ async def lifespan(app: FastAPI):
     print("[DB] Initializing database...")
     init_db()
     
-    # Initialize S3 bucket
+    # Create the shared S3 client (and its connection pool) before the
+    # first request; this also ensures the bucket exists
     print("[S3] Ensuring S3 bucket exists...")
-    s3_service = get_s3_service()
-    s3_service.ensure_bucket_exists()
+    get_s3_service()
+    
+    event_flusher = asyncio.create_task(_flush_events_periodically())
     
     yield
     
     # Shutdown
     print("[STOP] Shutting down application...")
+    event_flusher.cancel()
+    get_event_service().flush_pending()
+    get_csv_service().shutdown()
+    await get_document_service().aclose()
 
 
 # Create FastAPI application
@@ -68,21 +89,37 @@ API para gestión de archivos y análisis de documentos con IA.
     docs_url="/docs",
     redoc_url="/redoc",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
-# Configure CORS
+# Configure CORS; the web interface is same-origin and does not need it
+if settings.cors_allowed_origins_list:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_allowed_origins_list,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_headers=["authorization", "content-type"],
+        expose_headers=["content-disposition", "x-next-cursor"],
+    )
+
+# Reject oversized uploads before their body is received
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    UploadSizeLimitMiddleware,
+    limits={
+        "/api/v1/documents/upload": settings.max_document_size_bytes,
+        "/api/v1/files/upload": settings.max_file_size_bytes,
+    },
 )
 
 # Mount static files
 from pathlib import Path
 static_dir = Path(__file__).parent / "static"
-app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+app.mount(
+    "/static",
+    CachedStaticFiles(directory=str(static_dir), max_age=settings.static_cache_max_age_seconds),
+    name="static"
+)
 
 # Include API routers
 app.include_router(auth.router, prefix="/api/v1")
@@ -1,13 +1,18 @@
 """
 Database models for the application.
 """
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, Enum
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, Enum, JSON, Index, LargeBinary
+from sqlalchemy.orm import deferred, relationship
 from app.core.database import Base
 import enum
 
 
+def utcnow() -> datetime:
+    """Current UTC time as a naive datetime, the form stored in DateTime columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class DocumentType(str, enum.Enum):
     """Document classification types."""
     FACTURA = "factura"
@@ -40,8 +45,8 @@ class User(Base):
     email = Column(String(255), unique=True, index=True)
     role = Column(String(50), nullable=False, default="user")  # user, admin, uploader
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     
     # Relationships
     uploaded_files = relationship("UploadedFile", back_populates="user")
@@ -64,23 +69,36 @@ class UploadedFile(Base):
     row_count = Column(Integer)
     upload_status = Column(String(50), default="pending")  # pending, processing, completed, failed
     user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    # Parsed rows as one gzip-compressed JSON array; only loaded when asked for
+    data_blob = deferred(Column(LargeBinary, nullable=True))
+    
+    __table_args__ = (
+        Index("ix_uploaded_files_created", created_at.desc(), id.desc()),
+        Index("ix_uploaded_files_user_created", "user_id", created_at.desc(), id.desc()),
+    )
     
     # Relationships
     user = relationship("User", back_populates="uploaded_files")
-    csv_data = relationship("CSVData", back_populates="uploaded_file")
-    validations = relationship("FileValidation", back_populates="uploaded_file")
+    # Both can be very large; load them explicitly with a query instead
+    csv_data = relationship("CSVData", back_populates="uploaded_file", lazy="raise")
+    validations = relationship("FileValidation", back_populates="uploaded_file", lazy="raise")
 
 
 class CSVData(Base):
-    """Model to store processed CSV data."""
+    """Model to store processed CSV data (one row per CSV row, for files uploaded before UploadedFile.data_blob)."""
     __tablename__ = "csv_data"
     
     id = Column(Integer, primary_key=True, index=True)
     uploaded_file_id = Column(Integer, ForeignKey("uploaded_files.id"), nullable=False)
     row_number = Column(Integer, nullable=False)
-    data = Column(Text, nullable=False)  # JSON string of row data
-    created_at = Column(DateTime, default=datetime.utcnow)
+    data = deferred(Column(Text, nullable=False))  # JSON string of row data
+    created_at = Column(DateTime, default=utcnow)
+    
+    # Serve a file's rows in order without a sort
+    __table_args__ = (
+        Index("ix_csv_data_file_row", "uploaded_file_id", "row_number"),
+    )
     
     # Relationships
     uploaded_file = relationship("UploadedFile", back_populates="csv_data")
@@ -91,13 +109,13 @@ class FileValidation(Base):
     __tablename__ = "file_validations"
     
     id = Column(Integer, primary_key=True, index=True)
-    uploaded_file_id = Column(Integer, ForeignKey("uploaded_files.id"), nullable=False)
+    uploaded_file_id = Column(Integer, ForeignKey("uploaded_files.id"), nullable=False, index=True)
     validation_type = Column(String(100), nullable=False)  # empty_value, incorrect_type, duplicate
     row_number = Column(Integer)
     column_name = Column(String(255))
     message = Column(String(500))
     severity = Column(String(50), default="warning")  # warning, error
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     # Relationships
     uploaded_file = relationship("UploadedFile", back_populates="validations")
@@ -119,13 +137,28 @@ class Document(Base):
     analysis_status = Column(String(50), default="pending")  # pending, processing, completed, failed
     analysis_error = Column(Text, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    
+    # Serve the per-user listing (optionally filtered) in created_at order without a sort,
+    # and lookups of a stored object by its key
+    __table_args__ = (
+        Index("ix_documents_s3_key", "s3_key"),
+        Index("ix_documents_user_created", "user_id", created_at.desc()),
+        Index("ix_documents_user_status", "user_id", "analysis_status", created_at.desc()),
+        Index("ix_documents_user_type", "user_id", "document_type", created_at.desc()),
+    )
     
     # Relationships
     user = relationship("User", back_populates="documents")
-    invoice_data = relationship("InvoiceData", back_populates="document", uselist=False)
-    info_data = relationship("InfoData", back_populates="document", uselist=False)
+    invoice_data = relationship(
+        "InvoiceData", back_populates="document", uselist=False, lazy="raise",
+        cascade="all, delete-orphan", passive_deletes=True
+    )
+    info_data = relationship(
+        "InfoData", back_populates="document", uselist=False, lazy="raise",
+        cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class InvoiceData(Base):
@@ -133,7 +166,7 @@ class InvoiceData(Base):
     __tablename__ = "invoice_data"
     
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, unique=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, unique=True)
     
     # Client information
     client_name = Column(String(255))
@@ -150,12 +183,12 @@ class InvoiceData(Base):
     currency = Column(String(10), default="MXN")
     
     # Products (stored as JSON)
-    products_json = Column(Text)  # JSON array of products
+    products_json = Column(JSON)  # JSON array of products
     
-    # Raw extracted text
-    raw_text = Column(Text)
+    # Raw extracted text; only loaded when asked for
+    raw_text = deferred(Column(Text))
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     # Relationships
     document = relationship("Document", back_populates="invoice_data")
@@ -166,7 +199,7 @@ class InfoData(Base):
     __tablename__ = "info_data"
     
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, unique=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, unique=True)
     
     # Extracted information
     description = Column(Text)
@@ -175,12 +208,12 @@ class InfoData(Base):
     sentiment_score = Column(Float)
     
     # Key topics/entities
-    key_topics_json = Column(Text)  # JSON array of key topics
+    key_topics_json = Column(JSON)  # JSON array of key topics
     
-    # Raw extracted text
-    raw_text = Column(Text)
+    # Raw extracted text; only loaded when asked for
+    raw_text = deferred(Column(Text))
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     # Relationships
     document = relationship("Document", back_populates="info_data")
@@ -201,9 +234,16 @@ class EventLog(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     
     # Additional metadata (JSON)
-    metadata_json = Column(Text, nullable=True)
+    metadata_json = Column(JSON, nullable=True)
+    
+    created_at = Column(DateTime, default=utcnow)
     
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    __table_args__ = (
+        Index("ix_event_logs_created_id", created_at.desc(), id.desc()),
+        Index("ix_event_logs_type_created", "event_type", created_at.desc(), id.desc()),
+        Index("ix_event_logs_user_created", "user_id", created_at.desc(), id.desc()),
+        Index("ix_event_logs_document", "document_id"),
+    )
     
     # Relationships
     user = relationship("User", back_populates="events")
@@ -2,7 +2,7 @@
 Pydantic schemas for request/response validation.
 """
 from datetime import datetime
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from pydantic import BaseModel, EmailStr, Field
 from enum import Enum
 
@@ -242,6 +242,25 @@ class DocumentResponse(BaseModel):
         from_attributes = True
 
 
+class DocumentUploadUrlRequest(BaseModel):
+    """Request schema for a direct upload to S3."""
+    filename: str = Field(..., min_length=1, max_length=255)
+
+
+class DocumentUploadUrlResponse(BaseModel):
+    """Presigned POST for uploading a document straight to S3."""
+    url: str
+    fields: Dict[str, str]
+    s3_key: str
+    expires_in: int
+
+
+class DocumentRegisterRequest(BaseModel):
+    """Request schema for registering a document uploaded straight to S3."""
+    s3_key: str
+    filename: str = Field(..., min_length=1, max_length=255)
+
+
 class DocumentListResponse(BaseModel):
     """Response schema for listing documents."""
     id: int
@@ -297,10 +316,11 @@ class EventLogResponse(BaseModel):
 
 class EventLogListResponse(BaseModel):
     """Response schema for listing event logs."""
-    total: int
+    total: Optional[int] = None
     page: int
     page_size: int
     events: List[EventLogResponse]
+    next_cursor: Optional[str] = None
 
 
 class EventLogFilter(BaseModel):
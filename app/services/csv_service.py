@@ -1,129 +1,359 @@
 """
 CSV processing and validation service.
 """
+import asyncio
+import codecs
 import csv
-import hashlib
+import gzip
 import io
-from typing import List, Tuple, Dict, Any
-from app.schemas.schemas import ValidationResult
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# Numbers as float() reads them, also accepting a comma as decimal separator
+NUMERIC_PATTERN = re.compile(r"\s*[+-]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][+-]?\d+)?\s*")
+
+# Bytes read at a time while checking whether a file is valid UTF-8
+ENCODING_CHECK_CHUNK_SIZE = 1024 * 1024
+
+
+class CSVValidation(NamedTuple):
+    """
+    Single validation result, with the fields of schemas.ValidationResult.
+    
+    A file can produce one per cell, so they are plain tuples rather than
+    Pydantic models; use _asdict() where a ValidationResult is expected.
+    """
+    validation_type: str
+    message: str
+    row_number: Optional[int] = None
+    column_name: Optional[str] = None
+    severity: str = "warning"
 
 
 class CSVService:
     """Service for CSV file processing and validation."""
     
-    def __init__(self):
+    def __init__(self, process_workers: int = 0):
         self.numeric_columns = {"precio", "cantidad", "monto", "total", "price", "quantity", "amount"}
+        self.process_workers = process_workers
+        self._process_pool: ProcessPoolExecutor | None = None
+    
+    async def validate_and_pack_upload(
+        self,
+        file: BinaryIO,
+        filename: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[bytes, int, List[CSVValidation]]:
+        """
+        Run validate_and_pack_file without blocking the event loop.
+        
+        With process workers configured the file is parsed in a worker
+        process, so concurrent uploads are validated on separate cores
+        instead of taking turns on the GIL; otherwise it runs in the
+        threadpool. The file is read from its current position.
+        """
+        if not self.process_workers:
+            return await run_in_threadpool(self.validate_and_pack_file, file, filename, max_validations)
+        
+        content = await run_in_threadpool(file.read)
+        if self._process_pool is None:
+            # Spawned rather than forked: the server process runs threads
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            self._process_pool, _validate_and_pack_bytes, content, filename, max_validations
+        )
+    
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(cancel_futures=True)
+            self._process_pool = None
     
     def validate_and_process(
         self, 
         file_content: bytes, 
-        filename: str
-    ) -> Tuple[List[Dict[str, Any]], List[ValidationResult]]:
+        filename: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], List[CSVValidation]]:
         """
         Validate and process CSV file content.
         
         Returns:
             Tuple of (parsed_rows, validation_results)
         """
-        validations: List[ValidationResult] = []
-        rows: List[Dict[str, Any]] = []
+        return self.validate_and_process_file(io.BytesIO(file_content), filename, max_validations)
+    
+    def validate_and_process_file(
+        self,
+        file: BinaryIO,
+        filename: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], List[CSVValidation]]:
+        """
+        Validate and process a CSV file object, decoding it as it is read.
+        
+        The file is parsed once, as UTF-8 or, if it is not valid UTF-8,
+        as Latin-1. It must be seekable and is left open. See iter_rows for
+        ``max_validations``.
+        
+        Returns:
+            Tuple of (parsed_rows, validation_results)
+        """
+        return self._validate_text(file, self._detect_encoding(file), max_validations)
+    
+    def validate_and_pack_file(
+        self,
+        file: BinaryIO,
+        filename: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[bytes, int, List[CSVValidation]]:
+        """
+        Validate a CSV file object and pack its rows as they are parsed.
+        
+        Rows are written straight into the rows_to_blob format instead of
+        being collected in a list, so memory grows with the compressed size
+        of the file rather than with its parsed rows. Encoding handling is
+        the same as validate_and_process_file.
+        
+        Returns:
+            Tuple of (rows blob, row count, validation_results)
+        """
+        return self._pack_text(file, self._detect_encoding(file), max_validations)
+    
+    @staticmethod
+    def _detect_encoding(file: BinaryIO) -> str:
+        """
+        Return "utf-8" if the rest of the file is valid UTF-8, else "latin-1".
         
+        UTF-8 files starting with a byte order mark get "utf-8-sig", so the
+        mark is not read into the first header. The check runs the C decoder
+        over the raw bytes, which is much cheaper than parsing the CSV once
+        per candidate encoding. The file is left at the position it had.
+        """
+        start = file.tell()
+        decoder = codecs.getincrementaldecoder("utf-8")()
         try:
-            # Decode content
-            try:
-                content = file_content.decode("utf-8")
-            except UnicodeDecodeError:
-                content = file_content.decode("latin-1")
-            
-            # Parse CSV
-            reader = csv.DictReader(io.StringIO(content))
+            has_bom = file.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8
+            file.seek(start)
+            while chunk := file.read(ENCODING_CHECK_CHUNK_SIZE):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+            return "utf-8-sig" if has_bom else "utf-8"
+        except UnicodeDecodeError:
+            return "latin-1"
+        finally:
+            file.seek(start)
+    
+    def _validate_text(
+        self,
+        file: BinaryIO,
+        encoding: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], List[CSVValidation]]:
+        """Parse and validate a binary file decoded with the given encoding."""
+        validations: List[CSVValidation] = []
+        rows = list(self.iter_rows(file, encoding, validations, max_validations))
+        return rows, validations
+    
+    def _pack_text(
+        self,
+        file: BinaryIO,
+        encoding: str,
+        max_validations: Optional[int] = None
+    ) -> Tuple[bytes, int, List[CSVValidation]]:
+        """Parse, validate and pack a binary file decoded with the given encoding."""
+        validations: List[CSVValidation] = []
+        row_count = 0
+        
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6) as packed:
+            packed.write(b"[\n")
+            for row in self.iter_rows(file, encoding, validations, max_validations):
+                if row_count:
+                    packed.write(b",\n")
+                # Parsed values are already strings or None, so rows are dumped as
+                # they are; rows with extra fields carry them under a None key
+                packed.write(orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS))
+                row_count += 1
+            packed.write(b"\n]")
+        
+        return buffer.getvalue(), row_count, validations
+    
+    def iter_rows(
+        self,
+        file: BinaryIO,
+        encoding: str,
+        validations: List[CSVValidation],
+        max_validations: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Parse a binary CSV file lazily, yielding one row dict at a time.
+        
+        Validation results are appended to ``validations`` as rows are read.
+        Once ``max_validations`` results have been collected, rows are no
+        longer checked for duplicates or bad values; structure errors are
+        still reported. Raises UnicodeDecodeError if the file is not valid
+        in ``encoding``.
+        """
+        text = io.TextIOWrapper(file, encoding=encoding, newline="")
+        try:
+            # Parse CSV; rows are built from the raw field lists, as csv.DictReader
+            # would
+            reader = csv.reader(text)
+            fieldnames = next(reader, None)
             
-            if not reader.fieldnames:
-                validations.append(ValidationResult(
+            if not fieldnames:
+                validations.append(CSVValidation(
                     validation_type="structure_error",
                     message="El archivo CSV no tiene encabezados",
                     severity="error"
                 ))
-                return rows, validations
+                return
             
-            # Track duplicates using row hash
-            seen_hashes: Dict[str, int] = {}
+            field_count = len(fieldnames)
+            numeric_indices = frozenset(
+                index for index, name in enumerate(fieldnames)
+                if name.lower() in self.numeric_columns
+            )
             
-            for row_num, row in enumerate(reader, start=2):  # Start at 2 (1 is header)
-                rows.append(row)
+            # Track duplicates by a 64-bit hash of their field values; rows are
+            # not kept, so this is the only structure that grows with the file
+            seen_rows: Dict[int, int] = {}
+            row_num = 1  # 1 is the header
+            checking_values = True
+            
+            for values in reader:
+                if not values:
+                    continue  # Blank lines are skipped, as csv.DictReader does
+                row_num += 1
+                
+                row = dict(zip(fieldnames, values))
+                if len(values) < field_count:
+                    row.update(dict.fromkeys(fieldnames[len(values):]))
+                
+                if len(values) > field_count:
+                    row[None] = values[field_count:]
+                    validations.append(CSVValidation(
+                        validation_type="structure_error",
+                        row_number=row_num,
+                        message=f"La fila tiene {len(values)} columnas, se esperaban {field_count}",
+                        severity="error"
+                    ))
+                    yield row
+                    continue
+                
+                if checking_values and max_validations is not None and len(validations) >= max_validations:
+                    checking_values = False
+                    validations.append(CSVValidation(
+                        validation_type="validation_limit",
+                        row_number=row_num,
+                        message=f"Se alcanzó el límite de {max_validations} validaciones; "
+                                f"no se revisaron valores desde la fila {row_num}",
+                        severity="warning"
+                    ))
+                if not checking_values:
+                    yield row
+                    continue
                 
                 # Check for duplicate rows
-                row_hash = self._compute_row_hash(row)
-                if row_hash in seen_hashes:
-                    validations.append(ValidationResult(
+                row_key = self._values_hash(values)
+                first_row = seen_rows.get(row_key)
+                if first_row is not None:
+                    validations.append(CSVValidation(
                         validation_type="duplicate_row",
                         row_number=row_num,
-                        message=f"Fila duplicada (igual a fila {seen_hashes[row_hash]})",
+                        message=f"Fila duplicada (igual a fila {first_row})",
                         severity="warning"
                     ))
                 else:
-                    seen_hashes[row_hash] = row_num
+                    seen_rows[row_key] = row_num
                 
-                # Validate each column
-                for col_name, value in row.items():
+                # Validate each column by position, on the raw values
+                for index, value in enumerate(values):
                     # Check for empty values
-                    if value is None or str(value).strip() == "":
-                        validations.append(ValidationResult(
-                            validation_type="empty_value",
+                    if not value or value.isspace():
+                        validations.append(self._empty_value(row_num, fieldnames[index]))
+                    
+                    # Check for type validation on numeric columns
+                    elif index in numeric_indices and not self._is_numeric(value):
+                        col_name = fieldnames[index]
+                        validations.append(CSVValidation(
+                            validation_type="invalid_type",
                             row_number=row_num,
                             column_name=col_name,
-                            message=f"Valor vacío en columna '{col_name}'",
+                            message=f"Tipo incorrecto ('{value}') en columna '{col_name}' - se esperaba número",
                             severity="warning"
                         ))
-                        continue
-                    
-                    # Check for type validation on numeric columns
-                    if col_name.lower() in self.numeric_columns:
-                        if not self._is_numeric(value):
-                            validations.append(ValidationResult(
-                                validation_type="invalid_type",
-                                row_number=row_num,
-                                column_name=col_name,
-                                message=f"Tipo incorrecto ('{value}') en columna '{col_name}' - se esperaba número",
-                                severity="warning"
-                            ))
+                
+                # Columns missing from a short row are empty too
+                for col_name in fieldnames[len(values):]:
+                    validations.append(self._empty_value(row_num, col_name))
+                
+                yield row
             
-            if not rows:
-                validations.append(ValidationResult(
+            if row_num == 1:
+                validations.append(CSVValidation(
                     validation_type="empty_file",
                     message="El archivo CSV no contiene datos",
                     severity="error"
                 ))
                 
         except csv.Error as e:
-            validations.append(ValidationResult(
+            validations.append(CSVValidation(
                 validation_type="parse_error",
                 message=f"Error al parsear CSV: {str(e)}",
                 severity="error"
             ))
+        except UnicodeDecodeError:
+            # Let the caller handle a file that does not match its encoding
+            raise
         except Exception as e:
-            validations.append(ValidationResult(
+            validations.append(CSVValidation(
                 validation_type="unknown_error",
                 message=f"Error desconocido: {str(e)}",
                 severity="error"
             ))
-        
-        return rows, validations
+        finally:
+            # Detach so the caller's file is not closed along with the wrapper
+            text.detach()
+    
+    @staticmethod
+    def _empty_value(row_num: int, col_name: str) -> CSVValidation:
+        """Validation result for an empty value."""
+        return CSVValidation(
+            validation_type="empty_value",
+            row_number=row_num,
+            column_name=col_name,
+            message=f"Valor vacío en columna '{col_name}'",
+            severity="warning"
+        )
     
-    def _compute_row_hash(self, row: Dict[str, Any]) -> str:
-        """Compute a hash for a row to detect duplicates."""
-        # Sort keys for consistent hashing
-        sorted_items = sorted(row.items())
-        row_str = "|".join(f"{k}:{v}" for k, v in sorted_items)
-        return hashlib.md5(row_str.encode()).hexdigest()
+    @staticmethod
+    def _values_hash(values: List[str]) -> int:
+        """Compute a 64-bit hash of a row's field values to detect duplicates."""
+        # Headers are fixed within a file, so the values alone identify a row.
+        # Tuple hashing combines the per-process keyed string hashes without
+        # serializing the row first.
+        return hash(tuple(values))
     
     def _is_numeric(self, value: str) -> bool:
         """Check if a value is numeric."""
-        try:
-            float(str(value).replace(",", "."))
-            return True
-        except (ValueError, TypeError):
-            return False
+        if isinstance(value, str):
+            return NUMERIC_PATTERN.fullmatch(value) is not None
+        return isinstance(value, (int, float))
     
     def rows_to_json(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Convert rows to JSON-serializable format."""
@@ -131,15 +361,50 @@ class CSVService:
             {k: str(v) if v is not None else None for k, v in row.items()}
             for row in rows
         ]
+    
+    def rows_to_blob(self, rows: List[Dict[str, Any]]) -> bytes:
+        """
+        Serialize rows into a single gzip-compressed JSON array.
+        
+        Each row goes on its own line so iter_blob_rows can read the array
+        incrementally; orjson never emits a raw newline inside a value.
+        """
+        body = b",\n".join(orjson.dumps(row) for row in self.rows_to_json(rows))
+        return gzip.compress(b"[\n" + body + b"\n]", compresslevel=6)
+    
+    def blob_to_rows(self, blob: bytes) -> List[Dict[str, Any]]:
+        """Load rows stored with rows_to_blob."""
+        return orjson.loads(gzip.decompress(blob))
+    
+    def iter_blob_rows(self, blob: bytes) -> Iterator[Dict[str, Any]]:
+        """
+        Yield rows stored with rows_to_blob, decompressing only as far as they are read.
+        
+        Blobs written before rows were put on separate lines are loaded whole.
+        """
+        with gzip.GzipFile(fileobj=io.BytesIO(blob)) as packed:
+            first_line = packed.readline()
+            if first_line != b"[\n":
+                yield from orjson.loads(first_line + packed.read())
+                return
+            for line in packed:
+                line = line.rstrip(b",\n")
+                if line == b"]":
+                    return
+                if line:
+                    yield orjson.loads(line)
 
 
-# Singleton instance
-_csv_service: CSVService | None = None
+@lru_cache()
+def get_csv_service() -> CSVService:
+    """Get cached CSV service instance."""
+    return CSVService(process_workers=settings.csv_process_workers)
 
 
-def get_csv_service() -> CSVService:
-    """Get CSV service singleton."""
-    global _csv_service
-    if _csv_service is None:
-        _csv_service = CSVService()
-    return _csv_service
+def _validate_and_pack_bytes(
+    content: bytes,
+    filename: str,
+    max_validations: Optional[int] = None
+) -> Tuple[bytes, int, List[CSVValidation]]:
+    """Worker process entry point for CSVService.validate_and_pack_upload."""
+    return CSVService().validate_and_pack_file(io.BytesIO(content), filename, max_validations)
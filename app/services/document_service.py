@@ -1,30 +1,243 @@
 """
 Document Analysis Service using OpenAI for AI-powered document classification and data extraction.
 """
-import json
+import asyncio
+import orjson
 import base64
+import hashlib
 import io
-from typing import Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 from functools import lru_cache
 
-from openai import AsyncOpenAI
-from PIL import Image
-import PyPDF2
+from fastapi.concurrency import run_in_threadpool
 
+# The OpenAI SDK, Pillow and PyPDF2 are imported where they are used, so
+# workers without an OpenAI key, or that never see an image, don't load them
+
+try:
+    # PDFium extracts text in C; PyPDF2 is only used when it is not installed
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from app.core.cache import TTLCache
 from app.core.config import get_settings
-from app.core.database import SessionLocal
-from app.models.models import Document, InvoiceData, InfoData
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session, joinedload
+from app.models.models import Document, InvoiceData, InfoData, utcnow
 from app.schemas.schemas import (
     DocumentTypeEnum,
     DocumentAnalysisResult,
     InvoiceDataBase,
     InfoDataBase,
-    InvoiceProduct,
     SentimentEnum,
 )
 
 settings = get_settings()
 
+# Used when tiktoken does not know the configured model
+DEFAULT_TOKEN_ENCODING = "o200k_base"
+# Rough characters per token, for truncating when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Characters per token that text is never expected to exceed; bounds how much
+# document text is extracted and tokenized for a token budget
+MAX_CHARS_PER_TOKEN = 16
+# Longest image edge sent to the Vision API; larger images only cost more tiles
+MAX_IMAGE_DIMENSION = 1568
+# MIME types of the accepted document extensions
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png"
+}
+# Batch states after which the batch no longer changes
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# System prompt for every analysis. It is sent first and never changes, so
+# OpenAI's prompt caching can reuse it across requests.
+ANALYSIS_PROMPT = """Analiza el siguiente documento en dos pasos.
+
+PASO 1 - Clasifícalo en una de estas categorías:
+
+1. "factura" - Si el documento contiene datos económicos/financieros como:
+   - Montos, precios, totales
+   - Números de factura
+   - Información de cliente y proveedor
+   - Listado de productos o servicios con precios
+
+2. "informacion" - Si el documento contiene texto general como:
+   - Cartas, memorándums
+   - Documentos informativos
+   - Reportes sin datos financieros detallados
+   - Cualquier documento que no sea una factura
+
+PASO 2 - Extrae los datos según la categoría:
+
+Si es "factura", llena "invoice_data" con:
+1. Información del Cliente: nombre y dirección del cliente
+2. Información del Proveedor: nombre y dirección del proveedor
+3. Detalles de la Factura: número, fecha, total y moneda (si se indica, por defecto MXN)
+4. Productos/Servicios (lista de items): cantidad, nombre/descripción, precio unitario y total del item
+
+Si es "informacion", llena "info_data" con:
+1. Descripción: Una descripción breve del contenido del documento (1-2 oraciones)
+2. Resumen: Un resumen más detallado del contenido (3-5 oraciones)
+3. Análisis de Sentimiento:
+   - Tipo: "positivo", "negativo" o "neutral"
+   - Score: Un valor de -1.0 (muy negativo) a 1.0 (muy positivo)
+4. Temas Clave: Lista de los temas principales del documento
+
+El objeto de la otra categoría debe ser null.
+
+Responde ÚNICAMENTE con un JSON en el siguiente formato:
+{
+    "document_type": "factura" o "informacion",
+    "confidence": 0.0 a 1.0,
+    "invoice_data": {
+        "client_name": "nombre o null",
+        "client_address": "dirección o null",
+        "provider_name": "nombre o null",
+        "provider_address": "dirección o null",
+        "invoice_number": "número o null",
+        "invoice_date": "fecha como string o null",
+        "invoice_total": número o null,
+        "currency": "MXN" u otra moneda,
+        "products": [
+            {
+                "quantity": número o null,
+                "name": "nombre del producto",
+                "unit_price": número o null,
+                "total": número o null
+            }
+        ]
+    } o null,
+    "info_data": {
+        "description": "descripción breve",
+        "summary": "resumen detallado",
+        "sentiment": "positivo", "negativo" o "neutral",
+        "sentiment_score": número de -1.0 a 1.0,
+        "key_topics": ["tema1", "tema2", "tema3"]
+    } o null
+}
+
+Si no puedes extraer algún dato, usa null. Asegúrate de que los números sean valores numéricos, no strings.
+"""
+
+# Structured output schema for ANALYSIS_PROMPT replies. With strict mode the
+# model can only answer with this shape, so replies always parse; every field
+# is required and unknown values are sent as null (the currency defaults to MXN).
+ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "document_analysis",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "document_type": {"type": "string", "enum": ["factura", "informacion"]},
+                "confidence": {"type": "number"},
+                "invoice_data": {
+                    "type": ["object", "null"],
+                    "properties": {
+                        "client_name": {"type": ["string", "null"]},
+                        "client_address": {"type": ["string", "null"]},
+                        "provider_name": {"type": ["string", "null"]},
+                        "provider_address": {"type": ["string", "null"]},
+                        "invoice_number": {"type": ["string", "null"]},
+                        "invoice_date": {"type": ["string", "null"]},
+                        "invoice_total": {"type": ["number", "null"]},
+                        "currency": {"type": "string"},
+                        "products": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "quantity": {"type": ["number", "null"]},
+                                    "name": {"type": ["string", "null"]},
+                                    "unit_price": {"type": ["number", "null"]},
+                                    "total": {"type": ["number", "null"]},
+                                },
+                                "required": ["quantity", "name", "unit_price", "total"],
+                                "additionalProperties": False,
+                            },
+                        },
+                    },
+                    "required": [
+                        "client_name", "client_address", "provider_name", "provider_address",
+                        "invoice_number", "invoice_date", "invoice_total", "currency", "products",
+                    ],
+                    "additionalProperties": False,
+                },
+                "info_data": {
+                    "type": ["object", "null"],
+                    "properties": {
+                        "description": {"type": ["string", "null"]},
+                        "summary": {"type": ["string", "null"]},
+                        "sentiment": {"type": ["string", "null"], "enum": ["positivo", "negativo", "neutral", None]},
+                        "sentiment_score": {"type": ["number", "null"]},
+                        "key_topics": {"type": "array", "items": {"type": "string"}},
+                    },
+                    "required": ["description", "summary", "sentiment", "sentiment_score", "key_topics"],
+                    "additionalProperties": False,
+                },
+            },
+            "required": ["document_type", "confidence", "invoice_data", "info_data"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def _invoice_data_values(analysis_result: DocumentAnalysisResult) -> dict:
+    """Column values of the InvoiceData row for an invoice analysis."""
+    invoice = analysis_result.invoice_data
+    return {
+        "client_name": invoice.client_name,
+        "client_address": invoice.client_address,
+        "provider_name": invoice.provider_name,
+        "provider_address": invoice.provider_address,
+        "invoice_number": invoice.invoice_number,
+        "invoice_date": invoice.invoice_date,
+        "invoice_total": invoice.invoice_total,
+        "currency": invoice.currency,
+        "products_json": [p.model_dump() for p in invoice.products],
+        "raw_text": analysis_result.raw_text,
+    }
+
+
+def _info_data_values(analysis_result: DocumentAnalysisResult) -> dict:
+    """Column values of the InfoData row for an information document analysis."""
+    info = analysis_result.info_data
+    return {
+        "description": info.description,
+        "summary": info.summary,
+        "sentiment": info.sentiment,
+        "sentiment_score": info.sentiment_score,
+        "key_topics_json": list(info.key_topics),
+        "raw_text": analysis_result.raw_text,
+    }
+
+
+@lru_cache()
+def _get_token_encoding(model: str):
+    """Return the tiktoken encoding for a model, or None if it cannot be loaded."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_TOKEN_ENCODING)
+    except Exception as e:
+        print(f"Warning: Failed to load token encoding: {e}")
+        return None
+
 
 class DocumentService:
     """Service class for document analysis using Microsoft Semantic Kernel."""
@@ -34,43 +247,89 @@ class DocumentService:
         self.client = None
         # Use model from settings, fallback to gpt-4o-mini
         self.model = settings.openai_model if settings.openai_model else "gpt-4o-mini"
+        # Analyses of identical files, keyed by the SHA-256 of their content
+        self._analysis_cache = TTLCache(
+            maxsize=settings.document_analysis_cache_size,
+            ttl=settings.document_analysis_cache_ttl_seconds
+        )
+        # Caps concurrent OpenAI calls so bursts of uploads stay under the rate limits
+        self._request_semaphore = asyncio.Semaphore(settings.openai_max_concurrency)
         
         if settings.openai_api_key:
             try:
-                self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+                from openai import AsyncOpenAI
+                
+                self.client = AsyncOpenAI(
+                    api_key=settings.openai_api_key,
+                    max_retries=settings.openai_max_retries,
+                    http_client=self._create_http_client()
+                )
             except Exception as e:
                 print(f"Warning: Failed to initialize OpenAI client: {e}")
                 self.client = None
+    
+    @staticmethod
+    def _create_http_client():
+        """
+        Create the HTTP client used for OpenAI requests.
         
-        self.db = SessionLocal()
+        The aiohttp transport holds up much better than httpx's under many
+        concurrent requests; httpx is used when the aiohttp extra is missing.
+        The pool is sized so concurrent analyses are limited by the API rate
+        limit rather than by waiting for a free connection.
+        """
+        import httpx
+        from openai import DefaultAioHttpClient, DefaultAsyncHttpxClient
+        
+        options = {
+            "limits": httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+            ),
+            "timeout": httpx.Timeout(settings.openai_timeout),
+        }
+        try:
+            return DefaultAioHttpClient(**options)
+        except RuntimeError:
+            return DefaultAsyncHttpxClient(**options)
+    
+    async def aclose(self):
+        """Close the OpenAI client and its connection pool."""
+        if self.client is not None:
+            await self.client.close()
     
     def _is_ai_available(self) -> bool:
         """Check if AI service is available."""
         return self.client is not None and settings.openai_api_key
     
-    def _save_to_database(self, document: Document):
+    def _save_to_database(self, db: Session, document: Document):
         """Save or update document in database."""
         try:
-            self.db.merge(document)
-            self.db.commit()
+            db.merge(document)
+            db.commit()
         except Exception as e:
-            self.db.rollback()
+            db.rollback()
             print(f"Error saving document to database: {e}")
     
-    def _get_document_by_s3_key(self, s3_key: str) -> Optional[Document]:
-        """Retrieve document from database by S3 key."""
+    def _get_document_by_s3_key(self, db: Session, s3_key: str, *options) -> Optional[Document]:
+        """Retrieve document from database by S3 key, applying any loader options."""
         try:
             from app.models.models import Document as DocumentModel
-            return self.db.query(DocumentModel).filter(DocumentModel.s3_key == s3_key).first()
+            return (
+                db.query(DocumentModel)
+                .options(*options)
+                .filter(DocumentModel.s3_key == s3_key)
+                .first()
+            )
         except Exception as e:
             print(f"Error retrieving document: {e}")
             return None
     
-    def get_all_documents(self, user_id: int = None) -> list:
+    def get_all_documents(self, db: Session, user_id: int = None) -> list:
         """Retrieve all documents from database, optionally filtered by user."""
         try:
             from app.models.models import Document as DocumentModel
-            query = self.db.query(DocumentModel)
+            query = db.query(DocumentModel)
             if user_id:
                 query = query.filter(DocumentModel.user_id == user_id)
             return query.all()
@@ -78,20 +337,20 @@ class DocumentService:
             print(f"Error retrieving documents: {e}")
             return []
     
-    def get_document_by_id(self, doc_id: int) -> Optional[Document]:
+    def get_document_by_id(self, db: Session, doc_id: int) -> Optional[Document]:
         """Retrieve specific document from database by ID."""
         try:
             from app.models.models import Document as DocumentModel
-            return self.db.query(DocumentModel).filter(DocumentModel.id == doc_id).first()
+            return db.query(DocumentModel).filter(DocumentModel.id == doc_id).first()
         except Exception as e:
             print(f"Error retrieving document by ID: {e}")
             return None
     
-    def query_invoices(self, user_id: int = None) -> list:
+    def query_invoices(self, db: Session, user_id: int = None) -> list:
         """Query all invoices from database, optionally filtered by user."""
         try:
             from app.models.models import Document as DocumentModel, InvoiceData
-            query = self.db.query(InvoiceData).join(DocumentModel)
+            query = db.query(InvoiceData).join(DocumentModel)
             if user_id:
                 query = query.filter(DocumentModel.user_id == user_id)
             return query.all()
@@ -99,11 +358,11 @@ class DocumentService:
             print(f"Error querying invoices: {e}")
             return []
     
-    def query_info_documents(self, user_id: int = None) -> list:
+    def query_info_documents(self, db: Session, user_id: int = None) -> list:
         """Query all information documents from database, optionally filtered by user."""
         try:
             from app.models.models import Document as DocumentModel, InfoData
-            query = self.db.query(InfoData).join(DocumentModel)
+            query = db.query(InfoData).join(DocumentModel)
             if user_id:
                 query = query.filter(DocumentModel.user_id == user_id)
             return query.all()
@@ -111,113 +370,173 @@ class DocumentService:
             print(f"Error querying info documents: {e}")
             return []
     
-    def _extract_text_from_pdf(self, file_content: bytes) -> str:
-        """Extract text content from PDF file."""
+    def store_analysis_result(
+        self,
+        db: Session,
+        document: Document,
+        analysis_result: DocumentAnalysisResult
+    ) -> Tuple[Optional[InvoiceData], Optional[InfoData]]:
+        """
+        Apply an analysis result to a document and add its extracted data to the session.
+        
+        Nothing is committed.
+        
+        Returns:
+            Tuple of (invoice_data, info_data), either of which may be None
+        """
+        document.document_type = analysis_result.document_type.value
+        document.analysis_status = "completed"
+        
+        invoice_data = None
+        info_data = None
+        
+        if analysis_result.document_type.value == "factura" and analysis_result.invoice_data:
+            invoice_data = InvoiceData(document_id=document.id, **_invoice_data_values(analysis_result))
+            db.add(invoice_data)
+        
+        elif analysis_result.document_type.value == "informacion" and analysis_result.info_data:
+            info_data = InfoData(document_id=document.id, **_info_data_values(analysis_result))
+            db.add(info_data)
+        
+        return invoice_data, info_data
+    
+    def store_analysis_results(
+        self,
+        db: Session,
+        analyses: List[Tuple[Document, DocumentAnalysisResult]]
+    ):
+        """
+        Apply many analysis results at once, e.g. from a batch analysis.
+        
+        Data extracted by an earlier analysis of the same documents is deleted
+        first, since each document has at most one InvoiceData/InfoData row.
+        The new data goes in as one multi-row INSERT per table instead of one
+        INSERT ... RETURNING per document, since the new row ids are not
+        needed. Nothing is committed.
+        """
+        document_ids = [document.id for document, _ in analyses]
+        if not document_ids:
+            return
+        db.execute(
+            delete(InvoiceData).where(InvoiceData.document_id.in_(document_ids)),
+            execution_options={"synchronize_session": False}
+        )
+        db.execute(
+            delete(InfoData).where(InfoData.document_id.in_(document_ids)),
+            execution_options={"synchronize_session": False}
+        )
+        
+        created_at = utcnow()
+        invoice_rows = []
+        info_rows = []
+        
+        for document, analysis_result in analyses:
+            document.document_type = analysis_result.document_type.value
+            document.analysis_status = "completed"
+            document.analysis_error = None
+            
+            if analysis_result.document_type.value == "factura" and analysis_result.invoice_data:
+                invoice_rows.append({
+                    "document_id": document.id, "created_at": created_at,
+                    **_invoice_data_values(analysis_result)
+                })
+            elif analysis_result.document_type.value == "informacion" and analysis_result.info_data:
+                info_rows.append({
+                    "document_id": document.id, "created_at": created_at,
+                    **_info_data_values(analysis_result)
+                })
+        
+        # render_nulls keeps rows with missing values in the same batch
+        if invoice_rows:
+            db.execute(insert(InvoiceData), invoice_rows, execution_options={"render_nulls": True})
+        if info_rows:
+            db.execute(insert(InfoData), info_rows, execution_options={"render_nulls": True})
+    
+    def _extract_text_from_pdf(self, file_content: bytes, max_chars: Optional[int] = None) -> str:
+        """
+        Extract text content from PDF file.
+        
+        Pages are read in order; once ``max_chars`` characters have been
+        collected the remaining pages are skipped.
+        """
         try:
+            if pdfium is not None:
+                pdf = pdfium.PdfDocument(file_content)
+                try:
+                    page_texts = (page.get_textpage().get_text_range() for page in pdf)
+                    return self._join_page_texts(page_texts, max_chars)
+                finally:
+                    pdf.close()
+            
+            import PyPDF2
+            
             pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
-            return text.strip()
+            page_texts = (page.extract_text() or "" for page in pdf_reader.pages)
+            return self._join_page_texts(page_texts, max_chars)
         except Exception as e:
             print(f"Error extracting PDF text: {e}")
             return ""
     
-    def _encode_image_to_base64(self, file_content: bytes, content_type: str) -> str:
-        """Encode image to base64 for OpenAI Vision API."""
-        base64_image = base64.b64encode(file_content).decode('utf-8')
-        return f"data:{content_type};base64,{base64_image}"
+    def _max_document_chars(self) -> int:
+        """Most document text an analysis can use; PDF extraction stops there."""
+        return settings.openai_max_document_tokens * MAX_CHARS_PER_TOKEN
     
-    def _get_classification_prompt(self) -> str:
-        """Get the prompt for document classification."""
-        return """Analiza el siguiente documento y clasifícalo en una de estas categorías:
-
-1. "factura" - Si el documento contiene datos económicos/financieros como:
-   - Montos, precios, totales
-   - Números de factura
-   - Información de cliente y proveedor
-   - Listado de productos o servicios con precios
-
-2. "informacion" - Si el documento contiene texto general como:
-   - Cartas, memorándums
-   - Documentos informativos
-   - Reportes sin datos financieros detallados
-   - Cualquier documento que no sea una factura
-
-Responde ÚNICAMENTE con un JSON en el siguiente formato:
-{
-    "document_type": "factura" o "informacion",
-    "confidence": 0.0 a 1.0
-}
-"""
+    @staticmethod
+    def _join_page_texts(page_texts: Iterator[str], max_chars: Optional[int]) -> str:
+        """Join page texts with newlines, stopping once max_chars have been collected."""
+        parts = []
+        total = 0
+        for text in page_texts:
+            parts.append(text)
+            total += len(text) + 1
+            if max_chars is not None and total >= max_chars:
+                break
+        return "\n".join(parts).strip()
     
-    def _get_invoice_extraction_prompt(self) -> str:
-        """Get the prompt for invoice data extraction."""
-        return """Extrae los siguientes datos de esta factura:
-
-1. Información del Cliente:
-   - Nombre del cliente
-   - Dirección del cliente
-
-2. Información del Proveedor:
-   - Nombre del proveedor
-   - Dirección del proveedor
-
-3. Detalles de la Factura:
-   - Número de factura
-   - Fecha de la factura
-   - Total de la factura
-   - Moneda (si se indica, por defecto MXN)
-
-4. Productos/Servicios (lista de items):
-   - Cantidad
-   - Nombre/Descripción
-   - Precio unitario
-   - Total del item
-
-Responde ÚNICAMENTE con un JSON en el siguiente formato:
-{
-    "client_name": "nombre o null",
-    "client_address": "dirección o null",
-    "provider_name": "nombre o null",
-    "provider_address": "dirección o null",
-    "invoice_number": "número o null",
-    "invoice_date": "fecha como string o null",
-    "invoice_total": número o null,
-    "currency": "MXN" u otra moneda,
-    "products": [
-        {
-            "quantity": número o null,
-            "name": "nombre del producto",
-            "unit_price": número o null,
-            "total": número o null
-        }
-    ]
-}
-
-Si no puedes extraer algún dato, usa null. Asegúrate de que los números sean valores numéricos, no strings.
-"""
+    def _truncate_to_tokens(self, text: str, max_tokens: int) -> str:
+        """Cut text down to at most max_tokens tokens of the configured model."""
+        encoding = _get_token_encoding(self.model)
+        if encoding is None:
+            return text[:max_tokens * CHARS_PER_TOKEN]
+        
+        # Don't tokenize a whole long document
+        text = text[:max_tokens * MAX_CHARS_PER_TOKEN]
+        tokens = encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
     
-    def _get_info_extraction_prompt(self) -> str:
-        """Get the prompt for information document extraction."""
-        return """Analiza este documento informativo y extrae:
-
-1. Descripción: Una descripción breve del contenido del documento (1-2 oraciones)
-2. Resumen: Un resumen más detallado del contenido (3-5 oraciones)
-3. Análisis de Sentimiento:
-   - Tipo: "positivo", "negativo" o "neutral"
-   - Score: Un valor de -1.0 (muy negativo) a 1.0 (muy positivo)
-4. Temas Clave: Lista de los temas principales del documento
-
-Responde ÚNICAMENTE con un JSON en el siguiente formato:
-{
-    "description": "descripción breve",
-    "summary": "resumen detallado",
-    "sentiment": "positivo", "negativo" o "neutral",
-    "sentiment_score": número de -1.0 a 1.0,
-    "key_topics": ["tema1", "tema2", "tema3"]
-}
-"""
+    def _downscale_image(self, file_content: bytes, content_type: str) -> Tuple[bytes, str]:
+        """Re-encode images larger than MAX_IMAGE_DIMENSION as a JPEG that fits within it."""
+        try:
+            from PIL import Image, ImageOps
+            
+            with Image.open(io.BytesIO(file_content)) as image:
+                if max(image.size) <= MAX_IMAGE_DIMENSION:
+                    return file_content, content_type
+                
+                # Lets JPEG decode straight at a reduced scale
+                image.draft("RGB", (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+                # Re-encoding drops EXIF, so apply its rotation to the pixels first
+                resized = ImageOps.exif_transpose(image).convert("RGB")
+                resized.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.Resampling.LANCZOS)
+                
+                buffer = io.BytesIO()
+                resized.save(buffer, "JPEG", quality=85, optimize=True)
+                return buffer.getvalue(), "image/jpeg"
+        except Exception as e:
+            print(f"Error resizing image: {e}")
+            return file_content, content_type
+    
+    def _encode_image_to_base64(self, file_content: bytes, content_type: str) -> str:
+        """Encode image to base64 for OpenAI Vision API, downscaling large images first."""
+        file_content, content_type = self._downscale_image(file_content, content_type)
+        base64_image = base64.b64encode(file_content).decode('ascii')
+        return f"data:{content_type};base64,{base64_image}"
+    
+    def _get_analysis_prompt(self) -> str:
+        """Get the prompt that classifies a document and extracts its data in one pass."""
+        return ANALYSIS_PROMPT
     
     async def analyze_document(
         self,
@@ -225,11 +544,13 @@ Responde ÚNICAMENTE con un JSON en el siguiente formato:
         content_type: str,
         filename: str,
         s3_key: str = None,
-        user_id: int = None
+        user_id: int = None,
+        db: Optional[Session] = None,
+        use_cache: bool = True
     ) -> DocumentAnalysisResult:
         """
         Analyze a document using Semantic Kernel to classify and extract data.
-        Results are stored in the SQL database.
+        Results are stored in the SQL database when a session and S3 key are given.
         
         Args:
             file_content: The document content as bytes
@@ -237,6 +558,9 @@ Responde ÚNICAMENTE con un JSON en el siguiente formato:
             filename: Original filename
             s3_key: S3 key for file location
             user_id: User ID who uploaded the document
+            db: Database session used to store the results
+            use_cache: Reuse an earlier analysis of the same content; when False
+                the document is always sent to OpenAI and the cached entry replaced
             
         Returns:
             DocumentAnalysisResult with classification and extracted data
@@ -251,41 +575,43 @@ Responde ÚNICAMENTE con un JSON en el siguiente formato:
                 info_data=None
             )
         
-        # Extract text or prepare image for analysis
-        raw_text = ""
-        is_image = content_type.startswith("image/")
+        # An object already analyzed under this S3 key keeps its stored result
+        if s3_key and db is not None and use_cache:
+            existing = await run_in_threadpool(self._get_stored_analysis, db, s3_key)
+            if existing is not None:
+                return self._hydrate_result(existing)
         
-        if content_type == "application/pdf":
-            raw_text = self._extract_text_from_pdf(file_content)
+        # The same file always gets the same analysis; reuse it instead of calling OpenAI again.
+        # Hashing and PDF parsing run in the threadpool so other analyses keep
+        # progressing on the event loop meanwhile.
+        cache_key = (await run_in_threadpool(hashlib.sha256, file_content)).digest()
+        cached = self._analysis_cache.get(cache_key) if use_cache else None
         
-        # Step 1: Classify the document
-        doc_type, confidence = await self._classify_document(
-            file_content, content_type, raw_text, is_image
-        )
-        
-        # Step 2: Extract data based on classification
-        invoice_data = None
-        info_data = None
-        
-        if doc_type == DocumentTypeEnum.FACTURA:
-            invoice_data, extraction_text = await self._extract_invoice_data(
-                file_content, content_type, raw_text, is_image
-            )
-            raw_text = extraction_text or raw_text
+        if cached is not None:
+            doc_type, confidence = cached.document_type, cached.confidence
+            invoice_data, info_data = cached.invoice_data, cached.info_data
+            raw_text = cached.raw_text
         else:
-            info_data, extraction_text = await self._extract_info_data(
+            # Extract text or prepare image for analysis
+            raw_text = ""
+            is_image = content_type.startswith("image/")
+            
+            if content_type == "application/pdf":
+                raw_text = await run_in_threadpool(
+                    self._extract_text_from_pdf, file_content, self._max_document_chars()
+                )
+            
+            # Steps 1 and 2: Classify the document and extract its data in one call
+            doc_type, confidence, invoice_data, info_data = await self._classify_and_extract(
                 file_content, content_type, raw_text, is_image
             )
-            raw_text = extraction_text or raw_text
         
         # Step 3: Save to database
-        if s3_key:
+        if s3_key and db is not None:
             try:
                 from app.models.models import Document as DocumentModel
                 from app.models.models import InvoiceData as InvoiceDataModel
                 from app.models.models import InfoData as InfoDataModel
-                from app.models.models import InvoiceProduct as InvoiceProductModel
-                from datetime import datetime
                 
                 document = DocumentModel(
                     filename=filename,
@@ -298,13 +624,12 @@ Responde ÚNICAMENTE con un JSON en el siguiente formato:
                     user_id=user_id
                 )
                 
-                self.db.add(document)
-                self.db.flush()  # Flush to get the document ID
+                # Extracted data is attached through the relationship, so one
+                # commit inserts the document first and fills in its ID
                 
                 # If invoice data, save to database
                 if invoice_data:
-                    inv = InvoiceDataModel(
-                        document_id=document.id,
+                    document.invoice_data = InvoiceDataModel(
                         client_name=invoice_data.client_name,
                         client_address=invoice_data.client_address,
                         provider_name=invoice_data.provider_name,
@@ -313,214 +638,281 @@ Responde ÚNICAMENTE con un JSON en el siguiente formato:
                         invoice_date=invoice_data.invoice_date,
                         invoice_total=invoice_data.invoice_total,
                         currency=invoice_data.currency,
-                        products_json=json.dumps([p.dict() for p in invoice_data.products]) if invoice_data.products else "[]",
+                        products_json=[p.model_dump() for p in invoice_data.products],
                         raw_text=raw_text
                     )
-                    self.db.add(inv)
                 
                 # If info data, save to database
                 if info_data:
-                    info = InfoDataModel(
-                        document_id=document.id,
+                    document.info_data = InfoDataModel(
                         description=info_data.description,
                         summary=info_data.summary,
                         sentiment=info_data.sentiment,
                         sentiment_score=info_data.sentiment_score,
-                        key_topics_json=json.dumps(info_data.key_topics) if info_data.key_topics else "[]",
+                        key_topics_json=list(info_data.key_topics),
                         raw_text=raw_text
                     )
-                    self.db.add(info)
                 
-                self.db.commit()
+                db.add(document)
+                db.commit()
                     
             except Exception as e:
-                self.db.rollback()
+                db.rollback()
                 print(f"Error saving analysis results to database: {e}")
         
-        return DocumentAnalysisResult(
+        result = DocumentAnalysisResult(
             document_type=doc_type,
             confidence=confidence,
             invoice_data=invoice_data,
             info_data=info_data,
             raw_text=raw_text
         )
+        
+        # Only successful analyses are cached, so failures are retried next time
+        if cached is None and (invoice_data or info_data):
+            self._analysis_cache.set(cache_key, result)
+        
+        return result
+    
+    def _get_stored_analysis(self, db: Session, s3_key: str) -> Optional[Document]:
+        """Return the completed document stored under an S3 key with its extracted data."""
+        document = self._get_document_by_s3_key(
+            db,
+            s3_key,
+            joinedload(Document.invoice_data).undefer(InvoiceData.raw_text),
+            joinedload(Document.info_data).undefer(InfoData.raw_text),
+        )
+        if document is None or document.analysis_status != "completed":
+            return None
+        return document
+    
+    @staticmethod
+    def _hydrate_result(document: Document) -> DocumentAnalysisResult:
+        """Rebuild the analysis result of a stored document."""
+        invoice_data = info_data = None
+        raw_text = ""
+        
+        if document.invoice_data is not None:
+            stored = document.invoice_data
+            invoice_data = InvoiceDataBase.model_validate({
+                "client_name": stored.client_name,
+                "client_address": stored.client_address,
+                "provider_name": stored.provider_name,
+                "provider_address": stored.provider_address,
+                "invoice_number": stored.invoice_number,
+                "invoice_date": stored.invoice_date,
+                "invoice_total": stored.invoice_total,
+                "currency": stored.currency or "MXN",
+                "products": stored.products_json or [],
+            })
+            raw_text = stored.raw_text or ""
+        
+        if document.info_data is not None:
+            stored = document.info_data
+            info_data = InfoDataBase.model_validate({
+                "description": stored.description,
+                "summary": stored.summary,
+                "sentiment": stored.sentiment,
+                "sentiment_score": stored.sentiment_score,
+                "key_topics": stored.key_topics_json or [],
+            })
+            raw_text = stored.raw_text or ""
+        
+        # Confidence is not stored; a completed analysis is reported as certain
+        return DocumentAnalysisResult(
+            document_type=DocumentTypeEnum(document.document_type),
+            confidence=1.0,
+            invoice_data=invoice_data,
+            info_data=info_data,
+            raw_text=raw_text
+        )
     
-    async def _classify_document(
+    async def _classify_and_extract(
         self,
         file_content: bytes,
         content_type: str,
         raw_text: str,
         is_image: bool
-    ) -> Tuple[DocumentTypeEnum, float]:
-        """Classify the document type using OpenAI."""
+    ) -> Tuple[DocumentTypeEnum, float, Optional[InvoiceDataBase], Optional[InfoDataBase]]:
+        """
+        Classify the document and extract its data with a single OpenAI call.
+        
+        Returns:
+            Tuple of (document type, confidence, invoice data, info data); only
+            the data matching the document type is set
+        """
         try:
-            # Build the prompt with document content
-            system_prompt = self._get_classification_prompt()
-            
-            if is_image:
-                base64_image = self._encode_image_to_base64(file_content, content_type)
-                user_message = f"Clasifica este documento:\n\n{base64_image}"
-            else:
-                user_message = f"Clasifica este documento:\n\n{raw_text[:4000]}"
-            
-            # Call OpenAI API
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            
-            result_text = response.choices[0].message.content.strip()
-            
-            # Clean up the response if it contains markdown code blocks
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0]
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0]
-            
-            result = json.loads(result_text)
-            doc_type = DocumentTypeEnum(result.get("document_type", "informacion"))
-            confidence = float(result.get("confidence", 0.5))
-            
-            return doc_type, confidence
-            
+            request = await self._build_analysis_request(file_content, content_type, raw_text, is_image)
+            async with self._request_semaphore:
+                response = await self.client.chat.completions.create(**request)
+            return self._parse_analysis_reply(response.choices[0].message.content)
         except Exception as e:
-            print(f"Error classifying document: {e}")
-            return DocumentTypeEnum.INFORMACION, 0.0
+            print(f"Error analyzing document: {e}")
+            return DocumentTypeEnum.INFORMACION, 0.0, None, None
     
-    async def _extract_invoice_data(
+    async def _build_analysis_request(
         self,
         file_content: bytes,
         content_type: str,
         raw_text: str,
         is_image: bool
-    ) -> Tuple[Optional[InvoiceDataBase], str]:
-        """Extract invoice data using OpenAI."""
-        try:
-            system_prompt = self._get_invoice_extraction_prompt()
-            
-            if is_image:
-                base64_image = self._encode_image_to_base64(file_content, content_type)
-                user_message = f"Extrae los datos de esta factura:\n\n{base64_image}"
-            else:
-                user_message = f"Extrae los datos de esta factura:\n\n{raw_text[:8000]}"
-            
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
+    ) -> dict:
+        """Build the chat completion arguments that analyze one document."""
+        if is_image:
+            base64_image = await run_in_threadpool(
+                self._encode_image_to_base64, file_content, content_type
             )
-            
-            result_text = response.choices[0].message.content.strip()
-            
-            # Clean up the response
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0]
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0]
-            
-            result = json.loads(result_text)
-            
-            # Parse products
-            products = []
-            for p in result.get("products", []):
-                products.append(InvoiceProduct(
-                    quantity=p.get("quantity"),
-                    name=p.get("name"),
-                    unit_price=p.get("unit_price"),
-                    total=p.get("total")
-                ))
-            
-            invoice_data = InvoiceDataBase(
-                client_name=result.get("client_name"),
-                client_address=result.get("client_address"),
-                provider_name=result.get("provider_name"),
-                provider_address=result.get("provider_address"),
-                invoice_number=result.get("invoice_number"),
-                invoice_date=result.get("invoice_date"),
-                invoice_total=result.get("invoice_total"),
-                currency=result.get("currency", "MXN"),
-                products=products
-            )
-            
-            return invoice_data, raw_text
-            
-        except Exception as e:
-            print(f"Error extracting invoice data: {e}")
-            return None, raw_text
+            # Sent as an image part so it is read by the vision model and billed
+            # per image tile, not as base64 text tokens
+            user_message = [
+                {"type": "text", "text": "Analiza este documento:"},
+                {"type": "image_url", "image_url": {"url": base64_image}},
+            ]
+        else:
+            document_text = self._truncate_to_tokens(raw_text, settings.openai_max_document_tokens)
+            user_message = f"Analiza este documento:\n\n{document_text}"
+        
+        # Structured outputs make the model answer with a bare JSON object
+        # matching ANALYSIS_RESPONSE_FORMAT
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self._get_analysis_prompt()},
+                {"role": "user", "content": user_message}
+            ],
+            "response_format": ANALYSIS_RESPONSE_FORMAT,
+        }
     
-    async def _extract_info_data(
+    def _parse_analysis_reply(
         self,
-        file_content: bytes,
-        content_type: str,
-        raw_text: str,
-        is_image: bool
-    ) -> Tuple[Optional[InfoDataBase], str]:
-        """Extract information document data using OpenAI."""
+        content: str
+    ) -> Tuple[DocumentTypeEnum, float, Optional[InvoiceDataBase], Optional[InfoDataBase]]:
+        """
+        Parse the model's JSON reply to an analysis request.
+        
+        Raises if the reply or its classification cannot be read; a bad data
+        object only leaves that data empty.
+        """
+        result = orjson.loads(content)
+        doc_type = DocumentTypeEnum(result.get("document_type", "informacion"))
+        confidence = float(result.get("confidence", 0.5))
+        
+        # A bad data object does not invalidate the classification
+        invoice_data = None
+        info_data = None
         try:
-            system_prompt = self._get_info_extraction_prompt()
+            if doc_type == DocumentTypeEnum.FACTURA:
+                if result.get("invoice_data"):
+                    invoice_data = self._parse_invoice_data(result["invoice_data"])
+            elif result.get("info_data"):
+                info_data = self._parse_info_data(result["info_data"])
+        except Exception as e:
+            print(f"Error extracting {doc_type.value} data: {e}")
+        
+        return doc_type, confidence, invoice_data, info_data
+    
+    async def analyze_documents_batch(
+        self,
+        documents: List[Tuple[str, bytes, str]],
+        poll_interval: float = 60.0
+    ) -> Dict[str, DocumentAnalysisResult]:
+        """
+        Analyze many documents through the OpenAI Batch API.
+        
+        Batch requests cost about half as much as regular calls but can take
+        up to 24 hours, so this is meant for backfills and other non-interactive
+        imports. Nothing is stored; the caller saves the results.
+        
+        Args:
+            documents: (custom_id, file_content, content_type) for each document
+            poll_interval: Seconds between batch status checks
             
-            if is_image:
-                base64_image = self._encode_image_to_base64(file_content, content_type)
-                user_message = f"Analiza este documento:\n\n{base64_image}"
-            else:
-                user_message = f"Analiza este documento:\n\n{raw_text[:8000]}"
+        Returns:
+            Analysis results by custom_id; documents whose request failed are missing
+        """
+        if not self._is_ai_available() or not documents:
+            return {}
+        
+        raw_texts = {}
+        lines = []
+        for custom_id, file_content, content_type in documents:
+            raw_text = ""
+            if content_type == "application/pdf":
+                raw_text = await run_in_threadpool(
+                    self._extract_text_from_pdf, file_content, self._max_document_chars()
+                )
+            raw_texts[custom_id] = raw_text
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
+            body = await self._build_analysis_request(
+                file_content, content_type, raw_text, content_type.startswith("image/")
             )
+            lines.append(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }))
+        
+        batch_file = await self.client.files.create(
+            file=("document_analysis.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        while batch.status not in BATCH_FINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            batch = await self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or not batch.output_file_id:
+            print(f"Document analysis batch {batch.id} ended as {batch.status}")
+            return {}
+        
+        output = await self.client.files.content(batch.output_file_id)
+        
+        results = {}
+        for line in output.content.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            custom_id = item.get("custom_id")
+            response = item.get("response") or {}
+            if response.get("status_code") != 200 or custom_id not in raw_texts:
+                continue
             
-            result_text = response.choices[0].message.content.strip()
-            
-            # Clean up the response
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0]
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0]
-            
-            result = json.loads(result_text)
+            try:
+                doc_type, confidence, invoice_data, info_data = self._parse_analysis_reply(
+                    response["body"]["choices"][0]["message"]["content"]
+                )
+            except Exception as e:
+                print(f"Error reading batch analysis for {custom_id}: {e}")
+                continue
             
-            info_data = InfoDataBase(
-                description=result.get("description"),
-                summary=result.get("summary"),
-                sentiment=result.get("sentiment"),
-                sentiment_score=result.get("sentiment_score"),
-                key_topics=result.get("key_topics", [])
+            results[custom_id] = DocumentAnalysisResult(
+                document_type=doc_type,
+                confidence=confidence,
+                invoice_data=invoice_data,
+                info_data=info_data,
+                raw_text=raw_texts[custom_id]
             )
-            
-            return info_data, raw_text
-            
-        except Exception as e:
-            print(f"Error extracting info data: {e}")
-            return None, raw_text
+        
+        return results
     
-    def get_content_type(self, filename: str) -> str:
-        """Get MIME type based on file extension."""
-        ext = filename.rsplit(".", 1)[-1].lower()
-        content_types = {
-            "pdf": "application/pdf",
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg",
-            "png": "image/png"
-        }
-        return content_types.get(ext, "application/octet-stream")
+    def _parse_invoice_data(self, result: dict) -> InvoiceDataBase:
+        """Build invoice data, including its products, from the extracted JSON object."""
+        # Validated by pydantic-core in one pass; unknown keys are ignored
+        return InvoiceDataBase.model_validate(result)
     
-    def close(self):
-        """Close database session."""
-        if self.db:
-            self.db.close()
+    def _parse_info_data(self, result: dict) -> InfoDataBase:
+        """Build information document data from the extracted JSON object."""
+        return InfoDataBase.model_validate(result)
     
-    def __del__(self):
-        """Cleanup when service is destroyed."""
-        self.close()
+    def get_content_type(self, filename: str) -> str:
+        """Get MIME type based on file extension."""
+        return CONTENT_TYPES.get(filename.rpartition(".")[2].lower(), "application/octet-stream")
 
 
 @lru_cache()
@@ -1,15 +1,19 @@
 """
 Event Log Service for historical tracking of system events.
 """
-import json
+import threading
+import time
 from datetime import datetime
-from typing import Optional, List, BinaryIO
-from io import BytesIO
+from typing import Callable, Optional, List, BinaryIO
+from tempfile import SpooledTemporaryFile
 from functools import lru_cache
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy import and_, or_, text
 
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.core.pagination import paginate_keyset
 from app.models.models import EventLog, EventType, User
 from app.schemas.schemas import (
     EventLogCreate,
@@ -18,10 +22,38 @@ from app.schemas.schemas import (
     EventTypeEnum,
 )
 
+settings = get_settings()
+
+# Load the username with each page of events in one extra query, and fail
+# loudly if anything else would be lazy-loaded per row
+_EVENT_LOAD_OPTIONS = (
+    selectinload(EventLog.user).load_only(User.id, User.username),
+    raiseload("*"),
+)
+
+# Event type labels used in the Excel export
+EXPORT_EVENT_TYPE_LABELS = {
+    "subida_documento": "Subida de Documento",
+    "analisis_ia": "Análisis IA",
+    "interaccion_usuario": "Interacción Usuario",
+    "sistema": "Sistema"
+}
+
+# Rows fetched per round trip while exporting
+EXPORT_BATCH_SIZE = 1000
+# Exports larger than this are spooled to disk instead of memory
+EXPORT_SPOOL_MAX_BYTES = 10 * 1024 * 1024
+
 
 class EventService:
     """Service class for event logging and history management."""
     
+    def __init__(self):
+        # Events logged from background tasks, waiting to be written in one batch
+        self._pending: List[EventLog] = []
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+    
     def create_event(
         self,
         db: Session,
@@ -29,7 +61,8 @@ class EventService:
         description: str,
         user_id: Optional[int] = None,
         document_id: Optional[int] = None,
-        metadata: Optional[dict] = None
+        metadata: Optional[dict] = None,
+        commit: bool = True
     ) -> EventLog:
         """
         Create a new event log entry.
@@ -41,6 +74,8 @@ class EventService:
             user_id: Optional user ID
             document_id: Optional document ID
             metadata: Optional additional metadata
+            commit: Commit right away; when False the event is only added to
+                the session and is written by the caller's commit
             
         Returns:
             Created EventLog instance
@@ -50,41 +85,27 @@ class EventService:
             description=description,
             user_id=user_id,
             document_id=document_id,
-            metadata_json=json.dumps(metadata) if metadata else None,
+            metadata_json=metadata or None,
         )
         
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        if commit:
+            db.commit()
         
         return event
     
     def get_event(self, db: Session, event_id: int) -> Optional[EventLog]:
         """Get a single event by ID."""
-        return db.query(EventLog).filter(EventLog.id == event_id).first()
+        return (
+            db.query(EventLog)
+            .options(*_EVENT_LOAD_OPTIONS)
+            .filter(EventLog.id == event_id)
+            .first()
+        )
     
-    def get_events(
-        self,
-        db: Session,
-        filters: Optional[EventLogFilter] = None,
-        page: int = 1,
-        page_size: int = 20
-    ) -> tuple[List[EventLog], int]:
-        """
-        Get events with optional filtering and pagination.
-        
-        Args:
-            db: Database session
-            filters: Optional filters to apply
-            page: Page number (1-indexed)
-            page_size: Number of items per page
-            
-        Returns:
-            Tuple of (list of events, total count)
-        """
-        query = db.query(EventLog)
-        
-        # Apply filters
+    @staticmethod
+    def _apply_filters(query, filters: Optional[EventLogFilter]):
+        """Restrict an EventLog query to the given filters."""
         if filters:
             conditions = []
             
@@ -108,67 +129,139 @@ class EventService:
             if conditions:
                 query = query.filter(and_(*conditions))
         
-        # Get total count
-        total = query.count()
+        return query
+    
+    def get_events(
+        self,
+        db: Session,
+        filters: Optional[EventLogFilter] = None,
+        page: int = 1,
+        page_size: int = 20,
+        cursor: Optional[str] = None,
+        include_total: bool = True
+    ) -> tuple[List[EventLog], Optional[int], Optional[str]]:
+        """
+        Get events with optional filtering and pagination.
+        
+        Args:
+            db: Database session
+            filters: Optional filters to apply
+            page: Page number (1-indexed), ignored when a cursor is given
+            page_size: Number of items per page
+            cursor: Keyset cursor returned with the previous page
+            include_total: Whether to count matching events; None is
+                returned as the total when False
+            
+        Returns:
+            Tuple of (list of events, total count, next page cursor)
+        """
+        query = self._apply_filters(db.query(EventLog), filters)
+        
+        total = self.count_events(db, query, filters) if include_total else None
         
-        # Apply pagination and ordering
-        offset = (page - 1) * page_size
-        events = query.order_by(EventLog.created_at.desc()).offset(offset).limit(page_size).all()
+        # Cursors seek straight to the next page; plain page numbers still use an offset
+        events, next_cursor = paginate_keyset(
+            query.options(*_EVENT_LOAD_OPTIONS), EventLog.created_at, EventLog.id, page_size,
+            cursor=cursor, offset=(page - 1) * page_size
+        )
         
-        return events, total
+        return events, total, next_cursor
     
-    def event_to_response(self, event: EventLog, db: Session) -> EventLogResponse:
-        """Convert EventLog model to response schema."""
-        username = None
-        if event.user_id:
-            user = db.query(User).filter(User.id == event.user_id).first()
-            if user:
-                username = user.username
+    def count_events(
+        self,
+        db: Session,
+        query,
+        filters: Optional[EventLogFilter] = None
+    ) -> int:
+        """
+        Count the events matched by a filtered query.
         
-        metadata = None
-        if event.metadata_json:
-            try:
-                metadata = json.loads(event.metadata_json)
-            except json.JSONDecodeError:
-                metadata = None
+        Without filters on SQL Server the row count is read from the
+        partition statistics, which is instant but may lag slightly behind
+        concurrent inserts; otherwise the query is counted exactly.
+        """
+        has_filters = filters is not None and bool(filters.model_dump(exclude_none=True))
+        if not has_filters and db.get_bind().dialect.name == "mssql":
+            approximate = db.execute(text(
+                "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                "WHERE object_id = OBJECT_ID(:table) AND index_id < 2"
+            ), {"table": EventLog.__tablename__}).scalar()
+            if approximate is not None:
+                return int(approximate)
         
-        return EventLogResponse(
-            id=event.id,
-            event_type=event.event_type,
-            description=event.description,
-            document_id=event.document_id,
-            user_id=event.user_id,
-            username=username,
-            metadata=metadata,
-            created_at=event.created_at
-        )
+        return query.count()
+    
+    def event_to_response(self, event: EventLog) -> EventLogResponse:
+        """
+        Convert EventLog model to response schema.
+        
+        Values come straight from our own table, so the model is built with
+        model_construct and skips validation. The event must have been loaded
+        through get_event/get_events so its user is already in memory.
+        """
+        return EventLogResponse.model_construct(**self.event_to_dict(event))
+    
+    def event_to_dict(self, event: EventLog) -> dict:
+        """
+        Convert EventLog model to a plain dict with the EventLogResponse fields.
+        
+        Used by endpoints that serialize straight to JSON, where building a
+        model per event would cost more than the serialization itself.
+        metadata_json is a JSON column, so it is already a dict here.
+        """
+        return {
+            "id": event.id,
+            "event_type": event.event_type,
+            "description": event.description,
+            "document_id": event.document_id,
+            "user_id": event.user_id,
+            "username": event.user.username if event.user else None,
+            "metadata": event.metadata_json,
+            "created_at": event.created_at,
+        }
     
     def export_to_excel(
         self,
         db: Session,
         filters: Optional[EventLogFilter] = None
-    ) -> BytesIO:
+    ) -> BinaryIO:
         """
         Export filtered events to Excel format.
         
+        Rows are streamed from the database in batches into a write-only
+        workbook, so memory use stays flat regardless of how many events
+        match. The finished file is spooled to disk once it grows past
+        EXPORT_SPOOL_MAX_BYTES.
+        
         Args:
             db: Database session
             filters: Optional filters to apply
             
         Returns:
-            BytesIO buffer containing the Excel file
+            File object positioned at the start of the Excel file
         """
         import openpyxl
+        from openpyxl.cell import WriteOnlyCell
         from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
         from openpyxl.utils import get_column_letter
         
-        # Get all events (no pagination for export)
-        events, _ = self.get_events(db, filters, page=1, page_size=100000)
+        # Usernames come from the same query instead of one lookup per row
+        query = self._apply_filters(
+            db.query(
+                EventLog.id,
+                EventLog.event_type,
+                EventLog.description,
+                EventLog.document_id,
+                EventLog.created_at,
+                User.username
+            ).outerjoin(User, EventLog.user_id == User.id),
+            filters
+        )
+        rows = query.order_by(EventLog.created_at.desc()).yield_per(EXPORT_BATCH_SIZE)
         
         # Create workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Histórico de Eventos"
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(title="Histórico de Eventos")
         
         # Define styles
         header_font = Font(bold=True, color="FFFFFF")
@@ -181,52 +274,45 @@ class EventService:
             bottom=Side(style='thin')
         )
         
+        def bordered(value):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.border = thin_border
+            return cell
+        
+        # Column widths and frozen header must be set before any row is written
+        column_widths = [10, 25, 60, 20, 15, 22]
+        for col, width in enumerate(column_widths, 1):
+            ws.column_dimensions[get_column_letter(col)].width = width
+        ws.freeze_panes = "A2"
+        
         # Headers
         headers = ["ID", "Tipo", "Descripción", "Usuario", "Documento ID", "Fecha y Hora"]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
+        header_cells = []
+        for header in headers:
+            cell = bordered(header)
             cell.font = header_font
             cell.fill = header_fill
             cell.alignment = header_alignment
-            cell.border = thin_border
-        
-        # Event type labels
-        event_type_labels = {
-            "subida_documento": "Subida de Documento",
-            "analisis_ia": "Análisis IA",
-            "interaccion_usuario": "Interacción Usuario",
-            "sistema": "Sistema"
-        }
+            header_cells.append(cell)
+        ws.append(header_cells)
         
         # Data rows
-        for row, event in enumerate(events, 2):
-            username = None
-            if event.user_id:
-                user = db.query(User).filter(User.id == event.user_id).first()
-                if user:
-                    username = user.username
-            
-            ws.cell(row=row, column=1, value=event.id).border = thin_border
-            ws.cell(row=row, column=2, value=event_type_labels.get(event.event_type, event.event_type)).border = thin_border
-            ws.cell(row=row, column=3, value=event.description).border = thin_border
-            ws.cell(row=row, column=4, value=username or "-").border = thin_border
-            ws.cell(row=row, column=5, value=event.document_id or "-").border = thin_border
-            ws.cell(row=row, column=6, value=event.created_at.strftime("%Y-%m-%d %H:%M:%S")).border = thin_border
-        
-        # Adjust column widths
-        column_widths = [10, 25, 60, 20, 15, 22]
-        for col, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(col)].width = width
+        for event in rows:
+            ws.append([
+                bordered(event.id),
+                bordered(EXPORT_EVENT_TYPE_LABELS.get(event.event_type, event.event_type)),
+                bordered(event.description),
+                bordered(event.username or "-"),
+                bordered(event.document_id or "-"),
+                bordered(event.created_at.strftime("%Y-%m-%d %H:%M:%S"))
+            ])
         
-        # Freeze header row
-        ws.freeze_panes = "A2"
-        
-        # Save to buffer
-        buffer = BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
+        # Save to a spooled file
+        output = SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+        wb.save(output)
+        output.seek(0)
         
-        return buffer
+        return output
     
     # Convenience methods for common event types
     def log_document_upload(
@@ -234,7 +320,8 @@ class EventService:
         db: Session,
         document_id: int,
         filename: str,
-        user_id: int
+        user_id: int,
+        commit: bool = True
     ) -> EventLog:
         """Log a document upload event."""
         return self.create_event(
@@ -243,7 +330,8 @@ class EventService:
             description=f"Documento '{filename}' subido exitosamente",
             user_id=user_id,
             document_id=document_id,
-            metadata={"filename": filename}
+            metadata={"filename": filename},
+            commit=commit
         )
     
     def log_ai_analysis(
@@ -253,7 +341,8 @@ class EventService:
         document_type: str,
         user_id: Optional[int] = None,
         success: bool = True,
-        error: Optional[str] = None
+        error: Optional[str] = None,
+        commit: bool = True
     ) -> EventLog:
         """Log an AI analysis event."""
         if success:
@@ -271,7 +360,8 @@ class EventService:
                 "document_type": document_type,
                 "success": success,
                 "error": error
-            }
+            },
+            commit=commit
         )
     
     def log_user_interaction(
@@ -280,7 +370,8 @@ class EventService:
         action: str,
         user_id: int,
         document_id: Optional[int] = None,
-        details: Optional[dict] = None
+        details: Optional[dict] = None,
+        commit: bool = True
     ) -> EventLog:
         """Log a user interaction event."""
         return self.create_event(
@@ -289,21 +380,118 @@ class EventService:
             description=f"Interacción de usuario: {action}",
             user_id=user_id,
             document_id=document_id,
-            metadata=details
+            metadata=details,
+            commit=commit
         )
     
+    def log_with_new_session(self, log_method: Callable[..., EventLog], **kwargs):
+        """
+        Run a log_* method outside the request's session.
+        
+        Meant for BackgroundTasks, which run after the request's session has
+        been closed. The event is buffered and written with others in one
+        transaction once event_log_batch_size events are pending or
+        event_log_flush_interval_seconds have passed; the lifespan task
+        flushes whatever is left when traffic stops. Failures are reported
+        but never propagated, since the response has already been sent.
+        
+        Args:
+            log_method: One of the log_* methods of this service
+            **kwargs: Arguments for log_method, excluding db
+        """
+        db = SessionLocal()
+        try:
+            event = log_method(db=db, commit=False, **kwargs)
+            db.expunge(event)
+        except Exception as e:
+            db.rollback()
+            print(f"Error logging event: {e}")
+            return
+        finally:
+            db.close()
+        
+        with self._pending_lock:
+            self._pending.append(event)
+            due = (
+                len(self._pending) >= settings.event_log_batch_size
+                or time.monotonic() - self._last_flush >= settings.event_log_flush_interval_seconds
+            )
+        if due:
+            self.flush_pending()
+    
+    def flush_pending(self) -> int:
+        """
+        Write buffered background events in a single transaction.
+        
+        If the batch fails (e.g. an event points at a document deleted while
+        it was buffered), the events are retried one at a time so only the
+        failing ones are dropped.
+        
+        Returns:
+            Number of events written
+        """
+        with self._pending_lock:
+            events, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not events:
+            return 0
+        
+        db = SessionLocal()
+        try:
+            db.add_all(events)
+            db.commit()
+            return len(events)
+        except Exception as e:
+            db.rollback()
+            print(f"Error writing {len(events)} buffered events, retrying one by one: {e}")
+        finally:
+            db.close()
+        
+        written = 0
+        for event in events:
+            # The failed flush may have assigned ids, so insert fresh copies
+            retry = EventLog(
+                event_type=event.event_type,
+                description=event.description,
+                user_id=event.user_id,
+                document_id=event.document_id,
+                metadata_json=event.metadata_json,
+            )
+            if event.created_at is not None:
+                retry.created_at = event.created_at
+            db = SessionLocal()
+            try:
+                db.add(retry)
+                db.commit()
+                written += 1
+            except Exception as e:
+                db.rollback()
+                print(f"Error writing buffered event '{event.description}': {e}")
+            finally:
+                db.close()
+        return written
+    
+    def discard_pending_for_document(self, document_id: int) -> None:
+        """Drop buffered events of a document that is being deleted."""
+        with self._pending_lock:
+            self._pending = [
+                event for event in self._pending if event.document_id != document_id
+            ]
+    
     def log_system_event(
         self,
         db: Session,
         description: str,
-        metadata: Optional[dict] = None
+        metadata: Optional[dict] = None,
+        commit: bool = True
     ) -> EventLog:
         """Log a system event."""
         return self.create_event(
             db=db,
             event_type=EventTypeEnum.SYSTEM,
             description=description,
-            metadata=metadata
+            metadata=metadata,
+            commit=commit
         )
 
 
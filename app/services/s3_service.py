@@ -1,26 +1,54 @@
 """
 AWS S3 service for file storage using LocalStack.
 """
+from typing import BinaryIO, Iterator
+
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from app.core.cache import TTLCache
 from app.core.config import get_settings
 
 settings = get_settings()
 
+# S3 requires every multipart part except the last to be at least 5 MB
+MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+# Cached presigned URLs are handed out until this many seconds before they
+# expire, so a client still has time to use them
+PRESIGNED_URL_REFRESH_MARGIN = 100
+
 
 class S3Service:
-    """Service class for S3 operations."""
+    """
+    Service class for S3 operations.
+    
+    boto3 calls block until S3 answers, so the async methods run them in the
+    threadpool to keep the event loop free; the shared client is thread-safe.
+    """
     
     def __init__(self):
-        """Initialize S3 client for LocalStack."""
+        """Initialize S3 client for LocalStack with a shared connection pool."""
         self.client = boto3.client(
             "s3",
             endpoint_url=settings.s3_endpoint_url,
             aws_access_key_id=settings.aws_access_key_id,
             aws_secret_access_key=settings.aws_secret_access_key,
             region_name=settings.aws_region,
+            config=Config(
+                max_pool_connections=settings.s3_max_pool_connections,
+                retries={"mode": "adaptive", "max_attempts": 5},
+                tcp_keepalive=True,
+                # LocalStack serves buckets by path, which also avoids a
+                # per-bucket DNS lookup and TLS handshake
+                s3={"addressing_style": "path"},
+            ),
         )
         self.bucket_name = settings.s3_bucket_name
+        # Presigned URLs by key, reused until shortly before they expire
+        self._presigned_urls = TTLCache(maxsize=4096)
     
     def ensure_bucket_exists(self) -> bool:
         """Create bucket if it doesn't exist."""
@@ -53,7 +81,8 @@ class S3Service:
             Dict with upload result
         """
         try:
-            self.client.put_object(
+            await run_in_threadpool(
+                self.client.put_object,
                 Bucket=self.bucket_name,
                 Key=s3_key,
                 Body=file_content,
@@ -71,6 +100,143 @@ class S3Service:
                 "error": str(e)
             }
     
+    async def upload_streaming(
+        self,
+        file: UploadFile,
+        s3_key: str,
+        content_type: str,
+        max_size: int | None = None,
+        part_size: int = MULTIPART_PART_SIZE,
+        copy_to: BinaryIO | None = None
+    ) -> dict:
+        """
+        Upload a file to S3 in fixed-size parts without reading it fully into memory.
+        
+        Files that fit in a single part are sent with a plain put_object;
+        larger files use a multipart upload that is aborted as soon as
+        ``max_size`` is exceeded.
+        
+        Args:
+            file: The uploaded file to read chunks from
+            s3_key: The key (path) where the file will be stored in S3
+            content_type: The MIME type of the file
+            max_size: Maximum allowed size in bytes (no limit if None)
+            part_size: Size in bytes of each multipart part
+            copy_to: Optional file that receives a copy of every chunk read,
+                so callers can keep the content without a second read
+            
+        Returns:
+            Dict with upload result, including the total ``size`` on success
+            and an ``error_code`` of ``file_too_large`` or ``empty_file`` when
+            the file is rejected
+        """
+        async def read_chunk() -> bytes:
+            chunk = await file.read(part_size)
+            if chunk and copy_to is not None:
+                await run_in_threadpool(copy_to.write, chunk)
+            return chunk
+        
+        first_chunk = await read_chunk()
+        if not first_chunk:
+            return {
+                "success": False,
+                "error": "Empty file",
+                "error_code": "empty_file"
+            }
+        
+        if max_size is not None and len(first_chunk) > max_size:
+            return self._file_too_large_result()
+        
+        next_chunk = await read_chunk()
+        if not next_chunk:
+            result = await self.upload_file(first_chunk, s3_key, content_type)
+            if result["success"]:
+                result["size"] = len(first_chunk)
+            return result
+        
+        try:
+            upload = await run_in_threadpool(
+                self.client.create_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                ContentType=content_type,
+            )
+        except ClientError as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        
+        upload_id = upload["UploadId"]
+        parts = []
+        total_size = 0
+        chunk = first_chunk
+        
+        try:
+            while chunk:
+                total_size += len(chunk)
+                if max_size is not None and total_size > max_size:
+                    await run_in_threadpool(self._abort_multipart_upload, s3_key, upload_id)
+                    return self._file_too_large_result()
+                
+                part_number = len(parts) + 1
+                response = await run_in_threadpool(
+                    self.client.upload_part,
+                    Bucket=self.bucket_name,
+                    Key=s3_key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    Body=chunk,
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                
+                if next_chunk is not None:
+                    chunk, next_chunk = next_chunk, None
+                else:
+                    chunk = await read_chunk()
+            
+            await run_in_threadpool(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except ClientError as e:
+            await run_in_threadpool(self._abort_multipart_upload, s3_key, upload_id)
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        
+        return {
+            "success": True,
+            "bucket": self.bucket_name,
+            "key": s3_key,
+            "url": f"{settings.s3_endpoint_url}/{self.bucket_name}/{s3_key}",
+            "size": total_size
+        }
+    
+    def _abort_multipart_upload(self, s3_key: str, upload_id: str):
+        """Abort a multipart upload, ignoring errors."""
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+            )
+        except ClientError as e:
+            print(f"Error aborting multipart upload: {e}")
+    
+    @staticmethod
+    def _file_too_large_result() -> dict:
+        """Result returned when an upload exceeds the size limit."""
+        return {
+            "success": False,
+            "error": "File too large",
+            "error_code": "file_too_large"
+        }
+    
     async def download_file(self, s3_key: str) -> bytes | None:
         """
         Download a file from S3.
@@ -82,13 +248,52 @@ class S3Service:
             File content as bytes or None if error
         """
         try:
-            response = self.client.get_object(
+            return await run_in_threadpool(self._read_object, s3_key)
+        except ClientError:
+            return None
+    
+    def _read_object(self, s3_key: str) -> bytes:
+        """Fetch a whole object from S3; blocking, run it in the threadpool."""
+        response = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=s3_key
+        )
+        return response["Body"].read()
+    
+    async def stream_file(
+        self,
+        s3_key: str,
+        chunk_size: int = 65536
+    ) -> tuple[Iterator[bytes], int] | None:
+        """
+        Open a file in S3 for streaming without buffering it in memory.
+        
+        Args:
+            s3_key: The key (path) of the file in S3
+            chunk_size: Size in bytes of each yielded chunk
+            
+        Returns:
+            Tuple of (chunk iterator, content length) or None if error
+        """
+        try:
+            response = await run_in_threadpool(
+                self.client.get_object,
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
-            return response["Body"].read()
         except ClientError:
             return None
+        
+        # StreamingResponse iterates sync iterators in the threadpool too
+        body = response["Body"]
+        
+        def iter_body() -> Iterator[bytes]:
+            try:
+                yield from body.iter_chunks(chunk_size=chunk_size)
+            finally:
+                body.close()
+        
+        return iter_body(), response["ContentLength"]
     
     async def delete_file(self, s3_key: str) -> bool:
         """
@@ -101,7 +306,8 @@ class S3Service:
             True if successful, False otherwise
         """
         try:
-            self.client.delete_object(
+            await run_in_threadpool(
+                self.client.delete_object,
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
@@ -109,9 +315,79 @@ class S3Service:
         except ClientError:
             return False
     
+    async def get_file_size(self, s3_key: str) -> int | None:
+        """
+        Get the size of a file in S3.
+        
+        Args:
+            s3_key: The key (path) of the file in S3
+            
+        Returns:
+            Size in bytes or None if the file does not exist
+        """
+        try:
+            response = await run_in_threadpool(
+                self.client.head_object,
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+            return response["ContentLength"]
+        except ClientError:
+            return None
+    
+    def get_presigned_upload(self, s3_key: str, content_type: str, max_size: int) -> dict:
+        """
+        Sign a POST that uploads a file straight to S3.
+        
+        S3 itself rejects the upload if the file is empty, larger than
+        ``max_size`` or sent with another content type.
+        
+        Args:
+            s3_key: The key (path) where the file will be stored in S3
+            content_type: The MIME type the file must be sent with
+            max_size: Maximum allowed size in bytes
+            
+        Returns:
+            Dict with the ``url`` to post to and the form ``fields`` to send
+            before the file
+        """
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            Fields={"Content-Type": content_type},
+            Conditions=[
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_size],
+            ],
+            ExpiresIn=settings.s3_presigned_upload_expiry,
+        )
+    
     def get_file_url(self, s3_key: str) -> str:
         """Generate a URL for the file."""
         return f"{settings.s3_endpoint_url}/{self.bucket_name}/{s3_key}"
+    
+    def get_presigned_url(self, s3_key: str) -> str:
+        """
+        Get a time-limited GET URL for the file, reusing a cached one when possible.
+        
+        Args:
+            s3_key: The key (path) of the file in S3
+            
+        Returns:
+            Presigned URL valid for ``s3_presigned_url_expiry`` seconds
+        """
+        url = self._presigned_urls.get(s3_key)
+        if url is None:
+            url = self.client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket_name, "Key": s3_key},
+                ExpiresIn=settings.s3_presigned_url_expiry,
+            )
+            expiry = settings.s3_presigned_url_expiry
+            # Short expiries keep at least half their lifetime in the cache
+            ttl = max(expiry - PRESIGNED_URL_REFRESH_MARGIN, expiry // 2)
+            self._presigned_urls.set(s3_key, url, ttl=ttl)
+        return url
 
 
 # Singleton instance
@@ -0,0 +1,87 @@
+"""
+Script to analyze stored documents through the OpenAI Batch API.
+
+Meant for backfills: re-runs the analysis of documents left in a given
+status (by default, failed ones) at batch pricing. Batches can take up to
+24 hours to finish, so run it outside the web process.
+
+Usage:
+    python scripts/analyze_batch.py [--status failed] [--limit 500] [--poll-interval 60]
+"""
+import argparse
+import asyncio
+import sys
+sys.path.insert(0, ".")
+
+from app.core.database import SessionLocal, init_db
+from app.models.models import Document
+from app.services.document_service import get_document_service
+from app.services.event_service import get_event_service
+from app.services.s3_service import get_s3_service
+
+
+async def analyze_documents(status: str, limit: int, poll_interval: float):
+    """Analyze up to ``limit`` documents in ``status`` with one batch and store the results."""
+    init_db()
+
+    db = SessionLocal()
+    document_service = get_document_service()
+
+    try:
+        documents = (
+            db.query(Document)
+            .filter(Document.analysis_status == status)
+            .order_by(Document.id)
+            .limit(limit)
+            .all()
+        )
+        if not documents:
+            print(f"ℹ️ No documents with status '{status}'.")
+            return
+
+        print(f"📥 Downloading {len(documents)} documents from S3...")
+        s3_service = get_s3_service()
+        contents = await asyncio.gather(
+            *(s3_service.download_file(document.s3_key) for document in documents)
+        )
+
+        batch_input = [
+            (str(document.id), content, document.content_type)
+            for document, content in zip(documents, contents)
+            if content is not None
+        ]
+
+        print(f"🤖 Submitting {len(batch_input)} documents to the OpenAI Batch API...")
+        results = await document_service.analyze_documents_batch(batch_input, poll_interval)
+
+        # All results are committed together with the event below
+        document_service.store_analysis_results(db, [
+            (document, results[str(document.id)])
+            for document in documents
+            if str(document.id) in results
+        ])
+
+        get_event_service().log_system_event(
+            db=db,
+            description=f"Análisis por lote completado: {len(results)} de {len(documents)} documentos",
+            metadata={"status": status, "analyzed": len(results), "selected": len(documents)}
+        )
+
+        print(f"✅ Stored analyses for {len(results)} of {len(documents)} documents.")
+
+    except Exception as e:
+        print(f"❌ Error running batch analysis: {e}")
+        db.rollback()
+    finally:
+        db.close()
+        await document_service.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze stored documents with the OpenAI Batch API")
+    parser.add_argument("--status", default="failed", help="Analysis status of the documents to analyze")
+    parser.add_argument("--limit", type=int, default=500, help="Maximum number of documents per batch")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch status checks")
+    args = parser.parse_args()
+
+    asyncio.run(analyze_documents(args.status, args.limit, args.poll_interval))
@@ -3,6 +3,9 @@ Pytest configuration and fixtures for tests.
 """
 import pytest
 from unittest.mock import MagicMock, patch
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 
 @pytest.fixture
@@ -57,3 +60,34 @@ def mock_settings():
 def mock_s3_client():
     """Mock S3 client."""
     return MagicMock()
+
+
+@pytest.fixture
+def mock_db_session():
+    """Mock database session limited to the Session API."""
+    return MagicMock(spec_set=Session)
+
+
+@pytest.fixture
+def db_session():
+    """Session on a fresh in-memory SQLite database with all tables created."""
+    from app.core.database import Base
+    import app.models.models  # noqa: F401 - registers the tables on Base.metadata
+
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,77 @@
+"""
+Tests for the authentication API endpoints.
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.auth import router
+from app.core.database import get_db
+from app.models.models import User
+
+
+@pytest.fixture
+def client(db_session):
+    """Client for the auth router using the test database."""
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = lambda: db_session
+    return TestClient(app)
+
+
+class TestRegisterUser:
+    """Test cases for POST /auth/register."""
+
+    def _register(self, client, username, email=None):
+        return client.post("/auth/register", json={
+            "username": username, "password": "secret123", "email": email
+        })
+
+    def test_register_creates_user(self, client, db_session):
+        """Test that a new user is created."""
+        response = self._register(client, "alice", "alice@example.com")
+
+        assert response.status_code == 201
+        assert response.json()["username"] == "alice"
+        assert db_session.query(User).count() == 1
+
+    def test_duplicate_username(self, client):
+        """Test that a taken username is reported as such."""
+        self._register(client, "alice", "alice@example.com")
+
+        response = self._register(client, "alice", "other@example.com")
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "El nombre de usuario ya existe"
+
+    def test_duplicate_email(self, client):
+        """Test that a taken email is reported as such."""
+        self._register(client, "alice", "alice@example.com")
+
+        response = self._register(client, "bob", "alice@example.com")
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "El email ya está registrado"
+
+
+class TestGetCurrentUser:
+    """Test cases for the cached current user lookup."""
+
+    def test_cache_omits_password_hash(self, client, db_session):
+        """Test that cached users carry no password hash and still serve /me."""
+        from app.core.security import _user_cache
+
+        _user_cache.clear()
+        client.post("/auth/register", json={"username": "alice", "password": "secret123"})
+        token = client.post(
+            "/auth/login", data={"username": "alice", "password": "secret123"}
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        first = client.get("/auth/me", headers=headers)
+        user_id = first.json()["id"]
+        second = client.get("/auth/me", headers=headers)
+
+        assert "password_hash" not in _user_cache.get(user_id)
+        assert second.status_code == 200
+        assert second.json() == first.json()
@@ -0,0 +1,63 @@
+"""
+Tests for the in-process TTL cache.
+"""
+from unittest.mock import patch
+
+from app.core.cache import TTLCache
+
+
+class TestTTLCache:
+    """Test cases for TTLCache class."""
+
+    def test_get_returns_stored_value(self):
+        """Test that a stored value is returned before it expires."""
+        cache = TTLCache(ttl=60)
+        cache.set("key", "value")
+
+        assert cache.get("key") == "value"
+
+    def test_get_returns_default_when_missing(self):
+        """Test that get returns the default for unknown keys."""
+        cache = TTLCache()
+
+        assert cache.get("missing") is None
+        assert cache.get("missing", "default") == "default"
+
+    @patch("app.core.cache.time.monotonic")
+    def test_entries_expire_after_ttl(self, mock_monotonic):
+        """Test that entries are dropped once their TTL has elapsed."""
+        mock_monotonic.return_value = 100.0
+        cache = TTLCache(ttl=10)
+        cache.set("key", "value")
+
+        mock_monotonic.return_value = 109.0
+        assert cache.get("key") == "value"
+
+        mock_monotonic.return_value = 110.0
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_oldest_entry_evicted_when_full(self):
+        """Test that the oldest entry is evicted once maxsize is reached."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert cache.get("c") == 3
+
+    def test_delete_and_clear(self):
+        """Test that delete removes one entry and clear removes all."""
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        cache.delete("a")
+        cache.delete("missing")
+        assert cache.get("a") is None
+        assert len(cache) == 1
+
+        cache.clear()
+        assert len(cache) == 0
@@ -1,6 +1,11 @@
 """
 Tests for the CSV service.
 """
+import asyncio
+import codecs
+import gzip
+import io
+import orjson
 import pytest
 from app.services.csv_service import CSVService, get_csv_service
 
@@ -44,6 +49,18 @@ class TestCSVService:
         assert duplicate_validations[0].severity == "warning"
         assert "duplicada" in duplicate_validations[0].message.lower()
 
+    def test_validate_and_process_stops_checking_values_at_limit(self):
+        """Test value checks stop at max_validations while structure errors are still reported."""
+        content = b"name,price\n,x\n,y\n,z\na,1,extra\n"
+
+        rows, validations = self.csv_service.validate_and_process(content, "test.csv", max_validations=2)
+
+        assert len(rows) == 4
+        assert [v.validation_type for v in validations] == [
+            "empty_value", "invalid_type", "validation_limit", "structure_error"
+        ]
+        assert validations[2].row_number == 3
+
     def test_validate_and_process_detects_empty_values(self, sample_csv_with_empty_values):
         """Test that empty values are detected."""
         rows, validations = self.csv_service.validate_and_process(
@@ -124,6 +141,70 @@ class TestCSVService:
         errors = [v for v in validations if v.severity == "error"]
         assert len(errors) == 0
 
+    def test_validate_and_process_file_retries_latin1(self):
+        """Test a file object that is not valid UTF-8 is re-read as latin-1 and left open."""
+        # Non-UTF-8 byte only appears after the first decode buffer
+        content = ("name,precio\n" + "Producto,1.00\n" * 2000 + "Café,50.00\n").encode("latin-1")
+        file = io.BytesIO(content)
+
+        rows, validations = self.csv_service.validate_and_process_file(file, "test.csv")
+
+        assert len(rows) == 2001
+        assert rows[-1]["name"] == "Café"
+        assert not file.closed
+
+    def test_detect_encoding_keeps_split_utf8_and_position(self):
+        """Test a UTF-8 character split across read chunks is still UTF-8 and the file is rewound."""
+        from app.services.csv_service import ENCODING_CHECK_CHUNK_SIZE
+
+        content = b"a" * (ENCODING_CHECK_CHUNK_SIZE - 1) + "é".encode("utf-8")
+        file = io.BytesIO(content)
+
+        assert CSVService._detect_encoding(file) == "utf-8"
+        assert file.tell() == 0
+        assert CSVService._detect_encoding(io.BytesIO(content[:-1])) == "latin-1"
+
+    def test_validate_and_process_strips_utf8_bom(self):
+        """Test a UTF-8 byte order mark does not end up in the first header."""
+        content = codecs.BOM_UTF8 + "precio,nombre\nx,Café\n".encode("utf-8")
+
+        rows, validations = self.csv_service.validate_and_process(content, "test.csv")
+
+        assert rows == [{"precio": "x", "nombre": "Café"}]
+        assert [v.column_name for v in validations] == ["precio"]
+
+    def test_validate_and_pack_file_matches_process(self):
+        """Test packing while parsing gives the same rows and validations as processing."""
+        content = ("name,precio\n" + "Producto,1.00\n" * 2000 + "Café,x\n").encode("latin-1")
+
+        rows, validations = self.csv_service.validate_and_process(content, "test.csv")
+        blob, row_count, packed_validations = self.csv_service.validate_and_pack_file(
+            io.BytesIO(content), "test.csv"
+        )
+
+        assert row_count == 2001
+        assert self.csv_service.blob_to_rows(blob) == self.csv_service.rows_to_json(rows)
+        assert packed_validations == validations
+
+    def test_validate_and_pack_upload_in_worker_process(self):
+        """Test validation in a worker process gives the same result as in-process."""
+        content = b"name,precio\na,1\na,1\nb,x\n"
+        service = CSVService(process_workers=1)
+
+        try:
+            blob, row_count, validations = asyncio.run(
+                service.validate_and_pack_upload(io.BytesIO(content), "test.csv")
+            )
+        finally:
+            service.shutdown()
+
+        expected_blob, expected_count, expected_validations = self.csv_service.validate_and_pack_file(
+            io.BytesIO(content), "test.csv"
+        )
+        assert row_count == expected_count == 3
+        assert self.csv_service.blob_to_rows(blob) == self.csv_service.blob_to_rows(expected_blob)
+        assert validations == expected_validations
+
     def test_validate_and_process_numeric_with_comma(self):
         """Test that numeric values with comma decimal separator are accepted."""
         content = b"name,precio,cantidad\nProduct A,100,50,10\n"
@@ -134,37 +215,40 @@ class TestCSVService:
         # So this tests the actual numeric validation
         assert len(rows) >= 1
 
-    # ==================== _compute_row_hash tests ====================
+    def test_validate_and_process_row_with_extra_fields(self):
+        """Test that a row with more fields than the header is a structure error."""
+        content = b"name,precio\nProduct A,100,50\nProduct B,20\n"
+
+        rows, validations = self.csv_service.validate_and_process(content, "test.csv")
+
+        assert len(rows) == 2
+        errors = [v for v in validations if v.severity == "error"]
+        assert len(errors) == 1
+        assert errors[0].validation_type == "structure_error"
+        assert errors[0].row_number == 2
 
-    def test_compute_row_hash_same_rows_same_hash(self):
-        """Test that identical rows produce the same hash."""
-        row1 = {"name": "Product A", "precio": "100.50", "cantidad": "10"}
-        row2 = {"name": "Product A", "precio": "100.50", "cantidad": "10"}
+    # ==================== _values_hash tests ====================
 
-        hash1 = self.csv_service._compute_row_hash(row1)
-        hash2 = self.csv_service._compute_row_hash(row2)
+    def test_values_hash_same_values_same_hash(self):
+        """Test that rows with identical values produce the same hash."""
+        hash1 = self.csv_service._values_hash(["Product A", "100.50", "10"])
+        hash2 = self.csv_service._values_hash(["Product A", "100.50", "10"])
 
         assert hash1 == hash2
 
-    def test_compute_row_hash_different_rows_different_hash(self):
-        """Test that different rows produce different hashes."""
-        row1 = {"name": "Product A", "precio": "100.50", "cantidad": "10"}
-        row2 = {"name": "Product B", "precio": "100.50", "cantidad": "10"}
-
-        hash1 = self.csv_service._compute_row_hash(row1)
-        hash2 = self.csv_service._compute_row_hash(row2)
+    def test_values_hash_different_values_different_hash(self):
+        """Test that rows with different values produce different hashes."""
+        hash1 = self.csv_service._values_hash(["Product A", "100.50", "10"])
+        hash2 = self.csv_service._values_hash(["Product B", "100.50", "10"])
 
         assert hash1 != hash2
 
-    def test_compute_row_hash_order_independent(self):
-        """Test that column order doesn't affect the hash."""
-        row1 = {"name": "Product A", "precio": "100.50", "cantidad": "10"}
-        row2 = {"cantidad": "10", "name": "Product A", "precio": "100.50"}
+    def test_values_hash_depends_on_position(self):
+        """Test that the same values in other columns are not a duplicate."""
+        hash1 = self.csv_service._values_hash(["10", "20"])
+        hash2 = self.csv_service._values_hash(["20", "10"])
 
-        hash1 = self.csv_service._compute_row_hash(row1)
-        hash2 = self.csv_service._compute_row_hash(row2)
-
-        assert hash1 == hash2
+        assert hash1 != hash2
 
     # ==================== _is_numeric tests ====================
 
@@ -192,6 +276,13 @@ class TestCSVService:
         assert self.csv_service._is_numeric("") is False
         assert self.csv_service._is_numeric("one hundred") is False
 
+    def test_is_numeric_exponent_but_not_special_values(self):
+        """Test that exponents are numeric while inf/nan words are not."""
+        assert self.csv_service._is_numeric("1e5") is True
+        assert self.csv_service._is_numeric("-2,5E-3") is True
+        assert self.csv_service._is_numeric("nan") is False
+        assert self.csv_service._is_numeric("inf") is False
+
     # ==================== rows_to_json tests ====================
 
     def test_rows_to_json_converts_values_to_strings(self):
@@ -208,6 +299,31 @@ class TestCSVService:
         assert result[1]["precio"] is None
         assert result[1]["cantidad"] == "5"
 
+    def test_rows_to_blob_round_trip(self):
+        """Test that rows stored as a blob load back as the JSON rows."""
+        rows = [{"name": "Café", "precio": 100.5}, {"name": "B", "precio": None}]
+
+        blob = self.csv_service.rows_to_blob(rows)
+
+        assert isinstance(blob, bytes)
+        assert self.csv_service.blob_to_rows(blob) == self.csv_service.rows_to_json(rows)
+
+    def test_iter_blob_rows_reads_lazily(self):
+        """Test that blob rows can be read one at a time."""
+        rows = [{"name": str(i)} for i in range(3)]
+
+        blob = self.csv_service.rows_to_blob(rows)
+
+        assert list(self.csv_service.iter_blob_rows(blob)) == rows
+        assert list(self.csv_service.iter_blob_rows(self.csv_service.rows_to_blob([]))) == []
+
+    def test_iter_blob_rows_reads_compact_blobs(self):
+        """Test that blobs stored as a single-line JSON array still load."""
+        rows = [{"name": "A"}, {"name": "B"}]
+        blob = gzip.compress(orjson.dumps(rows))
+
+        assert list(self.csv_service.iter_blob_rows(blob)) == rows
+
     def test_rows_to_json_empty_list(self):
         """Test rows_to_json with empty list."""
         result = self.csv_service.rows_to_json([])
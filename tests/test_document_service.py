@@ -1,10 +1,17 @@
 """
 Tests for Document Analysis Service.
 """
-import pytest
+import asyncio
+
 from unittest.mock import AsyncMock, MagicMock, patch
 from app.services.document_service import DocumentService, get_document_service
-from app.schemas.schemas import DocumentTypeEnum
+from app.models.models import Document, InfoData, InvoiceData, User
+from app.schemas.schemas import (
+    DocumentAnalysisResult,
+    DocumentTypeEnum,
+    InfoDataBase,
+    InvoiceDataBase,
+)
 
 
 class TestDocumentService:
@@ -35,10 +42,10 @@ class TestDocumentService:
         """Test AI availability check when API key is not set."""
         with patch('app.services.document_service.settings') as mock_settings:
             mock_settings.openai_api_key = ""
+            mock_settings.openai_max_concurrency = 32
             service = DocumentService()
             assert not service._is_ai_available()
     
-    @pytest.mark.asyncio
     async def test_analyze_document_without_ai(self):
         """Test document analysis when AI is not available."""
         service = DocumentService()
@@ -54,6 +61,149 @@ class TestDocumentService:
         assert result.confidence == 0.0
         assert "not configured" in result.raw_text.lower()
     
+    async def test_aclose_closes_client(self):
+        """Test closing the service closes the OpenAI client."""
+        service = DocumentService()
+        service.client = MagicMock()
+        service.client.close = AsyncMock()
+
+        await service.aclose()
+
+        service.client.close.assert_awaited_once()
+
+    async def test_analyze_document_reuses_cached_analysis(self):
+        """Test an identical file is answered from the cache unless the cache is bypassed."""
+        service = DocumentService()
+        service.client = MagicMock()
+        message = MagicMock()
+        message.content = (
+            '{"document_type": "informacion", "confidence": 0.8, "invoice_data": null, '
+            '"info_data": {"description": "Carta", "key_topics": ["aviso"]}}'
+        )
+        service.client.chat.completions.create = AsyncMock(
+            return_value=MagicMock(choices=[MagicMock(message=message)])
+        )
+        
+        with patch('app.services.document_service.settings') as mock_settings:
+            mock_settings.openai_api_key = "sk-test"
+            first = await service.analyze_document(b"\x89PNG", "image/png", "a.png")
+            second = await service.analyze_document(b"\x89PNG", "image/png", "b.png")
+            await service.analyze_document(b"\x89PNG", "image/png", "c.png", use_cache=False)
+        
+        assert service.client.chat.completions.create.await_count == 2
+        assert second.info_data.description == first.info_data.description == "Carta"
+
+    async def test_analyze_document_limits_concurrent_requests(self):
+        """Test concurrent analyses wait for a free slot before calling OpenAI."""
+        service = DocumentService()
+        service._request_semaphore = asyncio.Semaphore(2)
+        service.client = MagicMock()
+        in_flight = []
+        peak = []
+        message = MagicMock(content='{"document_type": "informacion", "confidence": 0.5}')
+
+        async def create(**kwargs):
+            in_flight.append(kwargs)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0)
+            in_flight.pop()
+            return MagicMock(choices=[MagicMock(message=message)])
+
+        service.client.chat.completions.create = create
+
+        with patch('app.services.document_service.settings') as mock_settings:
+            mock_settings.openai_api_key = "sk-test"
+            await asyncio.gather(*(
+                service.analyze_document(bytes([i]), "image/png", f"{i}.png") for i in range(5)
+            ))
+
+        assert len(peak) == 5
+        assert max(peak) == 2
+
+    async def test_analyze_document_returns_stored_analysis(self):
+        """Test a completed document under the same S3 key is returned without calling OpenAI."""
+        service = DocumentService()
+        service.client = MagicMock()
+        service.client.chat.completions.create = AsyncMock()
+        stored = MagicMock(document_type="factura", analysis_status="completed", info_data=None)
+        stored.invoice_data.configure_mock(
+            client_name="ACME", client_address=None, provider_name=None, provider_address=None,
+            invoice_number="F-1", invoice_date=None, invoice_total=10.5, currency="MXN",
+            products_json=[{"quantity": 1, "name": "x", "unit_price": 10.5, "total": 10.5}],
+            raw_text="texto"
+        )
+
+        with patch('app.services.document_service.settings') as mock_settings, \
+                patch.object(service, '_get_document_by_s3_key', return_value=stored):
+            mock_settings.openai_api_key = "sk-test"
+            result = await service.analyze_document(
+                b"%PDF", "application/pdf", "a.pdf", s3_key="documents/1/a.pdf", db=MagicMock()
+            )
+
+        service.client.chat.completions.create.assert_not_awaited()
+        assert result.document_type == DocumentTypeEnum.FACTURA
+        assert result.invoice_data.products[0].total == 10.5
+        assert result.raw_text == "texto"
+
+    async def test_build_analysis_request_sends_image_part(self):
+        """Test images are sent as an image_url part instead of inline text."""
+        service = DocumentService()
+
+        with patch.object(service, '_downscale_image', side_effect=lambda content, ctype: (content, ctype)):
+            request = await service._build_analysis_request(b"\x89PNG", "image/png", "", True)
+
+        content = request["messages"][1]["content"]
+        assert content[1] == {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw=="}}
+
+    async def test_analyze_documents_batch(self):
+        """Test a batch is submitted as JSONL and its output is parsed by custom_id."""
+        import orjson
+        
+        service = DocumentService()
+        service.client = MagicMock()
+        service.client.files.create = AsyncMock(return_value=MagicMock(id="file-in"))
+        service.client.batches.create = AsyncMock(return_value=MagicMock(id="batch-1", status="in_progress"))
+        service.client.batches.retrieve = AsyncMock(
+            return_value=MagicMock(id="batch-1", status="completed", output_file_id="file-out")
+        )
+        reply = '{"document_type": "informacion", "confidence": 0.7, "info_data": {"summary": "Aviso"}}'
+        output = b"\n".join([
+            orjson.dumps({"custom_id": "1", "response": {"status_code": 200, "body": {
+                "choices": [{"message": {"content": reply}}]
+            }}}),
+            orjson.dumps({"custom_id": "2", "response": {"status_code": 500, "body": {}}}),
+        ])
+        service.client.files.content = AsyncMock(return_value=MagicMock(content=output))
+        
+        with patch('app.services.document_service.settings') as mock_settings:
+            mock_settings.openai_api_key = "sk-test"
+            results = await service.analyze_documents_batch(
+                [("1", b"\x89PNG", "image/png"), ("2", b"\x89PNG", "image/png")],
+                poll_interval=0
+            )
+        
+        submitted = service.client.files.create.call_args.kwargs["file"][1].splitlines()
+        assert [orjson.loads(line)["custom_id"] for line in submitted] == ["1", "2"]
+        assert orjson.loads(submitted[0])["url"] == "/v1/chat/completions"
+        assert list(results) == ["1"]
+        assert results["1"].info_data.summary == "Aviso"
+    
+    def test_truncate_to_tokens_without_tokenizer(self):
+        """Test text is cut by an estimated character budget when tiktoken is unavailable."""
+        service = DocumentService()
+        with patch('app.services.document_service._get_token_encoding', return_value=None):
+            assert service._truncate_to_tokens("a" * 100, 10) == "a" * 40
+    
+    def test_truncate_to_tokens_with_tokenizer(self):
+        """Test text is cut at the token budget when a tokenizer is available."""
+        service = DocumentService()
+        encoding = MagicMock()
+        encoding.encode_ordinary.side_effect = lambda text: text.split()
+        encoding.decode.side_effect = " ".join
+        with patch('app.services.document_service._get_token_encoding', return_value=encoding):
+            assert service._truncate_to_tokens("uno dos tres cuatro", 2) == "uno dos"
+            assert service._truncate_to_tokens("uno dos", 2) == "uno dos"
+    
     def test_encode_image_to_base64(self):
         """Test image encoding to base64."""
         service = DocumentService()
@@ -63,33 +213,153 @@ class TestDocumentService:
         
         assert result.startswith("data:image/png;base64,")
     
-    def test_classification_prompt(self):
-        """Test that classification prompt contains expected keywords."""
+    def test_encode_image_to_base64_downscales_large_images(self):
+        """Test images over the size limit are sent as a smaller JPEG."""
+        import base64
+        import io
+        from PIL import Image
+        from app.services.document_service import MAX_IMAGE_DIMENSION
+        
         service = DocumentService()
-        prompt = service._get_classification_prompt()
+        buffer = io.BytesIO()
+        Image.new("RGBA", (4000, 1000), (255, 0, 0, 255)).save(buffer, "PNG")
         
-        assert "factura" in prompt.lower()
-        assert "informacion" in prompt.lower()
-        assert "json" in prompt.lower()
+        result = service._encode_image_to_base64(buffer.getvalue(), "image/png")
+        
+        assert result.startswith("data:image/jpeg;base64,")
+        image = Image.open(io.BytesIO(base64.b64decode(result.split(",", 1)[1])))
+        assert image.size == (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION // 4)
     
-    def test_invoice_extraction_prompt(self):
-        """Test that invoice extraction prompt contains expected keywords."""
+    def test_extract_text_from_pdf_uses_pdfium(self):
+        """Test PDF text is read page by page through PDFium when it is installed."""
+        service = DocumentService()
+        page1, page2 = MagicMock(), MagicMock()
+        page1.get_textpage.return_value.get_text_range.return_value = "Factura 1"
+        page2.get_textpage.return_value.get_text_range.return_value = "Total 10 "
+        mock_pdfium = MagicMock()
+        mock_pdfium.PdfDocument.return_value.__iter__.return_value = [page1, page2]
+
+        with patch('app.services.document_service.pdfium', mock_pdfium):
+            text = service._extract_text_from_pdf(b"%PDF-1.4")
+
+        assert text == "Factura 1\nTotal 10"
+        mock_pdfium.PdfDocument.return_value.close.assert_called_once()
+
+    def test_extract_text_from_pdf_stops_at_max_chars(self):
+        """Test pages after the character budget is reached are not read."""
         service = DocumentService()
-        prompt = service._get_invoice_extraction_prompt()
+        pages = [MagicMock() for _ in range(3)]
+        for page in pages:
+            page.get_textpage.return_value.get_text_range.return_value = "x" * 10
+        mock_pdfium = MagicMock()
+        mock_pdfium.PdfDocument.return_value.__iter__.return_value = pages
+
+        with patch('app.services.document_service.pdfium', mock_pdfium):
+            text = service._extract_text_from_pdf(b"%PDF-1.4", max_chars=15)
+
+        assert text == "x" * 10 + "\n" + "x" * 10
+        pages[2].get_textpage.assert_not_called()
+
+    def test_extract_text_from_pdf_invalid_returns_empty(self):
+        """Test unreadable PDF content yields empty text instead of raising."""
+        service = DocumentService()
+        assert service._extract_text_from_pdf(b"not a pdf") == ""
+
+    def test_analysis_prompt(self):
+        """Test that the analysis prompt covers classification and both extractions."""
+        service = DocumentService()
+        prompt = service._get_analysis_prompt().lower()
         
-        assert "cliente" in prompt.lower()
-        assert "proveedor" in prompt.lower()
-        assert "factura" in prompt.lower()
-        assert "productos" in prompt.lower()
+        assert "factura" in prompt
+        assert "informacion" in prompt
+        assert "json" in prompt
+        assert "cliente" in prompt
+        assert "proveedor" in prompt
+        assert "productos" in prompt
+        assert "descripción" in prompt
+        assert "resumen" in prompt
+        assert "sentimiento" in prompt
     
-    def test_info_extraction_prompt(self):
-        """Test that info extraction prompt contains expected keywords."""
+    async def test_analyze_document_uses_single_call(self):
+        """Test classification and extraction come back from one OpenAI call."""
         service = DocumentService()
-        prompt = service._get_info_extraction_prompt()
+        service.client = MagicMock()
+        message = MagicMock()
+        message.content = (
+            '{"document_type": "factura", "confidence": 0.9, "info_data": null, '
+            '"invoice_data": {"client_name": "ACME", "invoice_total": 10.5, '
+            '"products": [{"quantity": 1, "name": "x", "unit_price": 10.5, "total": 10.5}]}}'
+        )
+        service.client.chat.completions.create = AsyncMock(
+            return_value=MagicMock(choices=[MagicMock(message=message)])
+        )
+        
+        with patch('app.services.document_service.settings') as mock_settings:
+            mock_settings.openai_api_key = "sk-test"
+            with patch.object(service, '_extract_text_from_pdf', return_value="Factura ACME"):
+                result = await service.analyze_document(
+                    file_content=b"%PDF-1.4",
+                    content_type="application/pdf",
+                    filename="test.pdf"
+                )
         
-        assert "descripción" in prompt.lower()
-        assert "resumen" in prompt.lower()
-        assert "sentimiento" in prompt.lower()
+        service.client.chat.completions.create.assert_awaited_once()
+        call_kwargs = service.client.chat.completions.create.call_args.kwargs
+        assert call_kwargs["response_format"]["type"] == "json_schema"
+        assert call_kwargs["response_format"]["json_schema"]["strict"] is True
+        assert result.document_type == DocumentTypeEnum.FACTURA
+        assert result.confidence == 0.9
+        assert result.invoice_data.client_name == "ACME"
+        assert result.invoice_data.products[0].total == 10.5
+        assert result.info_data is None
+
+
+class TestStoreAnalysisResults:
+    """Test cases for storing batch analysis results."""
+    
+    def _add_document(self, db, user, name):
+        document = Document(filename=name, original_filename=name, s3_key=f"documents/{name}", user_id=user.id)
+        db.add(document)
+        db.flush()
+        return document
+    
+    def test_replaces_existing_extracted_data(self, db_session):
+        """Test re-analysis of documents that already have extracted data."""
+        user = User(username="tester", password_hash="x")
+        db_session.add(user)
+        db_session.flush()
+        invoice_doc = self._add_document(db_session, user, "a.pdf")
+        info_doc = self._add_document(db_session, user, "b.pdf")
+        db_session.add(InvoiceData(document_id=invoice_doc.id, client_name="Old", raw_text="old"))
+        db_session.add(InfoData(document_id=info_doc.id, summary="old", raw_text="old"))
+        db_session.commit()
+        
+        service = DocumentService()
+        service.store_analysis_results(db_session, [
+            (invoice_doc, DocumentAnalysisResult(
+                document_type=DocumentTypeEnum.FACTURA, confidence=0.9, raw_text="new",
+                invoice_data=InvoiceDataBase(client_name="New")
+            )),
+            # A document that changed type keeps no stale invoice data
+            (info_doc, DocumentAnalysisResult(
+                document_type=DocumentTypeEnum.FACTURA, confidence=0.9, raw_text="new",
+                invoice_data=InvoiceDataBase(client_name="Other")
+            )),
+        ])
+        db_session.commit()
+        
+        invoices = db_session.query(InvoiceData).order_by(InvoiceData.document_id).all()
+        assert [(i.document_id, i.client_name) for i in invoices] == [
+            (invoice_doc.id, "New"), (info_doc.id, "Other")
+        ]
+        assert db_session.query(InfoData).count() == 0
+        assert invoice_doc.analysis_status == "completed"
+        assert info_doc.document_type == "factura"
+    
+    def test_empty_batch_is_noop(self, mock_db_session):
+        """Test that an empty batch runs no statements."""
+        DocumentService().store_analysis_results(mock_db_session, [])
+        mock_db_session.execute.assert_not_called()
 
 
 class TestGetDocumentService:
@@ -2,33 +2,30 @@
 Tests for Event Service.
 """
 import pytest
-import json
 from datetime import datetime, timedelta
 from unittest.mock import MagicMock, patch
 from io import BytesIO
-from sqlalchemy.orm import Session
 
 from app.services.event_service import EventService, get_event_service
-from app.schemas.schemas import EventTypeEnum, EventLogFilter
+from app.schemas.schemas import EventTypeEnum, EventLogFilter, EventLogResponse
 from app.models.models import EventLog
 
 
 class TestEventService:
     """Test cases for EventService."""
     
-    def test_create_event(self):
+    def test_create_event(self, mock_db_session):
         """Test event creation."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         mock_event = MagicMock()
         
-        mock_db.add = MagicMock()
-        mock_db.commit = MagicMock()
-        mock_db.refresh = MagicMock()
+        mock_db_session.add = MagicMock()
+        mock_db_session.commit = MagicMock()
+        mock_db_session.refresh = MagicMock()
         
         with patch.object(EventLog, '__init__', lambda self, **kwargs: None):
             result = service.create_event(
-                db=mock_db,
+                db=mock_db_session,
                 event_type=EventTypeEnum.DOCUMENT_UPLOAD,
                 description="Test event",
                 user_id=1,
@@ -36,17 +33,30 @@ class TestEventService:
                 metadata={"test": "data"}
             )
         
-        mock_db.add.assert_called_once()
-        mock_db.commit.assert_called_once()
-    
-    def test_log_document_upload(self):
+        mock_db_session.add.assert_called_once()
+        mock_db_session.commit.assert_called_once()
+
+    def test_create_event_without_commit(self, mock_db_session):
+        """Test an event can be left for the caller's transaction to commit."""
+        service = EventService()
+
+        event = service.create_event(
+            db=mock_db_session,
+            event_type=EventTypeEnum.AI_ANALYSIS,
+            description="Test event",
+            commit=False
+        )
+
+        mock_db_session.add.assert_called_once_with(event)
+        mock_db_session.commit.assert_not_called()
+
+    def test_log_document_upload(self, mock_db_session):
         """Test logging document upload event."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         with patch.object(service, 'create_event') as mock_create:
             service.log_document_upload(
-                db=mock_db,
+                db=mock_db_session,
                 document_id=1,
                 filename="test.pdf",
                 user_id=1
@@ -57,14 +67,13 @@ class TestEventService:
             assert call_args.kwargs['event_type'] == EventTypeEnum.DOCUMENT_UPLOAD
             assert "test.pdf" in call_args.kwargs['description']
     
-    def test_log_ai_analysis_success(self):
+    def test_log_ai_analysis_success(self, mock_db_session):
         """Test logging successful AI analysis event."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         with patch.object(service, 'create_event') as mock_create:
             service.log_ai_analysis(
-                db=mock_db,
+                db=mock_db_session,
                 document_id=1,
                 document_type="factura",
                 user_id=1,
@@ -76,14 +85,13 @@ class TestEventService:
             assert call_args.kwargs['event_type'] == EventTypeEnum.AI_ANALYSIS
             assert "completado" in call_args.kwargs['description'].lower()
     
-    def test_log_ai_analysis_failure(self):
+    def test_log_ai_analysis_failure(self, mock_db_session):
         """Test logging failed AI analysis event."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         with patch.object(service, 'create_event') as mock_create:
             service.log_ai_analysis(
-                db=mock_db,
+                db=mock_db_session,
                 document_id=1,
                 document_type="unknown",
                 user_id=1,
@@ -95,14 +103,13 @@ class TestEventService:
             call_args = mock_create.call_args
             assert "error" in call_args.kwargs['description'].lower()
     
-    def test_log_user_interaction(self):
+    def test_log_user_interaction(self, mock_db_session):
         """Test logging user interaction event."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         with patch.object(service, 'create_event') as mock_create:
             service.log_user_interaction(
-                db=mock_db,
+                db=mock_db_session,
                 action="Test action",
                 user_id=1,
                 document_id=1,
@@ -113,14 +120,13 @@ class TestEventService:
             call_args = mock_create.call_args
             assert call_args.kwargs['event_type'] == EventTypeEnum.USER_INTERACTION
     
-    def test_log_system_event(self):
+    def test_log_system_event(self, mock_db_session):
         """Test logging system event."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         with patch.object(service, 'create_event') as mock_create:
             service.log_system_event(
-                db=mock_db,
+                db=mock_db_session,
                 description="System event test",
                 metadata={"status": "ok"}
             )
@@ -128,11 +134,86 @@ class TestEventService:
             mock_create.assert_called_once()
             call_args = mock_create.call_args
             assert call_args.kwargs['event_type'] == EventTypeEnum.SYSTEM
+
+    def test_log_with_new_session(self, mock_db_session):
+        """Test background logging buffers the event instead of committing it."""
+        service = EventService()
+        log_method = MagicMock()
+
+        with patch('app.services.event_service.SessionLocal', return_value=mock_db_session), \
+             patch.object(service, 'flush_pending') as mock_flush:
+            service.log_with_new_session(log_method, action="Test action", user_id=1)
+
+        log_method.assert_called_once_with(
+            db=mock_db_session, commit=False, action="Test action", user_id=1
+        )
+        mock_db_session.commit.assert_not_called()
+        mock_db_session.close.assert_called_once()
+        mock_flush.assert_not_called()
+        assert service._pending == [log_method.return_value]
+
+    def test_log_with_new_session_flushes_full_batch(self, mock_db_session):
+        """Test the buffer is written once it reaches the batch size."""
+        service = EventService()
+
+        with patch('app.services.event_service.SessionLocal', return_value=mock_db_session), \
+             patch('app.services.event_service.settings') as mock_settings:
+            mock_settings.event_log_batch_size = 2
+            mock_settings.event_log_flush_interval_seconds = 3600
+            service.log_with_new_session(MagicMock(), action="First", user_id=1)
+            mock_db_session.add_all.assert_not_called()
+            service.log_with_new_session(MagicMock(), action="Second", user_id=1)
+
+        mock_db_session.add_all.assert_called_once()
+        assert len(mock_db_session.add_all.call_args.args[0]) == 2
+        mock_db_session.commit.assert_called_once()
+        assert service._pending == []
+
+    def test_log_with_new_session_swallows_errors(self, mock_db_session):
+        """Test background logging rolls back and does not raise on failure."""
+        service = EventService()
+        log_method = MagicMock(side_effect=Exception("DB down"))
+
+        with patch('app.services.event_service.SessionLocal', return_value=mock_db_session):
+            service.log_with_new_session(log_method, action="Test action", user_id=1)
+
+        mock_db_session.rollback.assert_called_once()
+        mock_db_session.close.assert_called_once()
     
+    def test_flush_pending_keeps_valid_events_when_one_fails(self):
+        """Test a failing event in a batch only drops that event."""
+        service = EventService()
+        service._pending = [
+            EventLog(event_type="sistema", description="ok"),
+            EventLog(event_type="interaccion_usuario", description="bad", document_id=999),
+        ]
+        batch_db, ok_db, bad_db = MagicMock(), MagicMock(), MagicMock()
+        batch_db.commit.side_effect = Exception("FOREIGN KEY constraint failed")
+        bad_db.commit.side_effect = Exception("FOREIGN KEY constraint failed")
+
+        with patch('app.services.event_service.SessionLocal', side_effect=[batch_db, ok_db, bad_db]):
+            written = service.flush_pending()
+
+        assert written == 1
+        batch_db.rollback.assert_called_once()
+        assert ok_db.add.call_args.args[0].description == "ok"
+        ok_db.commit.assert_called_once()
+        bad_db.rollback.assert_called_once()
+        assert service._pending == []
+
+    def test_discard_pending_for_document(self):
+        """Test buffered events of a deleted document are dropped."""
+        service = EventService()
+        keep = EventLog(event_type="sistema", description="keep", document_id=1)
+        service._pending = [keep, EventLog(event_type="sistema", description="drop", document_id=2)]
+
+        service.discard_pending_for_document(2)
+
+        assert service._pending == [keep]
+
     def test_event_to_response(self):
         """Test converting event model to response schema."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         # Create mock event
         mock_event = MagicMock()
@@ -141,15 +222,15 @@ class TestEventService:
         mock_event.description = "Test description"
         mock_event.document_id = 1
         mock_event.user_id = 1
-        mock_event.metadata_json = json.dumps({"test": "data"})
+        mock_event.metadata_json = {"test": "data"}
         mock_event.created_at = datetime.utcnow()
         
-        # Create mock user
+        # Eager-loaded user
         mock_user = MagicMock()
         mock_user.username = "testuser"
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_user
+        mock_event.user = mock_user
         
-        result = service.event_to_response(mock_event, mock_db)
+        result = service.event_to_response(mock_event)
         
         assert result.id == 1
         assert result.event_type == "subida_documento"
@@ -159,7 +240,6 @@ class TestEventService:
     def test_event_to_response_no_user(self):
         """Test converting event model without user."""
         service = EventService()
-        mock_db = MagicMock(spec=Session)
         
         mock_event = MagicMock()
         mock_event.id = 1
@@ -167,14 +247,82 @@ class TestEventService:
         mock_event.description = "System event"
         mock_event.document_id = None
         mock_event.user_id = None
+        mock_event.user = None
         mock_event.metadata_json = None
         mock_event.created_at = datetime.utcnow()
         
-        result = service.event_to_response(mock_event, mock_db)
-        
+        result = service.event_to_response(mock_event)
+
         assert result.username is None
         assert result.metadata is None
 
+    def test_event_to_dict_has_response_fields(self):
+        """Test the plain dict carries exactly the response schema fields."""
+        service = EventService()
+
+        mock_event = MagicMock()
+        mock_event.id = 2
+        mock_event.event_type = "sistema"
+        mock_event.description = "System event"
+        mock_event.document_id = None
+        mock_event.user_id = 1
+        mock_event.user.username = "testuser"
+        mock_event.metadata_json = None
+        mock_event.created_at = datetime.utcnow()
+
+        result = service.event_to_dict(mock_event)
+
+        assert set(result) == set(EventLogResponse.model_fields)
+        assert result["username"] == "testuser"
+        assert result["metadata"] is None
+
+    def test_count_events_uses_partition_stats_without_filters(self, mock_db_session):
+        """Test unfiltered counts on SQL Server read the partition statistics."""
+        service = EventService()
+        mock_db_session.get_bind.return_value.dialect.name = "mssql"
+        mock_db_session.execute.return_value.scalar.return_value = 1234
+        query = MagicMock()
+
+        assert service.count_events(mock_db_session, query, EventLogFilter()) == 1234
+        query.count.assert_not_called()
+
+    def test_count_events_counts_filtered_query(self, mock_db_session):
+        """Test filtered counts run an exact COUNT over the query."""
+        service = EventService()
+        mock_db_session.get_bind.return_value.dialect.name = "mssql"
+        query = MagicMock()
+        query.count.return_value = 5
+
+        filters = EventLogFilter(description_search="factura")
+        assert service.count_events(mock_db_session, query, filters) == 5
+        mock_db_session.execute.assert_not_called()
+
+    def test_export_to_excel(self, mock_db_session):
+        """Test exporting events writes a header and one row per event."""
+        import openpyxl
+
+        service = EventService()
+
+        row = MagicMock()
+        row.id = 7
+        row.event_type = "sistema"
+        row.description = "System event"
+        row.document_id = None
+        row.created_at = datetime(2024, 1, 2, 3, 4, 5)
+        row.username = None
+        query = mock_db_session.query.return_value.outerjoin.return_value
+        query.order_by.return_value.yield_per.return_value = [row]
+
+        output = service.export_to_excel(mock_db_session)
+
+        ws = openpyxl.load_workbook(output).active
+        assert ws.title == "Histórico de Eventos"
+        assert ws.freeze_panes == "A2"
+        assert [cell.value for cell in ws[1]][0] == "ID"
+        assert [cell.value for cell in ws[2]] == [
+            7, "Sistema", "System event", "-", "-", "2024-01-02 03:04:05"
+        ]
+
 
 class TestEventLogFilter:
     """Test cases for EventLogFilter."""
@@ -0,0 +1,84 @@
+"""
+Tests for the file API endpoints.
+"""
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.files import router
+from app.core.database import get_db
+from app.core.security import get_current_user
+from app.models.models import CSVData, UploadedFile, User
+from app.services.csv_service import get_csv_service
+
+
+@pytest.fixture
+def user(db_session):
+    """User owning the test files."""
+    user = User(username="tester", password_hash="x", role="user")
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+@pytest.fixture
+def client(db_session, user):
+    """Client for the files router using the test database and user."""
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = lambda: db_session
+    app.dependency_overrides[get_current_user] = lambda: user
+    return TestClient(app)
+
+
+def _add_file(db, user, **kwargs) -> UploadedFile:
+    db_file = UploadedFile(
+        filename="data.csv", original_filename="data.csv", s3_key="files/data.csv",
+        user_id=user.id, **kwargs
+    )
+    db.add(db_file)
+    db.commit()
+    return db_file
+
+
+class TestGetFileRows:
+    """Test cases for GET /files/{file_id}/rows."""
+
+    ROWS = [{"name": f"Product {i}", "precio": str(i)} for i in range(10)]
+
+    def test_pages_blob_rows(self, client, db_session, user):
+        """Test pagination over rows stored in the file's data blob."""
+        db_file = _add_file(db_session, user, data_blob=get_csv_service().rows_to_blob(self.ROWS))
+
+        response = client.get(f"/files/{db_file.id}/rows", params={"skip": 3, "limit": 4})
+
+        assert response.status_code == 200
+        assert response.json() == self.ROWS[3:7]
+        assert client.get(f"/files/{db_file.id}/rows", params={"skip": 8}).json() == self.ROWS[8:]
+        assert client.get(f"/files/{db_file.id}/rows", params={"skip": 20}).json() == []
+
+    def test_pages_legacy_csv_data_rows(self, client, db_session, user):
+        """Test pagination over files stored as one CSVData record per row."""
+        db_file = _add_file(db_session, user)
+        db_session.add_all(
+            CSVData(uploaded_file_id=db_file.id, row_number=i + 1, data=orjson.dumps(row).decode())
+            for i, row in reversed(list(enumerate(self.ROWS)))
+        )
+        db_session.commit()
+
+        response = client.get(f"/files/{db_file.id}/rows", params={"skip": 3, "limit": 4})
+
+        assert response.status_code == 200
+        assert response.json() == self.ROWS[3:7]
+
+    def test_other_users_file_is_forbidden(self, client, db_session):
+        """Test that rows of another user's file are not returned."""
+        other = User(username="other", password_hash="x", role="user")
+        db_session.add(other)
+        db_session.commit()
+        db_file = _add_file(db_session, other, data_blob=get_csv_service().rows_to_blob(self.ROWS))
+
+        response = client.get(f"/files/{db_file.id}/rows")
+
+        assert response.status_code == 403
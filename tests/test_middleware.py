@@ -0,0 +1,72 @@
+"""
+Tests for the request-level middleware.
+"""
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from app.core.middleware import MULTIPART_OVERHEAD_BYTES, UploadSizeLimitMiddleware
+
+LIMIT = 1024
+
+
+@pytest.fixture
+def client():
+    """Client for an app whose upload path is limited to LIMIT bytes."""
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadSizeLimitMiddleware, limits={"/upload": LIMIT})
+    return TestClient(app)
+
+
+def _multipart(content: bytes) -> tuple[bytes, str]:
+    """Encode ``content`` as a single-file multipart body."""
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class TestUploadSizeLimitMiddleware:
+    """Test cases for UploadSizeLimitMiddleware."""
+
+    def test_small_upload_passes(self, client):
+        """Test uploads within the limit reach the endpoint."""
+        response = client.post("/upload", files={"file": ("a.bin", b"x" * LIMIT)})
+
+        assert response.status_code == 200
+        assert response.json() == {"size": LIMIT}
+
+    def test_oversized_content_length_is_rejected(self, client):
+        """Test a declared Content-Length over the limit is refused up front."""
+        body, content_type = _multipart(b"x" * (LIMIT + MULTIPART_OVERHEAD_BYTES + 1))
+
+        response = client.post("/upload", content=body, headers={"Content-Type": content_type})
+
+        assert response.status_code == 413
+
+    def test_oversized_chunked_body_is_rejected(self, client):
+        """Test a body without Content-Length is cut off once it goes over the limit."""
+        body, content_type = _multipart(b"x" * (LIMIT + MULTIPART_OVERHEAD_BYTES + 1))
+
+        def chunks():
+            for start in range(0, len(body), 8192):
+                yield body[start:start + 8192]
+
+        response = client.post("/upload", content=chunks(), headers={"Content-Type": content_type})
+
+        assert "content-length" not in response.request.headers
+        assert response.status_code == 413
+
+    def test_other_paths_are_not_limited(self, client):
+        """Test requests to paths without a limit are passed through untouched."""
+        response = client.post("/other", content=b"x" * (LIMIT + MULTIPART_OVERHEAD_BYTES + 1))
+
+        assert response.status_code == 404
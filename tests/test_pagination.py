@@ -0,0 +1,64 @@
+"""
+Tests for keyset pagination helpers.
+"""
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from fastapi import HTTPException
+
+from app.core.pagination import encode_cursor, decode_cursor, paginate_keyset
+from app.models.models import EventLog
+
+
+class TestCursor:
+    """Test cases for cursor encoding."""
+
+    def test_round_trip(self):
+        """Test a cursor decodes back to the row position."""
+        created_at = datetime(2024, 5, 6, 7, 8, 9, 123456)
+        cursor = encode_cursor(created_at, 42)
+
+        assert decode_cursor(cursor) == (created_at, 42)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected with 400."""
+        with pytest.raises(HTTPException) as exc_info:
+            decode_cursor("not-a-cursor")
+
+        assert exc_info.value.status_code == 400
+
+
+class TestPaginateKeyset:
+    """Test cases for paginate_keyset."""
+
+    def _rows(self, count):
+        return [
+            SimpleNamespace(id=count - i, created_at=datetime(2024, 1, 1, 0, 0, count - i))
+            for i in range(count)
+        ]
+
+    def test_returns_next_cursor_when_more_rows(self):
+        """Test a full page yields a cursor pointing at its last row."""
+        query = MagicMock()
+        query.order_by.return_value.limit.return_value.all.return_value = self._rows(3)
+
+        rows, next_cursor = paginate_keyset(query, EventLog.created_at, EventLog.id, 2)
+
+        assert [row.id for row in rows] == [3, 2]
+        assert decode_cursor(next_cursor) == (rows[-1].created_at, 2)
+        query.order_by.return_value.limit.assert_called_once_with(3)
+        query.filter.assert_not_called()
+
+    def test_last_page_has_no_cursor(self):
+        """Test the last page returns no cursor and filters after the given one."""
+        query = MagicMock()
+        filtered = query.filter.return_value
+        filtered.order_by.return_value.limit.return_value.all.return_value = self._rows(1)
+        cursor = encode_cursor(datetime(2024, 1, 1, 0, 0, 5), 5)
+
+        rows, next_cursor = paginate_keyset(query, EventLog.created_at, EventLog.id, 2, cursor)
+
+        assert len(rows) == 1
+        assert next_cursor is None
+        query.filter.assert_called_once()
@@ -2,348 +2,310 @@
 Tests for the S3 service.
 """
 import pytest
-from unittest.mock import MagicMock, patch
+from io import BytesIO
+from types import SimpleNamespace
+from unittest.mock import ANY, Mock, call, patch
 from botocore.exceptions import ClientError
+from fastapi import UploadFile
 
+from app.services import s3_service as s3_module
 from app.services.s3_service import S3Service, get_s3_service
 
+# boto3 client methods S3Service calls; the client mock rejects anything else
+S3_CLIENT_METHODS = [
+    "abort_multipart_upload",
+    "complete_multipart_upload",
+    "create_bucket",
+    "create_multipart_upload",
+    "delete_object",
+    "generate_presigned_post",
+    "generate_presigned_url",
+    "get_object",
+    "head_bucket",
+    "head_object",
+    "put_object",
+    "upload_part",
+]
+
+# S3 errors raised by the client mock; built once and reused by reference
+HEAD_BUCKET_NOT_FOUND = ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadBucket")
+CREATE_BUCKET_ERROR = ClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "CreateBucket")
+PUT_OBJECT_ERROR = ClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "PutObject")
+GET_OBJECT_NOT_FOUND = ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "GetObject")
+GET_OBJECT_ERROR = ClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "GetObject")
+DELETE_OBJECT_ERROR = ClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "DeleteObject")
+HEAD_OBJECT_NOT_FOUND = ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+
+
+@pytest.fixture
+def s3_env():
+    """Patch boto3 and settings for S3Service; the client boto3 returns is shared."""
+    with patch.object(s3_module.boto3, "client") as mock_boto_client, \
+         patch.object(s3_module, "settings") as mock_settings:
+        mock_settings.s3_endpoint_url = "http://localhost:4566"
+        mock_settings.aws_access_key_id = "test"
+        mock_settings.aws_secret_access_key = "test"
+        mock_settings.aws_region = "us-east-1"
+        mock_settings.s3_bucket_name = "test-bucket"
+        mock_client = Mock(spec=S3_CLIENT_METHODS)
+        mock_boto_client.return_value = mock_client
+        yield SimpleNamespace(boto=mock_boto_client, client=mock_client, settings=mock_settings)
+
 
 class TestS3Service:
     """Test cases for S3Service class."""
 
     # ==================== __init__ tests ====================
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_init_creates_s3_client(self, mock_boto_client, mock_settings):
+    def test_init_creates_s3_client(self, s3_env):
         """Test that __init__ creates an S3 client with correct parameters."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test_key"
-        mock_settings.aws_secret_access_key = "test_secret"
-        mock_settings.aws_region = "us-west-2"
-        mock_settings.s3_bucket_name = "my-bucket"
+        s3_env.settings.aws_access_key_id = "test_key"
+        s3_env.settings.aws_secret_access_key = "test_secret"
+        s3_env.settings.aws_region = "us-west-2"
+        s3_env.settings.s3_bucket_name = "my-bucket"
+        s3_env.settings.s3_max_pool_connections = 50
 
         service = S3Service()
 
-        mock_boto_client.assert_called_once_with(
+        s3_env.boto.assert_called_once_with(
             "s3",
             endpoint_url="http://localhost:4566",
             aws_access_key_id="test_key",
             aws_secret_access_key="test_secret",
             region_name="us-west-2",
+            config=ANY,
         )
+        config = s3_env.boto.call_args.kwargs["config"]
+        assert config.max_pool_connections == 50
+        assert config.retries["mode"] == "adaptive"
         assert service.bucket_name == "my-bucket"
 
     # ==================== ensure_bucket_exists tests ====================
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_ensure_bucket_exists_when_bucket_exists(self, mock_boto_client, mock_settings):
-        """Test ensure_bucket_exists returns True when bucket already exists."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.head_bucket.return_value = {}
+    @pytest.mark.parametrize("head_error, create_error, expected, creates", [
+        (None, None, True, False),
+        (HEAD_BUCKET_NOT_FOUND, None, True, True),
+        (HEAD_BUCKET_NOT_FOUND, CREATE_BUCKET_ERROR, False, True),
+    ])
+    def test_ensure_bucket_exists(self, s3_env, head_error, create_error, expected, creates):
+        """Test the bucket is created only when missing, and False is returned if that fails."""
+        s3_env.client.head_bucket.side_effect = head_error
+        s3_env.client.create_bucket.side_effect = create_error
 
         service = S3Service()
         result = service.ensure_bucket_exists()
 
-        assert result is True
-        mock_client.head_bucket.assert_called_once_with(Bucket="test-bucket")
-        mock_client.create_bucket.assert_not_called()
+        assert result is expected
+        s3_env.client.head_bucket.assert_called_once_with(Bucket="test-bucket")
+        assert s3_env.client.create_bucket.call_args_list == ([call(Bucket="test-bucket")] if creates else [])
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_ensure_bucket_exists_creates_bucket_when_not_exists(self, mock_boto_client, mock_settings):
-        """Test ensure_bucket_exists creates bucket when it doesn't exist."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+    # ==================== upload_file tests ====================
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.head_bucket.side_effect = ClientError(
-            {"Error": {"Code": "404", "Message": "Not Found"}},
-            "HeadBucket"
-        )
-        mock_client.create_bucket.return_value = {}
+    @pytest.mark.parametrize("s3_key, content_type, expected_content_type", [
+        ("path/to/file.csv", "text/csv", "text/csv"),
+        ("path/to/file.csv", None, "text/csv"),
+        ("path/to/file.json", "application/json", "application/json"),
+    ])
+    async def test_upload_file_success(self, s3_env, s3_key, content_type, expected_content_type):
+        """Test successful file upload, with the given or the default content type."""
+        s3_env.client.put_object.return_value = {}
+        kwargs = {"content_type": content_type} if content_type else {}
 
         service = S3Service()
-        result = service.ensure_bucket_exists()
+        result = await service.upload_file(file_content=b"test content", s3_key=s3_key, **kwargs)
 
-        assert result is True
-        mock_client.head_bucket.assert_called_once_with(Bucket="test-bucket")
-        mock_client.create_bucket.assert_called_once_with(Bucket="test-bucket")
+        assert result["success"] is True
+        assert result["bucket"] == "test-bucket"
+        assert result["key"] == s3_key
+        assert "url" in result
+        s3_env.client.put_object.assert_called_once_with(
+            Bucket="test-bucket",
+            Key=s3_key,
+            Body=b"test content",
+            ContentType=expected_content_type,
+        )
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_ensure_bucket_exists_returns_false_on_create_error(self, mock_boto_client, mock_settings):
-        """Test ensure_bucket_exists returns False when bucket creation fails."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+    async def test_upload_file_failure(self, s3_env):
+        """Test upload_file returns error on failure."""
+        s3_env.client.put_object.side_effect = PUT_OBJECT_ERROR
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.head_bucket.side_effect = ClientError(
-            {"Error": {"Code": "404", "Message": "Not Found"}},
-            "HeadBucket"
-        )
-        mock_client.create_bucket.side_effect = ClientError(
-            {"Error": {"Code": "500", "Message": "Internal Error"}},
-            "CreateBucket"
+        service = S3Service()
+        result = await service.upload_file(
+            file_content=b"test content",
+            s3_key="path/to/file.csv"
         )
 
-        service = S3Service()
-        result = service.ensure_bucket_exists()
+        assert result["success"] is False
+        assert "error" in result
 
-        assert result is False
+    async def test_upload_file_runs_off_event_loop(self, s3_env):
+        """Test the blocking boto3 call runs in a worker thread."""
+        import threading
 
-    # ==================== upload_file tests ====================
+        threads = []
+        s3_env.client.put_object.side_effect = lambda **kwargs: threads.append(threading.get_ident())
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_upload_file_success(self, mock_boto_client, mock_settings):
-        """Test successful file upload."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+        service = S3Service()
+        await service.upload_file(b"test content", "path/to/file.csv")
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.put_object.return_value = {}
+        assert threads and threads[0] != threading.get_ident()
+
+    # ==================== upload_streaming tests ====================
 
+    async def test_upload_streaming_single_part_uses_put_object(self, s3_env):
+        """Test upload_streaming sends small files with a single put_object."""
         service = S3Service()
-        result = await service.upload_file(
-            file_content=b"test content",
-            s3_key="path/to/file.csv",
-            content_type="text/csv"
-        )
+        file = UploadFile(file=BytesIO(b"small content"))
+        result = await service.upload_streaming(file, "docs/file.pdf", "application/pdf", part_size=64)
 
         assert result["success"] is True
-        assert result["bucket"] == "test-bucket"
-        assert result["key"] == "path/to/file.csv"
-        assert "url" in result
-        mock_client.put_object.assert_called_once_with(
+        assert result["size"] == len(b"small content")
+        s3_env.client.put_object.assert_called_once_with(
             Bucket="test-bucket",
-            Key="path/to/file.csv",
-            Body=b"test content",
-            ContentType="text/csv",
+            Key="docs/file.pdf",
+            Body=b"small content",
+            ContentType="application/pdf",
         )
+        s3_env.client.create_multipart_upload.assert_not_called()
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_upload_file_default_content_type(self, mock_boto_client, mock_settings):
-        """Test upload_file uses default content type."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.put_object.return_value = {}
+    async def test_upload_streaming_multipart(self, s3_env):
+        """Test upload_streaming splits larger files into multipart parts."""
+        s3_env.client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        s3_env.client.upload_part.side_effect = [{"ETag": "e1"}, {"ETag": "e2"}, {"ETag": "e3"}]
 
         service = S3Service()
-        result = await service.upload_file(
-            file_content=b"test content",
-            s3_key="path/to/file.csv"
-        )
+        file = UploadFile(file=BytesIO(b"a" * 10 + b"b" * 10 + b"c" * 5))
+        result = await service.upload_streaming(file, "docs/file.pdf", "application/pdf", part_size=10)
 
-        mock_client.put_object.assert_called_once_with(
+        assert result["success"] is True
+        assert result["size"] == 25
+        bodies = [c.kwargs["Body"] for c in s3_env.client.upload_part.call_args_list]
+        assert bodies == [b"a" * 10, b"b" * 10, b"c" * 5]
+        s3_env.client.complete_multipart_upload.assert_called_once_with(
             Bucket="test-bucket",
-            Key="path/to/file.csv",
-            Body=b"test content",
-            ContentType="text/csv",
+            Key="docs/file.pdf",
+            UploadId="upload-1",
+            MultipartUpload={"Parts": [
+                {"ETag": "e1", "PartNumber": 1},
+                {"ETag": "e2", "PartNumber": 2},
+                {"ETag": "e3", "PartNumber": 3},
+            ]},
         )
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_upload_file_failure(self, mock_boto_client, mock_settings):
-        """Test upload_file returns error on failure."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.put_object.side_effect = ClientError(
-            {"Error": {"Code": "500", "Message": "Internal Error"}},
-            "PutObject"
-        )
+    async def test_upload_streaming_copies_chunks(self, s3_env):
+        """Test upload_streaming writes every chunk it reads to copy_to."""
+        s3_env.client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        s3_env.client.upload_part.side_effect = [{"ETag": "e1"}, {"ETag": "e2"}, {"ETag": "e3"}]
+        content = b"a" * 10 + b"b" * 10 + b"c" * 5
+        copy = BytesIO()
 
         service = S3Service()
-        result = await service.upload_file(
-            file_content=b"test content",
-            s3_key="path/to/file.csv"
+        result = await service.upload_streaming(
+            UploadFile(file=BytesIO(content)), "docs/file.pdf", "application/pdf",
+            part_size=10, copy_to=copy
         )
 
-        assert result["success"] is False
-        assert "error" in result
-
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_upload_file_with_custom_content_type(self, mock_boto_client, mock_settings):
-        """Test upload_file with custom content type."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+        assert result["success"] is True
+        assert copy.getvalue() == content
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.put_object.return_value = {}
+    async def test_upload_streaming_aborts_when_too_large(self, s3_env):
+        """Test upload_streaming aborts the multipart upload once max_size is exceeded."""
+        s3_env.client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        s3_env.client.upload_part.return_value = {"ETag": "e"}
 
         service = S3Service()
-        result = await service.upload_file(
-            file_content=b"test content",
-            s3_key="path/to/file.json",
-            content_type="application/json"
+        file = UploadFile(file=BytesIO(b"x" * 30))
+        result = await service.upload_streaming(
+            file, "docs/file.pdf", "application/pdf", max_size=15, part_size=10
         )
 
-        mock_client.put_object.assert_called_once_with(
+        assert result["success"] is False
+        assert result["error_code"] == "file_too_large"
+        s3_env.client.abort_multipart_upload.assert_called_once_with(
             Bucket="test-bucket",
-            Key="path/to/file.json",
-            Body=b"test content",
-            ContentType="application/json",
+            Key="docs/file.pdf",
+            UploadId="upload-1",
         )
+        s3_env.client.complete_multipart_upload.assert_not_called()
+
+    async def test_upload_streaming_empty_file(self, s3_env):
+        """Test upload_streaming rejects empty files without calling S3."""
+        service = S3Service()
+        result = await service.upload_streaming(UploadFile(file=BytesIO(b"")), "docs/file.pdf", "application/pdf")
+
+        assert result["success"] is False
+        assert result["error_code"] == "empty_file"
+        s3_env.client.put_object.assert_not_called()
 
     # ==================== download_file tests ====================
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_download_file_success(self, mock_boto_client, mock_settings):
+    async def test_download_file_success(self, s3_env):
         """Test successful file download."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_body = MagicMock()
-        mock_body.read.return_value = b"downloaded content"
-        mock_client.get_object.return_value = {"Body": mock_body}
+        body = BytesIO(b"downloaded content")
+        s3_env.client.get_object.return_value = {"Body": body}
 
         service = S3Service()
         result = await service.download_file("path/to/file.csv")
 
         assert result == b"downloaded content"
-        mock_client.get_object.assert_called_once_with(
+        s3_env.client.get_object.assert_called_once_with(
             Bucket="test-bucket",
             Key="path/to/file.csv"
         )
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_download_file_not_found(self, mock_boto_client, mock_settings):
-        """Test download_file returns None when file not found."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.get_object.side_effect = ClientError(
-            {"Error": {"Code": "404", "Message": "Not Found"}},
-            "GetObject"
-        )
+    @pytest.mark.parametrize("error", [GET_OBJECT_NOT_FOUND, GET_OBJECT_ERROR])
+    async def test_download_file_returns_none_on_error(self, s3_env, error):
+        """Test download_file returns None when the file is missing or S3 fails."""
+        s3_env.client.get_object.side_effect = error
 
         service = S3Service()
-        result = await service.download_file("path/to/nonexistent.csv")
+        result = await service.download_file("path/to/file.csv")
 
         assert result is None
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_download_file_error(self, mock_boto_client, mock_settings):
-        """Test download_file returns None on error."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+    # ==================== stream_file tests ====================
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.get_object.side_effect = ClientError(
-            {"Error": {"Code": "500", "Message": "Internal Error"}},
-            "GetObject"
-        )
+    async def test_stream_file_success(self, s3_env):
+        """Test stream_file yields body chunks and reports content length."""
+        mock_body = Mock(spec=["iter_chunks", "close"])
+        mock_body.iter_chunks.return_value = iter([b"part1", b"part2"])
+        s3_env.client.get_object.return_value = {"Body": mock_body, "ContentLength": 10}
 
         service = S3Service()
-        result = await service.download_file("path/to/file.csv")
+        chunks, content_length = await service.stream_file("path/to/file.pdf")
+
+        assert content_length == 10
+        assert list(chunks) == [b"part1", b"part2"]
+        mock_body.iter_chunks.assert_called_once_with(chunk_size=65536)
+        mock_body.close.assert_called_once()
+
+    async def test_stream_file_not_found(self, s3_env):
+        """Test stream_file returns None when file not found."""
+        s3_env.client.get_object.side_effect = GET_OBJECT_NOT_FOUND
+
+        service = S3Service()
+        result = await service.stream_file("path/to/nonexistent.pdf")
 
         assert result is None
 
     # ==================== delete_file tests ====================
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_delete_file_success(self, mock_boto_client, mock_settings):
+    async def test_delete_file_success(self, s3_env):
         """Test successful file deletion."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.delete_object.return_value = {}
+        s3_env.client.delete_object.return_value = {}
 
         service = S3Service()
         result = await service.delete_file("path/to/file.csv")
 
         assert result is True
-        mock_client.delete_object.assert_called_once_with(
+        s3_env.client.delete_object.assert_called_once_with(
             Bucket="test-bucket",
             Key="path/to/file.csv"
         )
 
-    @pytest.mark.asyncio
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    async def test_delete_file_failure(self, mock_boto_client, mock_settings):
+    async def test_delete_file_failure(self, s3_env):
         """Test delete_file returns False on failure."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.delete_object.side_effect = ClientError(
-            {"Error": {"Code": "500", "Message": "Internal Error"}},
-            "DeleteObject"
-        )
+        s3_env.client.delete_object.side_effect = DELETE_OBJECT_ERROR
 
         service = S3Service()
         result = await service.delete_file("path/to/file.csv")
@@ -352,141 +314,113 @@ class TestS3Service:
 
     # ==================== get_file_url tests ====================
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_get_file_url(self, mock_boto_client, mock_settings):
-        """Test get_file_url generates correct URL."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
-
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-
+    @pytest.mark.parametrize("s3_key", ["path/to/file.csv", "path/to/file with spaces.csv"])
+    def test_get_file_url(self, s3_env, s3_key):
+        """Test get_file_url joins endpoint, bucket and key as given."""
         service = S3Service()
-        url = service.get_file_url("path/to/file.csv")
+        url = service.get_file_url(s3_key)
 
-        assert url == "http://localhost:4566/test-bucket/path/to/file.csv"
+        assert url == f"http://localhost:4566/test-bucket/{s3_key}"
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_get_file_url_with_special_characters(self, mock_boto_client, mock_settings):
-        """Test get_file_url with special characters in key."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+    # ==================== get_presigned_url tests ====================
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
+    def test_get_presigned_url(self, s3_env):
+        """Test get_presigned_url signs a GET for the object."""
+        s3_env.settings.s3_presigned_url_expiry = 3600
 
-        service = S3Service()
-        url = service.get_file_url("path/to/file with spaces.csv")
+        s3_env.client.generate_presigned_url.return_value = "http://signed/url"
 
-        assert url == "http://localhost:4566/test-bucket/path/to/file with spaces.csv"
+        service = S3Service()
+        url = service.get_presigned_url("path/to/file.pdf")
 
+        assert url == "http://signed/url"
+        s3_env.client.generate_presigned_url.assert_called_once_with(
+            "get_object",
+            Params={"Bucket": "test-bucket", "Key": "path/to/file.pdf"},
+            ExpiresIn=3600,
+        )
 
-class TestS3ServiceSingleton:
-    """Test cases for S3Service singleton pattern."""
+    def test_get_presigned_url_is_cached(self, s3_env):
+        """Test get_presigned_url reuses the URL for repeated keys."""
+        s3_env.settings.s3_presigned_url_expiry = 3600
 
-    @patch("app.services.s3_service._s3_service", None)
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_get_s3_service_creates_singleton(self, mock_boto_client, mock_settings):
-        """Test that get_s3_service creates a singleton instance."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+        s3_env.client.generate_presigned_url.side_effect = ["http://signed/1", "http://signed/2"]
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
+        service = S3Service()
 
-        # Reset the singleton
-        import app.services.s3_service as s3_module
-        s3_module._s3_service = None
+        assert service.get_presigned_url("a.pdf") == "http://signed/1"
+        assert service.get_presigned_url("a.pdf") == "http://signed/1"
+        assert service.get_presigned_url("b.pdf") == "http://signed/2"
+        assert s3_env.client.generate_presigned_url.call_count == 2
 
-        service1 = get_s3_service()
-        service2 = get_s3_service()
+    @pytest.mark.parametrize("expiry,ttl", [(3600, 3500), (120, 60)])
+    def test_get_presigned_url_cache_ttl(self, s3_env, expiry, ttl):
+        """Test cached URLs expire before the URL does, keeping half of short expiries."""
+        s3_env.settings.s3_presigned_url_expiry = expiry
 
-        assert service1 is service2
+        service = S3Service()
+        with patch.object(service._presigned_urls, "set") as cache_set:
+            service.get_presigned_url("a.pdf")
 
-    @patch("app.services.s3_service._s3_service", None)
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_get_s3_service_ensures_bucket_exists(self, mock_boto_client, mock_settings):
-        """Test that get_s3_service ensures bucket exists."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+        cache_set.assert_called_once_with("a.pdf", ANY, ttl=ttl)
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
+    def test_get_presigned_upload_limits_size_and_type(self, s3_env):
+        """Test direct uploads are signed with the content type and size limit."""
+        s3_env.settings.s3_presigned_upload_expiry = 900
 
-        # Reset the singleton
-        import app.services.s3_service as s3_module
-        s3_module._s3_service = None
 
-        service = get_s3_service()
+        service = S3Service()
+        service.get_presigned_upload("docs/a.pdf", "application/pdf", 1024)
 
-        mock_client.head_bucket.assert_called_with(Bucket="test-bucket")
+        s3_env.client.generate_presigned_post.assert_called_once_with(
+            Bucket="test-bucket",
+            Key="docs/a.pdf",
+            Fields={"Content-Type": "application/pdf"},
+            Conditions=[{"Content-Type": "application/pdf"}, ["content-length-range", 1, 1024]],
+            ExpiresIn=900,
+        )
 
+    async def test_get_file_size(self, s3_env):
+        """Test get_file_size reads the object size, or None when it is missing."""
+        s3_env.client.head_object.side_effect = [
+            {"ContentLength": 42},
+            HEAD_OBJECT_NOT_FOUND,
+        ]
 
-class TestS3ServiceIntegration:
-    """Integration-style tests for S3Service (still using mocks but testing flows)."""
+        service = S3Service()
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_upload_download_flow(self, mock_boto_client, mock_settings):
-        """Test upload and download flow."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+        assert await service.get_file_size("docs/a.pdf") == 42
+        assert await service.get_file_size("docs/missing.pdf") is None
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
 
-        service = S3Service()
+class TestS3ServiceSingleton:
+    """Test cases for S3Service singleton pattern."""
 
-        # Mock upload
-        mock_client.put_object.return_value = {}
+    @patch.object(s3_module, "_s3_service", None)
+    def test_get_s3_service_creates_singleton(self, s3_env):
+        """Test that get_s3_service builds one instance and ensures its bucket once."""
+        service1 = get_s3_service()
+        service2 = get_s3_service()
 
-        # Mock download
-        mock_body = MagicMock()
-        mock_body.read.return_value = b"test content"
-        mock_client.get_object.return_value = {"Body": mock_body}
+        assert service1 is service2
+        s3_env.boto.assert_called_once()
+        s3_env.client.head_bucket.assert_called_once_with(Bucket="test-bucket")
 
-        # Test flow would be async
-        # This test just verifies the mocks are set up correctly
-        assert service.bucket_name == "test-bucket"
 
-    @patch("app.services.s3_service.settings")
-    @patch("app.services.s3_service.boto3.client")
-    def test_large_file_upload(self, mock_boto_client, mock_settings):
-        """Test uploading a large file."""
-        mock_settings.s3_endpoint_url = "http://localhost:4566"
-        mock_settings.aws_access_key_id = "test"
-        mock_settings.aws_secret_access_key = "test"
-        mock_settings.aws_region = "us-east-1"
-        mock_settings.s3_bucket_name = "test-bucket"
+class TestS3ServiceIntegration:
+    """Integration-style tests for S3Service (still using mocks but testing flows)."""
 
-        mock_client = MagicMock()
-        mock_boto_client.return_value = mock_client
-        mock_client.put_object.return_value = {}
+    async def test_upload_download_flow(self, s3_env):
+        """Test a file uploaded through the service downloads unchanged."""
+        stored = {}
+        s3_env.client.put_object.side_effect = lambda Key, Body, **kwargs: stored.update({Key: Body})
+        s3_env.client.get_object.side_effect = lambda Key, **kwargs: {
+            "Body": BytesIO(stored[Key])
+        }
 
         service = S3Service()
+        upload = await service.upload_file(b"test content", "path/to/file.csv")
+        content = await service.download_file("path/to/file.csv")
 
-        # Create a large content (10MB)
-        large_content = b"x" * (10 * 1024 * 1024)
-
-        # The method should handle large content
-        # In real tests, we'd use pytest.mark.asyncio
-        assert len(large_content) == 10 * 1024 * 1024
+        assert upload["success"] is True
+        assert content == b"test content"
@@ -0,0 +1,42 @@
+"""
+Tests for cached static file serving.
+"""
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from app.core.static_files import CachedStaticFiles, IMMUTABLE_CACHE_CONTROL
+
+
+class TestCachedStaticFiles:
+    """Test cases for CachedStaticFiles."""
+
+    def _client(self, tmp_path):
+        (tmp_path / "site.css").write_text("body {}")
+        (tmp_path / "app.3f9a1c2b.js").write_text("void 0;")
+        app = Starlette()
+        app.mount("/static", CachedStaticFiles(directory=str(tmp_path), max_age=600))
+        return TestClient(app)
+
+    def test_plain_file_uses_max_age(self, tmp_path):
+        """Test unhashed files are cached for the configured max age."""
+        response = self._client(tmp_path).get("/static/site.css")
+
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "public, max-age=600"
+        assert "etag" in response.headers
+
+    def test_hashed_file_is_immutable(self, tmp_path):
+        """Test content-hashed files are cached as immutable."""
+        response = self._client(tmp_path).get("/static/app.3f9a1c2b.js")
+
+        assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+    def test_revalidation_returns_not_modified(self, tmp_path):
+        """Test a matching ETag is answered with 304 and keeps the cache header."""
+        client = self._client(tmp_path)
+        etag = client.get("/static/site.css").headers["etag"]
+
+        response = client.get("/static/site.css", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.headers["cache-control"] == "public, max-age=600"